@@ -0,0 +1,126 @@
+#####################################################################
+# Call:
+# python benchmarks/bench_extract.py [objects]
+#
+# Micro-benchmark of the field extraction of trails: the former
+# try/except KeyError ladder (every field walked from the document
+# root) against the compiled oa_schema.TRAIL extractor, per document
+# and over a batch of documents.
+#
+#####################################################################
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import oa_fetch
+import oa_schema
+import xmltodict
+import fixtures
+
+PARAMS = {"lang": "en", "region": "0", "project": "bench"}
+
+
+#
+# Extraction as done by read_trail_data() before oa_schema
+#
+def legacy_extract_trail(trail_id, trail_xml):
+    data = {}
+    for name, keys, default in [
+        ("name", ["title"], ""),
+        ("distance", ["length"], 0),
+        ("duration", ["time", "@min"], 0),
+        ("ranking", ["@ranking"], 0),
+        ("author", ["meta", "authorFull", "name"], ""),
+        ("author_id", ["meta", "authorFull", "id"], 0),
+        ("difficulty", ["rating", "@difficulty"], 0),
+        ("category", ["category", "@id"], 0),
+        ("date_created", ["meta", "date", "@created"], ""),
+        ("date_lastModified", ["meta", "date", "@lastModified"], ""),
+        ("date_firstPublish", ["meta", "date", "@firstPublish"], ""),
+        ("primaryImage", ["primaryImage", "@id"], ""),
+    ]:
+        try:
+            value = trail_xml["oois"]["tour"]
+            for key in keys:
+                value = value[key]
+        except KeyError:
+            value = default
+        data[name] = value
+    lang = PARAMS["lang"]
+    try:
+        if isinstance(trail_xml["oois"]["tour"]["localizedTitle"], list):
+            lang = trail_xml["oois"]["tour"]["localizedTitle"][0]["@lang"]
+        else:
+            lang = trail_xml["oois"]["tour"]["localizedTitle"]["@lang"]
+    except KeyError:
+        pass
+    region_name = ""
+    district_name = ""
+    customarea = ""
+    if trail_xml["oois"]["tour"]["regions"] is not None:
+        try:
+            if isinstance(trail_xml["oois"]["tour"]["regions"]["region"], list):
+                for region in trail_xml["oois"]["tour"]["regions"]["region"]:
+                    if region["@type"] == "tourismarea":
+                        region_name = region_name + " " + region["@name"]
+                    if region["@type"] == "customarea":
+                        customarea = customarea + " " + region["@id"]
+                    if region["@type"] == "district":
+                        district_name = district_name + " " + region["@id"]
+        except KeyError:
+            pass
+    data.update(
+        {
+            "lang": lang,
+            "trail_id": trail_id,
+            "region": PARAMS["region"],
+            "region_name": region_name.strip(),
+            "district_name": district_name.strip(),
+            "customarea": customarea.strip(),
+            "project": PARAMS["project"],
+        }
+    )
+    return data
+
+
+def timed(label, count, function):
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    print(
+        "%-28s %10.3f s %12.0f objects/s %8.2f us/object"
+        % (label, elapsed, count / elapsed, elapsed / count * 1e6)
+    )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    document = xmltodict.parse(fixtures.oois(range(count)))
+    documents = list(oa_fetch.split_oois(document, "tour").items())
+    print("Extracting %d trails" % count)
+
+    def legacy():
+        for trail_id, trail_xml in documents:
+            legacy_extract_trail(trail_id, trail_xml)
+
+    def schema():
+        for trail_id, trail_xml in documents:
+            oa_schema.TRAIL.extract_document(
+                trail_xml, dict(PARAMS, object_id=trail_id)
+            )
+
+    def schema_batch():
+        oa_schema.TRAIL.extract_many(
+            [document], lambda object_id: dict(PARAMS, object_id=object_id)
+        )
+
+    timed("legacy KeyError ladder", count, legacy)
+    timed("schema, per document", count, schema)
+    timed("schema, batch of documents", count, schema_batch)
+
+
+if __name__ == "__main__":
+    main()
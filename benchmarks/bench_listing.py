@@ -0,0 +1,74 @@
+#####################################################################
+# Call:
+# python benchmarks/bench_listing.py [listing_size]
+#
+# Memory of the listing at region=0 scale: the parsed xmltodict tree
+# (one dict per <data> element), the entry dicts of the streaming
+# parser and the compact oa_listing.Listing built from either parser.
+# Reports the parse time, the peak memory while parsing and the memory
+# still held by the result (tracemalloc).
+#
+#####################################################################
+
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import oa_listing
+import oa_stream
+import xmltodict
+import fixtures
+
+VARIANTS = [
+    ("xmltodict tree", lambda data: xmltodict.parse(data)),
+    (
+        "xmltodict entries",
+        lambda data: oa_stream.read_listing(data, oa_stream.MODE_XMLTODICT),
+    ),
+    ("stream entries", lambda data: list(oa_stream.iter_listing(data))),
+    (
+        "Listing, xmltodict",
+        lambda data: oa_listing.read(data, oa_stream.MODE_XMLTODICT),
+    ),
+    ("Listing, stream", lambda data: oa_listing.read(data, oa_stream.MODE_STREAM)),
+]
+
+
+#
+# Seconds, peak bytes while building and bytes held by the result
+#
+def measure(build, data):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build(data)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return elapsed, peak, held
+
+
+def main():
+    listing_size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    data = fixtures.listing(listing_size)
+    print("Listing: %d entries (%.1f MB)" % (listing_size, len(data) / 1e6))
+    print(
+        "%-20s %10s %12s %12s %14s"
+        % ("variant", "seconds", "peak MB", "held MB", "held B/object")
+    )
+    for name, build in VARIANTS:
+        elapsed, peak, held = measure(build, data)
+        print(
+            "%-20s %10.3f %12.1f %12.1f %14.1f"
+            % (name, elapsed, peak / 1e6, held / 1e6, held / listing_size)
+        )
+
+
+if __name__ == "__main__":
+    main()
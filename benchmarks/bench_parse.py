@@ -0,0 +1,85 @@
+#####################################################################
+# Call:
+# python benchmarks/bench_parse.py [listing_size] [documents]
+#
+# Compares the xmltodict and the streaming (oa_stream) parser on a
+# synthetic region=0 size listing and on /oois detail documents:
+# wall time and peak memory (tracemalloc) per parser mode.
+#
+#####################################################################
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import oa_fetch
+import oa_stream
+import xmltodict
+import fixtures
+
+
+def measure(function):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def listing_ids(data, mode):
+    if mode == oa_stream.MODE_STREAM:
+        return [entry["@id"] for entry in oa_stream.iter_listing(data)]
+    return [entry["@id"] for entry in oa_stream.read_listing(data, mode)]
+
+
+def split_documents(documents, mode):
+    count = 0
+    for document in documents:
+        if mode == oa_stream.MODE_STREAM:
+            count = count + len(oa_stream.split_oois(document, "tour"))
+        else:
+            count = count + len(oa_fetch.split_oois(xmltodict.parse(document), "tour"))
+    return count
+
+
+def main():
+    listing_size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    documents = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    listing = fixtures.listing(listing_size)
+    # 20 objects per /oois document, as with [Fetch] BatchSize=20
+    details = [fixtures.oois(range(i, i + 20), seed=i) for i in range(0, documents, 20)]
+    print(
+        "Listing: %d entries (%.1f MB), details: %d objects in %d documents (%.1f MB)"
+        % (
+            listing_size,
+            len(listing) / 1e6,
+            documents,
+            len(details),
+            sum(len(d) for d in details) / 1e6,
+        )
+    )
+    print(
+        "%-10s %-10s %10s %12s %12s"
+        % ("stage", "parser", "seconds", "objects/s", "peak MB")
+    )
+    for mode in [oa_stream.MODE_XMLTODICT, oa_stream.MODE_STREAM]:
+        ids, elapsed, peak = measure(lambda: listing_ids(listing, mode))
+        print(
+            "%-10s %-10s %10.3f %12.0f %12.1f"
+            % ("listing", mode, elapsed, len(ids) / elapsed, peak / 1e6)
+        )
+    for mode in [oa_stream.MODE_XMLTODICT, oa_stream.MODE_STREAM]:
+        count, elapsed, peak = measure(lambda: split_documents(details, mode))
+        print(
+            "%-10s %-10s %10.3f %12.0f %12.1f"
+            % ("details", mode, elapsed, count / elapsed, peak / 1e6)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,439 @@
+#####################################################################
+# Call:
+# python benchmarks/bench_suite.py [--sizes 1000,10000,100000]
+#                                  [--stages listing,parse,...]
+#                                  [--output results.json] [--compare old.json]
+#
+# Benchmark suite of the sync stages, on the documents of fixtures.py
+# and the local stand-in servers (stand_in.py):
+#   listing  - listing parse, per parser mode
+#   parse    - /oois detail documents (20 objects each), per parser mode
+#   extract  - field extraction of the trails (oa_schema)
+#   pool     - parse and extraction of the /oois documents in this
+#              process and in a pool of --processes worker processes
+#              ([Fetch] Processes), throughput should grow with the cores
+#   diff     - existence diff of the Trails entity against a table holding
+#              half of the listed trails, [Sync] Mode New and Delta
+#   write    - chunked upserts into Trails: SQLite backend and the
+#              PostgREST stand-in through the supabase client
+#   e2e      - sync_engine run against both stand-ins in a separate
+#              process (first run and an unchanged rerun)
+# For every stage and size the throughput (objects/s) and the peak memory
+# (tracemalloc, for e2e the peak RSS of the process) are reported.
+# The results are saved as JSON; --compare prints the change against the
+# results of an earlier release.
+#
+#####################################################################
+
+import argparse
+import configparser
+import contextlib
+import datetime
+import importlib.util
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS, ".."))
+
+import oa_listing
+import oa_schema
+import oa_storage
+import oa_stream
+import oa_fetch
+import supabase_bulk
+import sync_engine
+import bench_parse
+import fixtures
+import stand_in
+
+STAGES = ["listing", "parse", "extract", "pool", "diff", "write", "e2e"]
+SIZES = [1000, 10000, 100000]
+OUTPUT = "bench_results.json"
+# Objects per /oois document, as with [Fetch] BatchSize=20
+BATCH_SIZE = 20
+PROJECT = "bench"
+
+
+#
+# Wall time of function, and its peak memory in a second, traced call
+# Returns (result, seconds, peak bytes or None)
+#
+def measure(function, memory=True):
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    peak = None
+    if memory:
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def result(stage, variant, objects, elapsed, peak, **extra):
+    row = {
+        "stage": stage,
+        "variant": variant,
+        "objects": objects,
+        "seconds": round(elapsed, 4),
+        "per_second": round(objects / elapsed, 1) if elapsed else None,
+        "peak_bytes": peak,
+    }
+    row.update(extra)
+    return row
+
+
+def details(size):
+    return [
+        fixtures.oois(range(i, min(i + BATCH_SIZE, size)), seed=i)
+        for i in range(0, size, BATCH_SIZE)
+    ]
+
+
+def bench_listing(size, options):
+    listing = fixtures.listing(size)
+    for mode in [oa_stream.MODE_XMLTODICT, oa_stream.MODE_STREAM]:
+        ids, elapsed, peak = measure(
+            lambda: bench_parse.listing_ids(listing, mode), options.memory
+        )
+        yield result("listing", mode, len(ids), elapsed, peak)
+
+
+def bench_parse_details(size, options):
+    documents = details(size)
+    for mode in [oa_stream.MODE_XMLTODICT, oa_stream.MODE_STREAM]:
+        count, elapsed, peak = measure(
+            lambda: bench_parse.split_documents(documents, mode), options.memory
+        )
+        yield result("parse", mode, count, elapsed, peak)
+
+
+def bench_extract(size, options):
+    documents = {}
+    for document in details(size):
+        documents.update(oa_stream.split_oois(document, "tour"))
+    params = {"lang": "en", "region": "0", "project": PROJECT}
+
+    def extract():
+        return [
+            oa_schema.TRAIL.extract_document(
+                document, dict(params, object_id=object_id)
+            )
+            for object_id, document in documents.items()
+        ]
+
+    rows, elapsed, peak = measure(extract, options.memory)
+    yield result("extract", "trails", len(rows), elapsed, peak)
+
+
+def parse_extract(documents, pool=None):
+    params = {"lang": "en", "region": "0", "project": PROJECT}
+    count = 0
+    results = []
+    for i, document in enumerate(documents):
+        ids = range(i * BATCH_SIZE, (i + 1) * BATCH_SIZE)
+        batch_params = {str(j): dict(params, object_id=str(j)) for j in ids}
+        args = (document, "tour", oa_stream.MODE_XMLTODICT, batch_params)
+        if pool is None:
+            count = count + len(oa_fetch.parse_batch(*args))
+        else:
+            results.append(pool.submit(oa_fetch.parse_batch, *args))
+    for result in results:
+        count = count + len(result.result())
+    return count
+
+
+def bench_pool(size, options):
+    documents = details(size)
+    count, elapsed, peak = measure(lambda: parse_extract(documents), options.memory)
+    yield result("pool", "in process", count, elapsed, peak)
+    pool = oa_fetch.create_pool(options.processes)
+    # Start the workers before timing
+    list(pool.map(abs, range(options.processes)))
+    count, elapsed, peak = measure(
+        lambda: parse_extract(documents, pool), options.memory
+    )
+    pool.shutdown()
+    yield result("pool", "%d processes" % options.processes, count, elapsed, peak)
+
+
+def trail_rows(size):
+    rows = []
+    for i in range(size):
+        rows.append(
+            {
+                "trail_id": str(1000000 + i),
+                "project": PROJECT,
+                "region": "0",
+                "distance": 1000.0 + i % 100,
+                "duration": 60 + i % 30,
+                "region_name": "Carpathians",
+                "date_lastModified": "2023-05-01T08:00:00+00:00",
+                "new": False,
+            }
+        )
+    return rows
+
+
+def bench_config(directory, **sections):
+    config = configparser.ConfigParser()
+    config.read_dict(
+        {
+            "Log": {"File": os.path.join(directory, "sync.log"), "Level": "WARNING"},
+            "Action": {"Execute": "Now"},
+            "Fetch": {"BatchSize": str(BATCH_SIZE)},
+            "Interface": {
+                "OUTDOORACTIVE_PROJECT": PROJECT,
+                "OUTDOORACTIVE_API": "bench",
+                "OUTDOORACTIVE_LANGUAGE": "en",
+                "SUPABASE_URL": "http://127.0.0.1:1",
+                "SUPABASE_KEY": "stand-in",
+            },
+        }
+    )
+    config.read_dict(sections)
+    return config
+
+
+def bench_diff(size, options):
+    listing = oa_listing.read(fixtures.listing(size), oa_stream.MODE_STREAM)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        client = oa_storage.SQLiteClient(path)
+        client.table("Trails").insert(trail_rows(size // 2)).execute()
+        client.db.close()
+        for mode in ["New", "Delta"]:
+            config = bench_config(
+                directory,
+                Storage={"Backend": "sqlite", "Path": path},
+                Sync={"Mode": mode},
+            )
+            engine = sync_engine.Engine(config)
+
+            def diff():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    return sync_engine.Trails(engine).diff(listing)
+
+            pending, elapsed, peak = measure(diff, options.memory)
+            engine.client.db.close()
+            yield result("diff", mode, size, elapsed, peak, pending=len(pending))
+
+
+def write_rows(client, rows):
+    writer = supabase_bulk.UpsertWriter(client, "Trails", "trail_id,project")
+    with contextlib.redirect_stdout(io.StringIO()):
+        for row in rows:
+            writer.add(row)
+        writer.close()
+    return writer.written
+
+
+def bench_write(size, options):
+    rows = trail_rows(size)
+    with tempfile.TemporaryDirectory() as directory:
+        client = oa_storage.SQLiteClient(os.path.join(directory, "bench.db"))
+        written, elapsed, peak = measure(
+            lambda: write_rows(client, rows), options.memory
+        )
+        client.db.close()
+        yield result("write", "sqlite", written, elapsed, peak)
+    try:
+        import supabase
+    except ImportError:
+        return
+    rest = stand_in.start(stand_in.RestServer(("127.0.0.1", 0)))
+    client = supabase.create_client(stand_in.url(rest), "stand-in")
+    written, elapsed, peak = measure(lambda: write_rows(client, rows), options.memory)
+    rest.shutdown()
+    rest.server_close()
+    yield result("write", "postgrest", written, elapsed, peak)
+
+
+#
+# sync_engine run in a child process, the stand-ins serve from this one
+#
+def bench_e2e(size, options):
+    if importlib.util.find_spec("supabase") is not None:
+        backend = "supabase"
+    else:
+        backend = "sqlite"
+    oa = stand_in.start(
+        stand_in.OAServer(
+            ("127.0.0.1", 0),
+            {
+                "counts": {path: size for path in stand_in.LISTINGS},
+                "latency": options.latency,
+            },
+        )
+    )
+    rest = stand_in.start(stand_in.RestServer(("127.0.0.1", 0)))
+    with tempfile.TemporaryDirectory() as directory:
+        config = bench_config(
+            directory,
+            Interface={
+                "OUTDOORACTIVE_URL": stand_in.url(oa) + "/api/project/",
+                "SUPABASE_URL": stand_in.url(rest),
+            },
+            Storage={
+                "Backend": backend,
+                "Path": os.path.join(directory, "bench.db"),
+            },
+        )
+        config_file = os.path.join(directory, "config.ini")
+        with open(config_file, "w") as f:
+            config.write(f)
+        for variant in ["first", "rerun"]:
+            report = os.path.join(directory, "report.json")
+            start = time.perf_counter()
+            subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", config_file]
+                + [report]
+                + options.entities,
+                stdout=subprocess.DEVNULL,
+                check=True,
+            )
+            elapsed = time.perf_counter() - start
+            with open(report) as f:
+                child = json.load(f)
+            yield result(
+                "e2e",
+                "%s %s" % (backend, variant),
+                size * len(options.entities),
+                elapsed,
+                child["peak_rss"],
+                requests=sum(oa.stats.values()),
+            )
+            oa.stats = {}
+    for server in [oa, rest]:
+        server.shutdown()
+        server.server_close()
+
+
+BENCHMARKS_BY_STAGE = {
+    "listing": bench_listing,
+    "parse": bench_parse_details,
+    "extract": bench_extract,
+    "pool": bench_pool,
+    "diff": bench_diff,
+    "write": bench_write,
+    "e2e": bench_e2e,
+}
+
+
+#
+# Child of bench_e2e: run the engine, report the peak memory
+#
+def child(config_file, report, entities):
+    sys.argv = [sys.argv[0], config_file] + entities
+    sync_engine.main()
+    try:
+        import resource
+
+        # kilobytes on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        peak = None
+    with open(report, "w") as f:
+        json.dump({"peak_rss": peak}, f)
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BENCHMARKS,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+def print_row(row, previous=None):
+    line = "%-8s %-16s %8d %10.3f %12s %10s" % (
+        row["stage"],
+        row["variant"],
+        row["objects"],
+        row["seconds"],
+        "%.0f" % row["per_second"] if row["per_second"] else "-",
+        "%.1f" % (row["peak_bytes"] / 1e6) if row["peak_bytes"] else "-",
+    )
+    if previous and previous.get("per_second") and row["per_second"]:
+        line = line + " %+7.1f%%" % (
+            (row["per_second"] / previous["per_second"] - 1) * 100
+        )
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the sync stages")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in SIZES))
+    parser.add_argument("--stages", default=",".join(STAGES))
+    parser.add_argument("--entities", default="trails", help="entities of the e2e runs")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="stand-in ms per request"
+    )
+    parser.add_argument(
+        "--processes", type=int, default=os.cpu_count() or 1, help="pool stage"
+    )
+    parser.add_argument("--no-memory", dest="memory", action="store_false")
+    parser.add_argument("--output", default=OUTPUT)
+    parser.add_argument("--compare", help="results of an earlier run")
+    parser.add_argument("--child", nargs="+", help=argparse.SUPPRESS)
+    options = parser.parse_args()
+    if options.child:
+        return child(options.child[0], options.child[1], options.child[2:])
+    options.entities = options.entities.split(",")
+    sizes = [int(size) for size in options.sizes.split(",")]
+    stages = options.stages.split(",")
+    for stage in stages:
+        if stage not in BENCHMARKS_BY_STAGE:
+            print("Unknown stage %s, use one of: %s" % (stage, ", ".join(STAGES)))
+            sys.exit(1)
+
+    previous = {}
+    if options.compare:
+        with open(options.compare) as f:
+            for row in json.load(f)["results"]:
+                previous[(row["stage"], row["variant"], row["objects"])] = row
+
+    print(
+        "%-8s %-16s %8s %10s %12s %10s"
+        % ("stage", "variant", "objects", "seconds", "objects/s", "peak MB")
+    )
+    results = []
+    for size in sizes:
+        for stage in stages:
+            for row in BENCHMARKS_BY_STAGE[stage](size, options):
+                row["size"] = size
+                results.append(row)
+                print_row(
+                    row, previous.get((row["stage"], row["variant"], row["objects"]))
+                )
+
+    with open(options.output, "w") as f:
+        json.dump(
+            {
+                "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+                "commit": commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print("Results saved in %s" % options.output)
+
+
+if __name__ == "__main__":
+    main()
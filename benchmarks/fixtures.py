@@ -0,0 +1,79 @@
+#####################################################################
+# Synthetic Outdooractive responses for the benchmarks
+#
+# The documents follow the layout of the Data API answers the scripts
+# read (listing: <datalist><data id=".."/>, details: <oois><tour ..>)
+#
+#####################################################################
+
+import random
+
+NAMESPACE = "http://www.outdooractive.com/api/schema/alp.interface"
+VALID_TO = "2099-12-31"
+
+
+def listing(count, kind="tour", first_id=1000000):
+    entries = "".join(
+        '<data id="%d" type="%s" lastModified="2023-05-01T10:00:00.000+02:00"/>'
+        % (first_id + i, kind)
+        for i in range(count)
+    )
+    return ('<datalist xmlns="%s">%s</datalist>' % (NAMESPACE, entries)).encode()
+
+
+def tour(object_id, rng=random):
+    return (
+        '<tour id="%d" ranking="%d">'
+        "<title>Trail %d</title>"
+        '<localizedTitle lang="ro">Traseu %d</localizedTitle>'
+        '<localizedTitle lang="en">Trail %d</localizedTitle>'
+        '<category id="%d" name="Hiking trail"><datatype>tour</datatype></category>'
+        "<regions>"
+        '<region type="tourismarea" id="1" name="Carpathians"/>'
+        '<region type="district" id="%d" name="District"/>'
+        '<region type="customarea" id="%d" name="Area"/>'
+        "</regions>"
+        '<time min="%d"/><length>%.1f</length>'
+        '<rating difficulty="%d"/>'
+        "<meta><authorFull><id>%d</id><name>Author %d</name></authorFull>"
+        '<date created="2020-01-01T10:00:00.000+01:00"'
+        ' lastModified="2023-05-01T10:00:00.000+02:00"'
+        ' firstPublish="2020-01-02T10:00:00.000+01:00"/>'
+        '<workflow state="published"/></meta>'
+        '<primaryImage id="%d"/>'
+        "<longText>%s</longText>"
+        "</tour>"
+        % (
+            object_id,
+            rng.randint(0, 100),
+            object_id,
+            object_id,
+            object_id,
+            rng.randint(1, 30),
+            rng.randint(1, 42),
+            rng.randint(1, 500),
+            rng.randint(30, 1500),
+            rng.uniform(500, 40000),
+            rng.randint(1, 3),
+            rng.randint(1, 200),
+            rng.randint(1, 200),
+            object_id + 1,
+            "Lorem ipsum dolor sit amet. " * 20,
+        )
+    )
+
+
+def oois(object_ids, kind="tour", seed=1):
+    rng = random.Random(seed)
+    objects = "".join(tour(object_id, rng) for object_id in object_ids)
+    if kind != "tour":
+        objects = objects.replace("<tour ", "<%s " % kind).replace(
+            "</tour>", "</%s>" % kind
+        )
+    if kind == "condition":
+        # Conditions carry their validity period
+        objects = objects.replace(
+            "<condition ",
+            '<condition dateFrom="2023-05-01" validTo="%s" ' % VALID_TO,
+        )
+    return ('<oois xmlns="%s">%s</oois>' % (NAMESPACE, objects)).encode()
@@ -0,0 +1,431 @@
+#####################################################################
+# Stand-in servers for benchmark runs
+#
+# OAServer answers the Outdooractive Data API requests of the scripts
+#   /api/project/<project>/filter/tour, pois, events, conditions
+#   /api/project/<project>/oois/<id>,<id>,...
+# with the documents of fixtures.py (or recorded ones, see --recorded),
+# with configurable latency, error rate and 429 (throttling) behaviour.
+# A listing with &area=N (N > 0) is the window of the listing shifted by
+# (N - 1) * region_shift objects, so neighbouring regions overlap.
+# RestServer is a PostgREST compatible endpoint for the supabase client
+#   /rest/v1/<table>            GET, POST (insert/upsert), PATCH, DELETE
+#   /rest/v1/rpc/<function>     POST
+# storing the tables with oa_storage.SQLiteClient (in memory by default).
+#
+# The scripts are pointed to the servers in the [Interface] section:
+#   OUTDOORACTIVE_URL=http://127.0.0.1:8081/api/project/
+#   SUPABASE_URL=http://127.0.0.1:8082
+#   SUPABASE_KEY=stand-in
+#
+# Call:
+# python benchmarks/stand_in.py [--trails N] [--latency MS] [--errors P]
+#                               [--throttle P] [--rate-limit N] ...
+#   serves until Ctrl+C and prints the request counts
+#
+# Recorded documents (--recorded DIR) replace the synthetic ones:
+#   DIR/filter_tour.xml, DIR/pois.xml, ...   listings
+#   DIR/oois/<id>.xml                        <oois> document of one object
+#
+#####################################################################
+# Version: 0.1.0
+# Email: paul.wasicsek@gmail.com
+# Status: dev
+#####################################################################
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import fixtures
+import oa_storage
+
+# Listing path -> (element name, first object ID)
+# The objects of a kind get IDs first_id, first_id + 1, ... so the kind of
+# an /oois request follows from its IDs
+LISTINGS = {
+    "filter/tour": ("tour", 1000000),
+    "pois": ("poi", 2000000),
+    "events": ("event", 3000000),
+    "conditions": ("condition", 4000000),
+}
+KIND_RANGE = 1000000
+
+OA_SETTINGS = {
+    # Objects per listing
+    "counts": {"filter/tour": 1000, "pois": 1000, "events": 1000, "conditions": 100},
+    # Milliseconds per request and per object of an /oois request
+    "latency": 0.0,
+    "object_latency": 0.0,
+    # Share of requests answered with error_status
+    "errors": 0.0,
+    "error_status": 500,
+    # Share of requests answered with 429, and requests per second above
+    # which every request is answered with 429
+    "throttle": 0.0,
+    "rate_limit": 0,
+    "retry_after": 1,
+    "recorded": None,
+    "seed": 1,
+    # Share of a listing between the first objects of two neighbouring areas
+    "region_shift": 0.5,
+}
+
+# Query parameters of PostgREST that are no filters
+REST_PARAMETERS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+REST_OPERATORS = {"eq", "neq", "gt", "gte", "lt", "lte", "in", "is"}
+
+
+class OAServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, settings=None):
+        super().__init__(address, OAHandler)
+        self.settings = dict(OA_SETTINGS, **(settings or {}))
+        self.random = random.Random(self.settings["seed"])
+        self.lock = threading.Lock()
+        self.listings = {}
+        self.window = (0, 0)
+        # Answered requests by endpoint and status
+        self.stats = {}
+
+    def count(self, endpoint, status):
+        with self.lock:
+            key = "%s %d" % (endpoint, status)
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    #
+    # Status of the next answer (200, error_status or 429)
+    #
+    def decide(self):
+        settings = self.settings
+        with self.lock:
+            draw = self.random.random()
+            if settings["rate_limit"]:
+                second = int(time.time())
+                start, requests = self.window
+                if start != second:
+                    start, requests = second, 0
+                self.window = (start, requests + 1)
+                if requests >= settings["rate_limit"]:
+                    return 429
+        if draw < settings["throttle"]:
+            return 429
+        if draw < settings["throttle"] + settings["errors"]:
+            return settings["error_status"]
+        return 200
+
+    def listing(self, path, area=0):
+        with self.lock:
+            if (path, area) not in self.listings:
+                kind, first_id = LISTINGS[path]
+                count = self.settings["counts"][path]
+                recorded = self.recorded(path.replace("/", "_") + ".xml")
+                if recorded is None:
+                    if area > 0:
+                        shift = int(count * self.settings["region_shift"])
+                        first_id = first_id + (area - 1) * shift
+                    recorded = fixtures.listing(count, kind, first_id)
+                self.listings[(path, area)] = recorded
+            return self.listings[(path, area)]
+
+    #
+    # <oois> document of the given IDs
+    #
+    def details(self, object_ids):
+        objects = []
+        for object_id in object_ids:
+            recorded = self.recorded(os.path.join("oois", "%d.xml" % object_id))
+            if recorded is None:
+                kind = kind_of(object_id)
+                if kind is None:
+                    continue
+                # Seeded by the ID, an object is the same in every batch
+                recorded = fixtures.oois([object_id], kind, seed=object_id)
+            objects.append(inner(recorded))
+        return b'<oois xmlns="%s">%s</oois>' % (
+            fixtures.NAMESPACE.encode(),
+            b"".join(objects),
+        )
+
+    def recorded(self, name):
+        if not self.settings["recorded"]:
+            return None
+        try:
+            with open(os.path.join(self.settings["recorded"], name), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+
+def kind_of(object_id):
+    for kind, first_id in LISTINGS.values():
+        if first_id <= object_id < first_id + KIND_RANGE:
+            return kind
+    return None
+
+
+#
+# Content of the root element of an XML document
+#
+def inner(document):
+    match = re.search(rb"<oois[^>]*>(.*)</oois>", document, re.S)
+    return match.group(1) if match else b""
+
+
+class OAHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        settings = server.settings
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        # api/project/<project>/<endpoint>
+        path = "/".join(parts[3:])
+        if parts[:2] != ["api", "project"] or len(parts) < 4:
+            return self.answer(404, b"Not found", "unknown")
+        object_ids = []
+        if path.startswith("oois/"):
+            endpoint = "oois"
+            try:
+                object_ids = [int(i) for i in unquote(parts[4]).split(",") if i]
+            except (IndexError, ValueError):
+                return self.answer(400, b"Bad object IDs", endpoint)
+        elif path in LISTINGS:
+            endpoint = path
+        else:
+            return self.answer(404, b"Not found", "unknown")
+
+        delay = settings["latency"] + settings["object_latency"] * len(object_ids)
+        if delay:
+            time.sleep(delay / 1000)
+        status = server.decide()
+        if status == 429:
+            return self.answer(
+                429,
+                b"Too many requests",
+                endpoint,
+                {"Retry-After": str(settings["retry_after"])},
+            )
+        if status != 200:
+            return self.answer(status, b"Server error", endpoint)
+        if endpoint == "oois":
+            body = server.details(object_ids)
+        else:
+            try:
+                area = int(dict(parse_qsl(url.query)).get("area", 0))
+            except ValueError:
+                area = 0
+            body = server.listing(path, area)
+        self.answer(200, body, endpoint, {"Content-Type": "application/xml"})
+
+    def answer(self, status, body, endpoint, headers=None):
+        self.server.count(endpoint, status)
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RestServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, path=":memory:"):
+        super().__init__(address, RestHandler)
+        self.client = oa_storage.SQLiteClient(path)
+
+
+#
+# PostgREST filter value (eq.5, in.(1,2), is.null) as (operator, value)
+#
+def parse_filter(value):
+    operator, _, operand = value.partition(".")
+    if operator not in REST_OPERATORS:
+        raise ValueError("Unsupported filter %s" % value)
+    if operator == "in":
+        operand = [v.strip().strip('"') for v in operand.strip("()").split(",")]
+    return operator, operand
+
+
+class RestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_PATCH(self):
+        self.handle_request("PATCH")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+    def handle_request(self, method):
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or "null") if length else None
+        try:
+            if parts[:2] != ["rest", "v1"] or len(parts) < 3:
+                return self.answer(404, {"message": "Not found"})
+            client = self.server.client
+            if parts[2] == "rpc" and len(parts) == 4 and method == "POST":
+                data = client.rpc(unquote(parts[3]), body or {}).execute().data
+                return self.answer(200, data)
+            query = self.build(client.table(unquote(parts[2])), method, url, body)
+            data = query.execute().data
+        except Exception as e:
+            return self.answer(400, {"message": str(e), "code": "PGRST000"})
+        if "return=minimal" in self.headers.get("Prefer", ""):
+            return self.answer(204 if method != "POST" else 201, None)
+        self.answer(201 if method == "POST" else 200, data)
+
+    #
+    # Query builder call of the request
+    #
+    def build(self, query, method, url, body):
+        params = parse_qsl(url.query, keep_blank_values=True)
+        options = dict(params)
+        if method == "POST":
+            if "resolution=merge-duplicates" in self.headers.get("Prefer", ""):
+                query = query.upsert(body, on_conflict=options.get("on_conflict"))
+            else:
+                query = query.insert(body)
+        elif method == "PATCH":
+            query = query.update(body)
+        elif method == "DELETE":
+            query = query.delete()
+        else:
+            query = query.select(options.get("select", "*"))
+        for column, value in params:
+            if column in REST_PARAMETERS:
+                continue
+            operator, operand = parse_filter(value)
+            if operator == "in":
+                query = query.in_(column, operand)
+            elif operator == "is":
+                query = query.is_(column, operand)
+            else:
+                query = getattr(query, operator)(column, operand)
+        for order in filter(None, options.get("order", "").split(",")):
+            column, _, direction = order.partition(".")
+            query = query.order(column, desc=direction.startswith("desc"))
+        if "limit" in options:
+            query = query.limit(int(options["limit"]))
+        return query
+
+    def answer(self, status, data):
+        body = b"" if data is None else json.dumps(data, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+#
+# Serve in a background thread, returns the server (shutdown() to stop)
+#
+def start(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def url(server):
+    host, port = server.server_address[:2]
+    return "http://%s:%d" % (host, port)
+
+
+def print_stats(server):
+    for key, count in sorted(server.stats.items()):
+        print("  %-20s %d" % (key, count))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Outdooractive and PostgREST stand-in servers"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--oa-port", type=int, default=8081)
+    parser.add_argument("--rest-port", type=int, default=8082)
+    parser.add_argument("--trails", type=int, default=1000)
+    parser.add_argument("--pois", type=int, default=1000)
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument("--conditions", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.0, help="ms per request")
+    parser.add_argument(
+        "--object-latency", type=float, default=0.0, help="ms per object of /oois"
+    )
+    parser.add_argument("--errors", type=float, default=0.0, help="share of errors")
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--throttle", type=float, default=0.0, help="share of 429s")
+    parser.add_argument("--rate-limit", type=int, default=0, help="requests/second")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument(
+        "--region-shift", type=float, default=0.5, help="listing share between areas"
+    )
+    parser.add_argument("--recorded", help="directory of recorded documents")
+    parser.add_argument("--database", default=":memory:", help="SQLite file")
+    args = parser.parse_args()
+
+    oa = OAServer(
+        (args.host, args.oa_port),
+        {
+            "counts": {
+                "filter/tour": args.trails,
+                "pois": args.pois,
+                "events": args.events,
+                "conditions": args.conditions,
+            },
+            "latency": args.latency,
+            "object_latency": args.object_latency,
+            "errors": args.errors,
+            "error_status": args.error_status,
+            "throttle": args.throttle,
+            "rate_limit": args.rate_limit,
+            "retry_after": args.retry_after,
+            "recorded": args.recorded,
+            "region_shift": args.region_shift,
+        },
+    )
+    rest = RestServer((args.host, args.rest_port), args.database)
+    start(oa)
+    start(rest)
+    print("[Interface]")
+    print("OUTDOORACTIVE_URL=%s/api/project/" % url(oa))
+    print("SUPABASE_URL=%s" % url(rest))
+    print("SUPABASE_KEY=stand-in")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    oa.shutdown()
+    rest.shutdown()
+    print("Outdooractive requests:")
+    print_stats(oa)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+#####################################################################
+# Persistent response cache for the Outdooractive API
+#
+# CachedSession is a requests.Session that keeps GET responses on disk,
+# shared by all scripts that point to the same [Cache] Path:
+#   - bodies are stored content-addressed (sha256 of the body), the
+#     index (URL -> body, ETag, Last-Modified, age) is a SQLite file
+#   - a response younger than the TTL of its endpoint is served from
+#     disk, an older one is revalidated with If-None-Match /
+#     If-Modified-Since, so an unchanged document costs a 304
+#   - the cache is kept below MaxSize by evicting the least recently
+#     used entries
+# The API key is removed from the URL before it is used as cache key.
+#
+# Call:
+# python oa_cache.py <ini_file.ini>
+#   prints size and content of the cache
+#
+#####################################################################
+# Version: 0.1.0
+# Email: paul.wasicsek@gmail.com
+# Status: dev
+#####################################################################
+
+import configparser
+import hashlib
+import logging as log
+import os
+import sqlite3
+import sys
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import requests
+
+CACHE_PATH = ".oa_cache"
+# Bytes
+MAX_SIZE = 512 * 1024 * 1024
+# Seconds a response is used without asking the API again, per endpoint
+TTL = {
+    "oois": 24 * 3600,
+    "filter": 3600,
+    "pois": 3600,
+    "events": 3600,
+    "conditions": 600,
+}
+DEFAULT_TTL = 3600
+
+
+#
+# Read the [Cache] section of config.ini
+# TTL is a list of endpoint:seconds, e.g. TTL=oois:86400, conditions:600
+#
+def read_settings(config):
+    settings = {"enabled": False, "path": CACHE_PATH, "max_size": MAX_SIZE, "ttl": TTL}
+    if not config.has_section("Cache"):
+        return settings
+    settings["enabled"] = config["Cache"].getboolean("Enabled", fallback=True)
+    settings["path"] = config["Cache"].get("Path", CACHE_PATH)
+    settings["max_size"] = int(config["Cache"].get("MaxSize", MAX_SIZE))
+    ttl = dict(TTL)
+    for item in config["Cache"].get("TTL", "").split(","):
+        if ":" in item:
+            endpoint, seconds = item.split(":")
+            ttl[endpoint.strip()] = int(seconds)
+    settings["ttl"] = ttl
+    return settings
+
+
+#
+# Cache key and endpoint of a request URL, without the API key
+#
+def cache_url(url):
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k != "key"]
+    return urlunsplit(parts._replace(query=urlencode(sorted(query))))
+
+
+def endpoint(url):
+    path = urlsplit(url).path.rstrip("/").split("/")
+    # /api/project/<project>/<endpoint>/...
+    try:
+        return path[path.index("project") + 2]
+    except (ValueError, IndexError):
+        return ""
+
+
+class ResponseCache:
+    def __init__(self, path=CACHE_PATH, max_size=MAX_SIZE, ttl=TTL):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "revalidated": 0,
+            "misses": 0,
+            "stored": 0,
+            "evicted": 0,
+            "bytes_served": 0,
+        }
+        os.makedirs(os.path.join(path, "objects"), exist_ok=True)
+        self.db = sqlite3.connect(
+            os.path.join(path, "index.db"), timeout=30, check_same_thread=False
+        )
+        self.db.execute("pragma journal_mode=wal")
+        self.db.execute(
+            "create table if not exists entries ("
+            " url text primary key, digest text, size integer, encoding text,"
+            " content_type text, etag text, last_modified text,"
+            " fetched_at real, accessed_at real)"
+        )
+        self.db.execute(
+            "create index if not exists entries_lru on entries(accessed_at)"
+        )
+        self.db.execute("create index if not exists entries_digest on entries(digest)")
+        self.db.execute(
+            "create table if not exists runs ("
+            " finished_at real, hits integer, revalidated integer, misses integer,"
+            " stored integer, evicted integer, bytes_served integer)"
+        )
+        self.db.commit()
+        # Approximate total, evict() recounts before it drops anything
+        self.size = self.db.execute(
+            "select coalesce(sum(size), 0) from entries"
+        ).fetchone()[0]
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.stats[name] = self.stats[name] + n
+
+    def body_path(self, digest):
+        return os.path.join(self.path, "objects", digest[:2], digest)
+
+    def lookup(self, url):
+        with self.lock:
+            row = self.db.execute(
+                "select digest, size, encoding, content_type, etag, last_modified,"
+                " fetched_at from entries where url = ?",
+                (url,),
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ["digest", "size", "encoding", "content_type", "etag"]
+        entry = dict(zip(keys + ["last_modified", "fetched_at"], row))
+        if not os.path.exists(self.body_path(entry["digest"])):
+            return None
+        return entry
+
+    def is_fresh(self, url, entry):
+        ttl = self.ttl.get(endpoint(url), DEFAULT_TTL)
+        return time.time() - entry["fetched_at"] < ttl
+
+    def touch(self, url, refetched=False):
+        now = time.time()
+        with self.lock:
+            if refetched:
+                self.db.execute(
+                    "update entries set fetched_at = ?, accessed_at = ? where url = ?",
+                    (now, now, url),
+                )
+            else:
+                self.db.execute(
+                    "update entries set accessed_at = ? where url = ?", (now, url)
+                )
+            self.db.commit()
+
+    #
+    # Build a requests.Response from a cache entry
+    #
+    def response(self, url, entry):
+        with open(self.body_path(entry["digest"]), "rb") as body:
+            content = body.read()
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response._content = content
+        response.encoding = entry["encoding"]
+        for header, value in [
+            ("Content-Type", entry["content_type"]),
+            ("ETag", entry["etag"]),
+            ("Last-Modified", entry["last_modified"]),
+        ]:
+            if value:
+                response.headers[header] = value
+        response.from_cache = True
+        self.count("bytes_served", len(content))
+        return response
+
+    def store(self, url, response):
+        content = response.content
+        digest = hashlib.sha256(content).hexdigest()
+        body_path = self.body_path(digest)
+        if not os.path.exists(body_path):
+            os.makedirs(os.path.dirname(body_path), exist_ok=True)
+            temp_path = "%s.%d.%d.tmp" % (body_path, os.getpid(), threading.get_ident())
+            with open(temp_path, "wb") as body:
+                body.write(content)
+            os.replace(temp_path, body_path)
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "insert or replace into entries values (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    url,
+                    digest,
+                    len(content),
+                    response.encoding,
+                    response.headers.get("Content-Type"),
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                    now,
+                    now,
+                ),
+            )
+            self.db.commit()
+            self.size = self.size + len(content)
+        self.count("stored")
+        if self.size > self.max_size:
+            self.evict()
+
+    #
+    # Drop the least recently used entries until the cache fits into max_size
+    # (with 10% headroom, so not every following store has to evict again)
+    #
+    def evict(self):
+        with self.lock:
+            total = self.db.execute(
+                "select coalesce(sum(size), 0) from entries"
+            ).fetchone()[0]
+            self.size = total
+            if total <= self.max_size:
+                return
+            for url, digest, size in self.db.execute(
+                "select url, digest, size from entries order by accessed_at"
+            ).fetchall():
+                self.db.execute("delete from entries where url = ?", (url,))
+                shared = self.db.execute(
+                    "select count(*) from entries where digest = ?", (digest,)
+                ).fetchone()[0]
+                if not shared:
+                    try:
+                        os.remove(self.body_path(digest))
+                    except OSError:
+                        pass
+                self.stats["evicted"] = self.stats["evicted"] + 1
+                total = total - size
+                if total <= self.max_size * 0.9:
+                    break
+            self.db.commit()
+            self.size = total
+
+    #
+    # Keep the counters of this run, so hit rates can be inspected later
+    #
+    def record_run(self):
+        keys = ["hits", "revalidated", "misses", "stored", "evicted", "bytes_served"]
+        with self.lock:
+            self.db.execute(
+                "insert into runs values (?, ?, ?, ?, ?, ?, ?)",
+                [time.time()] + [self.stats[key] for key in keys],
+            )
+            self.db.commit()
+
+    def summary(self):
+        with self.lock:
+            entries, size = self.db.execute(
+                "select count(*), coalesce(sum(size), 0) from entries"
+            ).fetchone()
+        return dict(self.stats, entries=entries, size=size)
+
+
+#
+# requests.Session with the response cache in front of every GET
+#
+class CachedSession(requests.Session):
+    def __init__(self, config=None):
+        super().__init__()
+        self.cache = None
+        if config is not None:
+            settings = read_settings(config)
+            if settings["enabled"]:
+                self.cache = ResponseCache(
+                    settings["path"], settings["max_size"], settings["ttl"]
+                )
+
+    def request(self, method, url, *args, **kwargs):
+        if self.cache is None or method.upper() != "GET":
+            return super().request(method, url, *args, **kwargs)
+        key = cache_url(url)
+        entry = self.cache.lookup(key)
+        if entry is not None and self.cache.is_fresh(key, entry):
+            self.cache.count("hits")
+            self.cache.touch(key)
+            return self.cache.response(url, entry)
+
+        headers = dict(kwargs.pop("headers", None) or {})
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        response = super().request(method, url, *args, headers=headers, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            self.cache.count("revalidated")
+            self.cache.touch(key, refetched=True)
+            return self.cache.response(url, entry)
+        self.cache.count("misses")
+        if response.status_code == 200:
+            self.cache.store(key, response)
+        return response
+
+    def print_cache_stats(self):
+        if self.cache is None:
+            return
+        summary = self.cache.summary()
+        line = ", ".join("%s=%s" % item for item in summary.items())
+        print("Cache: " + line)
+        log.info("Cache: " + line)
+        self.cache.record_run()
+
+
+def main():
+    try:
+        config_file = sys.argv[1]
+    except IndexError:
+        config_file = "config.ini"
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    settings = read_settings(config)
+    cache = ResponseCache(settings["path"], settings["max_size"], settings["ttl"])
+    summary = cache.summary()
+    print("Cache path: %s" % settings["path"])
+    print("Entries: %d" % summary["entries"])
+    print("Size: %.1f MB of %.1f MB" % (summary["size"] / 1e6, cache.max_size / 1e6))
+    with cache.lock:
+        urls = cache.db.execute("select url from entries").fetchall()
+        runs = cache.db.execute(
+            "select finished_at, hits, revalidated, misses, evicted from runs"
+            " order by finished_at desc limit 10"
+        ).fetchall()
+    by_endpoint = {}
+    for (url,) in urls:
+        by_endpoint[endpoint(url)] = by_endpoint.get(endpoint(url), 0) + 1
+    for name, count in sorted(by_endpoint.items()):
+        print("  %s: %d" % (name or "other", count))
+    print("Last runs:")
+    for finished_at, hits, revalidated, misses, evicted in runs:
+        requests_total = hits + revalidated + misses
+        hit_rate = (
+            100.0 * (hits + revalidated) / requests_total if requests_total else 0
+        )
+        print(
+            "  %s hits=%d revalidated=%d misses=%d evicted=%d (%.0f%% from cache)"
+            % (
+                time.strftime("%Y-%m-%d %H:%M", time.localtime(finished_at)),
+                hits,
+                revalidated,
+                misses,
+                evicted,
+                hit_rate,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#####################################################################
+# Delta sync helpers shared by the *_supabase scripts
+#
+# With [Sync] Mode=Delta the scripts refetch stored objects whose
+# lastModified changed on Outdooractive. The listing entries are used
+# when they carry a lastModified attribute; otherwise the stored
+# objects are re-requested in /oois batches (see oa_fetch) and only the
+# ones with a different lastModified are extracted and written.
+#
+#####################################################################
+# Version: 0.1.0
+# Email: paul.wasicsek@gmail.com
+# Status: dev
+#####################################################################
+
+import datetime
+
+# Only new objects are fetched, stored ones are never refreshed
+MODE_NEW = "New"
+# Stored objects are refreshed when their lastModified changed
+MODE_DELTA = "Delta"
+
+
+#
+# Read the [Sync] section of config.ini
+#
+def read_mode(config):
+    try:
+        return config["Sync"]["Mode"]
+    except KeyError:
+        return MODE_NEW
+
+
+#
+# Outdooractive sends e.g. 2023-05-01T10:00:00.000+02:00, Postgres returns
+# 2023-05-01T08:00:00+00:00 - compare them as points in time
+#
+def parse_timestamp(value):
+    if value is None or value == "":
+        return None
+    try:
+        timestamp = datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return str(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+    return timestamp
+
+
+def is_modified(current, stored):
+    current = parse_timestamp(current)
+    stored = parse_timestamp(stored)
+    if current is None:
+        return False
+    if stored is None or type(current) != type(stored):
+        return True
+    return current != stored
+
+
+#
+# lastModified of an object in a parsed /oois document
+#
+def last_modified(document, kind):
+    try:
+        return document["oois"][kind]["meta"]["date"]["@lastModified"]
+    except (KeyError, TypeError):
+        return None
+
+
+#
+# Split the listed objects that are already stored into
+#   changed - the listing shows a newer lastModified
+#   unverified - the listing has no lastModified, the document has to tell
+#
+def split_known(entries, known, column="date_lastModified"):
+    changed = []
+    unverified = []
+    for entry in entries:
+        stored = known.get(entry["@id"])
+        if stored is None:
+            continue
+        if "@lastModified" not in entry:
+            unverified.append(entry["@id"])
+        elif is_modified(entry["@lastModified"], stored.get(column)):
+            changed.append(entry["@id"])
+    return changed, unverified
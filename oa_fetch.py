@@ -0,0 +1,359 @@
+#####################################################################
+# Fetch engine for Outdooractive detail documents (/oois/{id})
+#
+# Used by trailKM_supabase, POIs_supabase, events_supabase and
+# conditions_supabase. An asyncio loop in a background thread keeps
+# up to [Fetch] Concurrency requests in flight on the shared requests
+# session and starts them at the pace of an adaptive rate limiter
+# (oa_rate.TokenBucket, see [Wait]). The documents are handed back, in
+# completion order, to the calling script, which parses and stores them
+# as before.
+# fetch_objects() requests up to [Fetch] BatchSize comma-separated IDs
+# per /oois call and splits the combined <oois> document back into one
+# document per object.
+# With [Fetch] Processes=N the responses are parsed (and the fields
+# extracted, see oa_schema) in a pool of N worker processes instead of
+# the calling thread, so parsing is not bound to one core by the GIL.
+# The IO threads hand over the raw bytes, the workers return the
+# extracted records.
+#
+#####################################################################
+# Version: 0.1.0
+# Email: paul.wasicsek@gmail.com
+# Status: dev
+#####################################################################
+
+import asyncio
+import collections
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import logging as log
+import multiprocessing
+import queue
+import threading
+import time
+import xmltodict
+import oa_delta
+import oa_metrics
+import oa_rate
+import oa_schema
+import oa_stream
+
+CONCURRENCY = 4
+# IDs per /oois request, 1 requests every object on its own
+BATCH_SIZE = 1
+# Repeats of a request answered with 429 / 503
+THROTTLE_RETRIES = 3
+
+# Marks the end of the result queue
+_DONE = object()
+
+
+#
+# Read the [Fetch] section of config.ini
+# rate is an oa_rate.TokenBucket, started at [Fetch] RequestsPerSecond or,
+# without it, at the rate configured in the [Wait] section
+#
+def read_settings(config):
+    settings = {
+        "concurrency": CONCURRENCY,
+        "rate": None,
+        "batch_size": BATCH_SIZE,
+        "processes": 0,
+    }
+    try:
+        settings["concurrency"] = int(config["Fetch"]["Concurrency"])
+    except KeyError:
+        pass
+    try:
+        settings["processes"] = int(config["Fetch"]["Processes"])
+    except KeyError:
+        pass
+    try:
+        settings["batch_size"] = int(config["Fetch"]["BatchSize"])
+    except KeyError:
+        pass
+    try:
+        rate = float(config["Fetch"]["RequestsPerSecond"])
+    except KeyError:
+        rate = None
+    settings["rate"] = oa_rate.read_limiter(config, rate)
+    return settings
+
+
+async def _fetch_all(
+    session, jobs, concurrency, rate, results, metrics=None, stop=None
+):
+    loop = asyncio.get_running_loop()
+    if not isinstance(rate, oa_rate.TokenBucket):
+        rate = oa_rate.TokenBucket(rate, adaptive=False)
+    jobs = iter(jobs)
+
+    async def fetch(executor, url):
+        # A throttled request is repeated after the limiter slowed down
+        for attempt in range(THROTTLE_RETRIES + 1):
+            await rate.acquire()
+            log.debug("Fetch URL:" + url)
+            start = time.perf_counter()
+            try:
+                response = await loop.run_in_executor(executor, session.get, url)
+            except Exception:
+                rate.feedback(None)
+                raise
+            if metrics is not None:
+                metrics.observe("fetch", time.perf_counter() - start)
+                metrics.count("bytes_received", oa_metrics.transferred(response))
+            rate.feedback(response.status_code, response.headers.get("Retry-After"))
+            if response.status_code not in oa_rate.THROTTLE_STATUS:
+                break
+            if metrics is not None and attempt < THROTTLE_RETRIES:
+                metrics.count("throttle_retries")
+        response.raise_for_status()
+        return response
+
+    async def worker(executor):
+        # The loop is single threaded, so the workers can share the iterator
+        for object_id, url in jobs:
+            if stop is not None and stop.is_set():
+                # The consumer stopped reading, no more requests
+                break
+            try:
+                response = await fetch(executor, url)
+                result = (object_id, response.content, None)
+            except Exception as e:
+                result = (object_id, None, e)
+            # Blocks while the consumer is behind, this keeps memory bounded
+            await loop.run_in_executor(executor, results.put, result)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        await asyncio.gather(*[worker(executor) for _ in range(concurrency)])
+    results.put(_DONE)
+
+
+#
+# Fetch the documents for jobs, an iterable of (object_id, url)
+# rate is the requests per second or a (shared) oa_rate.TokenBucket
+# Yields (object_id, content, error) as the responses arrive; content is the
+# undecoded body, error the exception of a failed request (content is then None)
+# metrics (oa_metrics.Metrics, optional) times every request as stage "fetch"
+#
+def fetch_documents(session, jobs, concurrency=CONCURRENCY, rate=None, metrics=None):
+    concurrency = max(1, concurrency)
+    results = queue.Queue(maxsize=concurrency * 4)
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=asyncio.run,
+        args=(_fetch_all(session, jobs, concurrency, rate, results, metrics, stop),),
+        daemon=True,
+    )
+    thread.start()
+    finished = False
+    try:
+        while True:
+            result = results.get()
+            if result is _DONE:
+                finished = True
+                return
+            yield result
+    finally:
+        if not finished:
+            # Closed early (consumer failed): let the requests in flight
+            # end and drain the queue so the fetch thread can finish
+            stop.set()
+            while results.get() is not _DONE:
+                pass
+        thread.join()
+
+
+#
+# Split a parsed <oois> document into one {"oois": {kind: object}} document
+# per object, keyed by the object ID, so the per-object extraction works
+# on batched responses unchanged
+#
+def split_oois(document, kind):
+    objects = (document.get("oois") or {}).get(kind) or []
+    if not isinstance(objects, list):
+        objects = [objects]
+    return {obj["@id"]: {"oois": {kind: obj}} for obj in objects}
+
+
+#
+# Parse one /oois response into per-object documents, keyed by object ID
+# With params ({object_id: params}) the fields are extracted as well and
+# the values are (record, lastModified); this runs in the worker processes,
+# so only the records travel back
+#
+def parse_batch(content, kind, parser=oa_stream.MODE_XMLTODICT, params=None):
+    if parser == oa_stream.MODE_STREAM:
+        documents = oa_stream.split_oois(content, kind)
+    else:
+        documents = split_oois(xmltodict.parse(content), kind)
+    if params is None:
+        return documents
+    schema = oa_schema.SCHEMAS[kind]
+    return {
+        object_id: (
+            schema.extract_document(document, params[object_id]),
+            oa_delta.last_modified(document, kind),
+        )
+        for object_id, document in documents.items()
+        if object_id in params
+    }
+
+
+#
+# Process pool for parse_batch(), None for processes < 1
+# (spawned workers: forking a process that runs threads is not safe)
+#
+def create_pool(processes):
+    if processes < 1:
+        return None
+    return ProcessPoolExecutor(
+        max_workers=processes, mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+#
+# (batch, documents, error) of every fetched batch, parsed in this thread
+# or, with a pool, in the worker processes (at most two batches per
+# process in flight, the done ones are handed over first). If a worker
+# process dies the pool is broken for all entities sharing it, the
+# remaining batches are then parsed in this thread
+#
+def _parse_batches(results, kind, parser, metrics, pool, processes, params):
+    if pool is None:
+        for batch, content, error in results:
+            documents = {}
+            if error is None:
+                start = time.perf_counter()
+                try:
+                    documents = parse_batch(content, kind, parser)
+                except Exception as e:
+                    error = e
+                if metrics is not None:
+                    metrics.observe("parse", time.perf_counter() - start)
+            yield batch, documents, error
+        return
+
+    broken = []
+
+    def parse_here(content, batch_params):
+        if not broken:
+            broken.append(True)
+            line = "Parser process pool broken, parsing in the fetching thread"
+            print("ERROR:", line)
+            log.error(line)
+        return parse_batch(content, kind, parser, batch_params)
+
+    def done(batch, start, future, content, batch_params):
+        documents = {}
+        error = None
+        try:
+            try:
+                documents = future.result()
+            except BrokenProcessPool:
+                documents = parse_here(content, batch_params)
+        except Exception as e:
+            error = e
+        if metrics is not None:
+            metrics.observe("parse", time.perf_counter() - start)
+        return batch, documents, error
+
+    pending = collections.deque()
+    for batch, content, error in results:
+        if error is not None:
+            yield batch, {}, error
+            continue
+        batch_params = None
+        if params is not None:
+            batch_params = {object_id: params(object_id) for object_id in batch}
+        start = time.perf_counter()
+        if not broken:
+            try:
+                future = pool.submit(parse_batch, content, kind, parser, batch_params)
+                pending.append((batch, start, future, content, batch_params))
+            except BrokenProcessPool:
+                broken.append(True)
+        if broken:
+            # In order: the batches still in the pool are handed over first
+            while pending:
+                yield done(*pending.popleft())
+            documents = {}
+            try:
+                documents = parse_here(content, batch_params)
+            except Exception as e:
+                error = e
+            if metrics is not None:
+                metrics.observe("parse", time.perf_counter() - start)
+            yield batch, documents, error
+            continue
+        while pending and (
+            pending[0][2].done() or len(pending) > 2 * max(1, processes)
+        ):
+            yield done(*pending.popleft())
+    while pending:
+        yield done(*pending.popleft())
+
+
+#
+# Fetch the objects with the given IDs, batch_size IDs per /oois request
+# build_url(ids) receives the comma-separated IDs of one batch, kind is the
+# element name of the objects (tour, poi, event, condition), parser the
+# oa_stream mode used for the responses, metrics (optional) times the
+# requests and the parse of every response (stage "parse").
+# Yields (object_id, document, error) with the parsed per-object document.
+# With a pool (create_pool()) the responses are parsed in the worker
+# processes; with params as well (params(object_id) for oa_schema) the
+# workers extract the fields and document is (record, lastModified).
+# A batch that fails, or misses some of its objects, is split in halves and
+# requested again; only a single ID that still fails is reported as error.
+#
+def fetch_objects(
+    session,
+    ids,
+    build_url,
+    kind,
+    batch_size=BATCH_SIZE,
+    concurrency=CONCURRENCY,
+    rate=None,
+    parser=oa_stream.MODE_XMLTODICT,
+    metrics=None,
+    processes=0,
+    pool=None,
+    params=None,
+):
+    batch_size = max(1, batch_size)
+    batches = [tuple(ids[i : i + batch_size]) for i in range(0, len(ids), batch_size)]
+    while batches:
+        jobs = [(batch, build_url(",".join(batch))) for batch in batches]
+        batches = []
+        results = fetch_documents(session, jobs, concurrency, rate, metrics)
+        parsed = _parse_batches(results, kind, parser, metrics, pool, processes, params)
+        try:
+            for batch, documents, error in parsed:
+                for object_id in batch:
+                    if object_id in documents:
+                        yield object_id, documents[object_id], None
+                missing = [
+                    object_id for object_id in batch if object_id not in documents
+                ]
+                if not missing:
+                    continue
+                if len(missing) == 1 and len(batch) == 1:
+                    yield missing[0], None, error or KeyError(
+                        "%s %s not in response" % (kind, missing[0])
+                    )
+                elif len(missing) == 1:
+                    batches.append(tuple(missing))
+                else:
+                    log.warning(
+                        "Batch of %d %s IDs incomplete (%s), retrying in halves"
+                        % (len(batch), kind, error or "%d missing" % len(missing))
+                    )
+                    half = (len(missing) + 1) // 2
+                    batches.append(tuple(missing[:half]))
+                    batches.append(tuple(missing[half:]))
+        finally:
+            # Joins the fetch thread also if the caller stopped early
+            parsed.close()
+            results.close()
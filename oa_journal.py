@@ -0,0 +1,267 @@
+#####################################################################
+# Checkpoint journal for the sync runs
+#
+# A local SQLite file records the progress of every entity run:
+#   - the listing and the result of the diff (pending IDs with the
+#     stored values needed later) when the crawl starts
+#   - every fetched, written, skipped and failed ID as it happens
+# The journal is append-only while a run is going on. When a run ends
+# normally it is marked finished and its items are dropped (the run row
+# keeps the counts). A run that crashed is still open: the next run of
+# the same entity and project resumes it, without listing request and
+# without reading Supabase, and only fetches the IDs that were not
+# written or skipped yet. Runs older than MaxAge are not resumed.
+#
+# An ID counts as written when the chunk holding its row was stored,
+# the writers flush at least every FlushInterval seconds so a crash
+# loses (and refetches) only the objects of the last interval.
+#
+# Configured in the optional [Journal] section:
+#   [Journal]
+#   Path=.oa_journal.db
+#   MaxAge=86400
+#   FlushInterval=1
+#
+# Call:
+# python oa_journal.py <ini_file.ini>
+#   prints the runs in the journal
+#
+#####################################################################
+# Version: 0.1.0
+# Email: paul.wasicsek@gmail.com
+# Status: dev
+#####################################################################
+
+import configparser
+import json
+import sqlite3
+import sys
+import threading
+import time
+
+JOURNAL_PATH = ".oa_journal.db"
+# Seconds an unfinished run can be resumed
+MAX_AGE = 24 * 3600
+# Seconds the writers keep rows before they are stored and journaled
+FLUSH_INTERVAL = 1.0
+
+LISTED = "listed"
+PENDING = "pending"
+FETCHED = "fetched"
+WRITTEN = "written"
+SKIPPED = "skipped"
+FAILED = "failed"
+# States after which an ID needs no more work
+DONE = (WRITTEN, SKIPPED)
+
+
+#
+# Read the [Journal] section of config.ini, None if there is none
+#
+def read_settings(config):
+    if not config.has_section("Journal"):
+        return None
+    if not config["Journal"].getboolean("Enabled", fallback=True):
+        return None
+    return {
+        "path": config["Journal"].get("Path", JOURNAL_PATH),
+        "max_age": int(config["Journal"].get("MaxAge", MAX_AGE)),
+        "flush_interval": float(config["Journal"].get("FlushInterval", FLUSH_INTERVAL)),
+    }
+
+
+class Journal:
+    def __init__(self, path=JOURNAL_PATH, max_age=MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("pragma journal_mode=wal")
+        # Commits survive a crash of the process, only a power loss may lose
+        # the last ones, which are then simply done again
+        self.db.execute("pragma synchronous=normal")
+        self.db.execute(
+            "create table if not exists runs ("
+            " run_id integer primary key, entity text, project text,"
+            " started_at real, finished_at real, state text, counts text)"
+        )
+        self.db.execute(
+            "create table if not exists items ("
+            " run_id integer, object_id text, state text, detail text)"
+        )
+        self.db.execute("create index if not exists items_run on items(run_id, state)")
+        self.db.commit()
+
+    #
+    # Resume the unfinished run of entity/project or start a new one
+    #
+    def open_run(self, entity, project):
+        with self.lock:
+            row = self.db.execute(
+                "select run_id, started_at, state from runs where entity = ?"
+                " and project = ? and finished_at is null"
+                " order by run_id desc limit 1",
+                (entity, project),
+            ).fetchone()
+            if row is not None and time.time() - row[1] < self.max_age:
+                return Run(self, row[0], entity, resumed=True, state=row[2])
+            if row is not None:
+                # Too old to resume, the listing may have changed since
+                self.close_run(row[0], "abandoned")
+            cursor = self.db.execute(
+                "insert into runs (entity, project, started_at) values (?, ?, ?)",
+                (entity, project, time.time()),
+            )
+            self.db.commit()
+            return Run(self, cursor.lastrowid, entity)
+
+    # Called with self.lock held
+    def close_run(self, run_id, counts):
+        self.db.execute(
+            "update runs set finished_at = ?, counts = ? where run_id = ?",
+            (time.time(), counts, run_id),
+        )
+        self.db.execute("delete from items where run_id = ?", (run_id,))
+        self.db.commit()
+
+    def runs(self, limit=20):
+        with self.lock:
+            return self.db.execute(
+                "select run_id, entity, project, started_at, finished_at, counts"
+                " from runs order by run_id desc limit ?",
+                (limit,),
+            ).fetchall()
+
+
+#
+# Progress of one entity run
+#
+class Run:
+    def __init__(self, journal, run_id, entity, resumed=False, state=None):
+        self.journal = journal
+        self.run_id = run_id
+        self.entity = entity
+        # Resumed runs only continue if the diff had been recorded
+        self.resumed = resumed and state is not None
+
+    #
+    # Append ids in state, detail(object_id) gives the optional detail value
+    #
+    def record(self, state, ids, detail=None):
+        rows = [
+            (
+                self.run_id,
+                str(object_id),
+                state,
+                None if detail is None else json.dumps(detail(object_id)),
+            )
+            for object_id in ids
+        ]
+        with self.journal.lock:
+            self.journal.db.executemany("insert into items values (?, ?, ?, ?)", rows)
+            self.journal.db.commit()
+
+    def items(self, state):
+        with self.journal.lock:
+            rows = self.journal.db.execute(
+                "select object_id, detail from items where run_id = ? and state = ?"
+                " order by rowid",
+                (self.run_id, state),
+            ).fetchall()
+        return [(object_id, json.loads(detail or "null")) for object_id, detail in rows]
+
+    #
+    # Record the listing, the pending IDs and the entity state in one
+    # transaction; from now on the run can be resumed
+    #
+    def start(self, entries, pending, known, state):
+        with self.journal.lock:
+            db = self.journal.db
+            db.executemany(
+                "insert into items values (?, ?, ?, ?)",
+                [
+                    (self.run_id, entry["@id"], LISTED, json.dumps(entry))
+                    for entry in entries
+                ],
+            )
+            db.executemany(
+                "insert into items values (?, ?, ?, ?)",
+                [
+                    (self.run_id, object_id, PENDING, json.dumps(known.get(object_id)))
+                    for object_id in pending
+                ],
+            )
+            db.execute(
+                "update runs set state = ? where run_id = ?",
+                (json.dumps(state), self.run_id),
+            )
+            db.commit()
+
+    #
+    # Listing, pending IDs without the finished ones, stored values of the
+    # pending IDs and entity state of a resumed run
+    #
+    def restore(self):
+        with self.journal.lock:
+            state = self.journal.db.execute(
+                "select state from runs where run_id = ?", (self.run_id,)
+            ).fetchone()[0]
+            done = {
+                object_id
+                for (object_id,) in self.journal.db.execute(
+                    "select object_id from items where run_id = ?"
+                    " and state in (?, ?)",
+                    (self.run_id,) + DONE,
+                )
+            }
+        entries = [entry for _, entry in self.items(LISTED)]
+        pending = []
+        known = {}
+        for object_id, stored in self.items(PENDING):
+            if stored is not None:
+                known[object_id] = stored
+            if object_id not in done:
+                pending.append(object_id)
+        return entries, pending, known, json.loads(state)
+
+    def counts(self):
+        with self.journal.lock:
+            rows = self.journal.db.execute(
+                "select state, count(distinct object_id) from items"
+                " where run_id = ? group by state",
+                (self.run_id,),
+            ).fetchall()
+        return dict(rows)
+
+    def finish(self):
+        counts = json.dumps(self.counts())
+        with self.journal.lock:
+            self.journal.close_run(self.run_id, counts)
+
+
+def main():
+    try:
+        config_file = sys.argv[1]
+    except IndexError:
+        config_file = "config.ini"
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    settings = read_settings(config) or {"path": JOURNAL_PATH, "max_age": MAX_AGE}
+    journal = Journal(settings["path"], settings["max_age"])
+    print("Journal path: %s" % settings["path"])
+    for run_id, entity, project, started_at, finished_at, counts in journal.runs():
+        print(
+            "  %d %s %s started %s %s %s"
+            % (
+                run_id,
+                entity,
+                project,
+                time.strftime("%Y-%m-%d %H:%M", time.localtime(started_at)),
+                "finished" if finished_at else "open",
+                counts or "",
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
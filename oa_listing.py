@@ -0,0 +1,225 @@
+#####################################################################
+# Compact listings and listing snapshots
+#
+# Listing holds the result of a listing request (/filter/tour, /pois,
+# /events, /conditions) as two typed arrays: the object IDs (int64) and
+# their lastModified (float64 Unix time, NaN if not listed), 16 bytes per
+# object instead of one dict per <data> element. read() builds it while
+# the document is parsed, the parsed tree is dropped right away.
+# Iterating a Listing yields short-lived {"@id", "@lastModified"} entries,
+# ids() only the IDs.
+#
+# Tombstones: after every run sync_engine keeps the IDs listed for an
+# entity as one sorted int64 array on disk (8 bytes per ID). The next
+# run diffs its listing against it: IDs that were listed before and
+# are gone now are removed on Outdooractive, their rows are marked with
+# removed_at in one bulk update (supabase_bulk.update_ids), so they stop
+# counting in DailyStats. IDs that come back get removed_at cleared.
+# The set differences are a linear merge of the two sorted arrays.
+#
+# Enabled by the optional [Tombstones] section:
+#   [Tombstones]
+#   Path=.oa_listing
+# The Trails, POIs and events tables need a removed_at timestamptz column.
+#
+# Call:
+# python oa_listing.py <ini_file.ini>
+#   prints the stored snapshots
+#
+#####################################################################
+# Version: 0.1.0
+# Email: paul.wasicsek@gmail.com
+# Status: dev
+#####################################################################
+
+from array import array
+import configparser
+import datetime
+import math
+import os
+import sys
+import oa_snapshot
+import oa_stream
+
+LISTING_PATH = ".oa_listing"
+
+
+class Listing:
+    __slots__ = ("object_ids", "modified")
+
+    def __init__(self):
+        # array of int64, a list of strings if an ID is not a plain number
+        self.object_ids = array("q")
+        self.modified = array("d")
+
+    def append(self, object_id, last_modified=None):
+        object_id = str(object_id)
+        if isinstance(self.object_ids, array):
+            try:
+                number = int(object_id)
+                if str(number) != object_id:
+                    raise ValueError(object_id)
+                self.object_ids.append(number)
+            except (ValueError, OverflowError):
+                self.object_ids = [str(i) for i in self.object_ids]
+                self.object_ids.append(object_id)
+        else:
+            self.object_ids.append(object_id)
+        self.modified.append(oa_snapshot.as_time(last_modified))
+
+    def __len__(self):
+        return len(self.modified)
+
+    #
+    # Listed IDs as strings, in listing order
+    #
+    def ids(self):
+        return map(str, self.object_ids)
+
+    #
+    # (ID, lastModified as Unix time or NaN)
+    #
+    def items(self):
+        return zip(self.ids(), self.modified)
+
+    #
+    # Entries as the parsers return them, created one at a time
+    #
+    def __iter__(self):
+        for object_id, modified in self.items():
+            entry = {"@id": object_id}
+            if not math.isnan(modified):
+                entry["@lastModified"] = as_iso(modified)
+            yield entry
+
+    @classmethod
+    def from_entries(cls, entries):
+        listing = cls()
+        for entry in entries:
+            listing.append(entry["@id"], entry.get("@lastModified"))
+        return listing
+
+
+def as_iso(value):
+    return datetime.datetime.fromtimestamp(value, datetime.timezone.utc).isoformat()
+
+
+#
+# Listing of a listing response (or document) in the given parser mode
+#
+def read(data, mode=oa_stream.MODE_XMLTODICT):
+    if mode == oa_stream.MODE_STREAM:
+        return Listing.from_entries(oa_stream.iter_listing(data))
+    return Listing.from_entries(oa_stream.read_listing(data, mode))
+
+
+#
+# Read the [Tombstones] section of config.ini, None if there is none
+#
+def read_settings(config):
+    if not config.has_section("Tombstones"):
+        return None
+    if not config["Tombstones"].getboolean("Enabled", fallback=True):
+        return None
+    return {"path": config["Tombstones"].get("Path", LISTING_PATH)}
+
+
+#
+# Sorted array of the distinct IDs, IDs that are not numeric are left out
+#
+def to_array(ids):
+    values = set()
+    for value in ids:
+        try:
+            values.add(int(value))
+        except (TypeError, ValueError):
+            continue
+    return array("q", sorted(values))
+
+
+def file_name(path, entity, project, area):
+    return os.path.join(path, "%s-%s-%s.ids" % (entity, project, area))
+
+
+#
+# Snapshot of a previous run, None if there is none
+#
+def load(file_path):
+    ids = array("q")
+    try:
+        with open(file_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            ids.fromfile(f, size // ids.itemsize)
+    except (OSError, EOFError):
+        return None
+    return ids
+
+
+def save(file_path, ids):
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    temp_path = "%s.%d.tmp" % (file_path, os.getpid())
+    with open(temp_path, "wb") as f:
+        ids.tofile(f)
+    os.replace(temp_path, file_path)
+
+
+#
+# (added, removed) between two sorted arrays, as sorted arrays
+#
+def diff(previous, current):
+    added = array("q")
+    removed = array("q")
+    i = j = 0
+    n, m = len(previous), len(current)
+    while i < n and j < m:
+        old, new = previous[i], current[j]
+        if old == new:
+            i = i + 1
+            j = j + 1
+        elif old < new:
+            removed.append(old)
+            i = i + 1
+        else:
+            added.append(new)
+            j = j + 1
+    removed.extend(previous[i:])
+    added.extend(current[j:])
+    return added, removed
+
+
+def main():
+    try:
+        config_file = sys.argv[1]
+    except IndexError:
+        config_file = "config.ini"
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    print_snapshots(read_settings(config) or {"path": LISTING_PATH})
+
+
+#
+# (file name, number of IDs) of the snapshots in path
+#
+def snapshots(path):
+    try:
+        names = sorted(os.listdir(path))
+    except OSError:
+        names = []
+    for name in names:
+        if name.endswith(".ids"):
+            ids = load(os.path.join(path, name))
+            if ids is not None:
+                yield name, len(ids)
+
+
+def print_snapshots(settings):
+    found = False
+    for name, count in snapshots(settings["path"]):
+        print("%s: %d IDs" % (name, count))
+        found = True
+    if not found:
+        print("No listing snapshots in %s" % settings["path"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+#####################################################################
+# Per-stage metrics of a sync run
+#
+# Metrics collects latency histograms of the sync stages
+#   listing   - listing request and parse, per entity
+#   fetch     - every /oois request, per entity
+#   parse     - parse and split of every /oois document, per entity
+#   extract   - field extraction of every object, per entity
+#   supabase  - every Supabase (or SQLite) call, per table and operation
+# and counters (requests, retries, cache hits, bytes, objects listed,
+# fetched, written, failed, ...). At the end of the run the summary is
+# written as JSON and as a Prometheus textfile (for the textfile
+# collector of node_exporter), so a drop of the sync throughput can
+# be alerted on.
+#
+# Enabled by the optional [Metrics] section:
+#   [Metrics]
+#   Json=trailkm_metrics.json
+#   Prometheus=/var/lib/node_exporter/textfile_collector/trailkm.prom
+#
+#####################################################################
+# Version: 0.1.0
+# Email: paul.wasicsek@gmail.com
+# Status: dev
+#####################################################################
+
+import bisect
+import json
+import logging as log
+import os
+import threading
+import time
+
+# Upper bounds of the histogram buckets in seconds (+Inf is implicit)
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+PREFIX = "trailkm"
+# Builder methods that select the operation of a Supabase call
+OPERATIONS = {"select", "insert", "upsert", "update", "delete"}
+
+
+#
+# Read the [Metrics] section of config.ini, None if there is none
+#
+def read_settings(config):
+    if not config.has_section("Metrics"):
+        return None
+    if not config["Metrics"].getboolean("Enabled", fallback=True):
+        return None
+    return {
+        "json": config["Metrics"].get("Json", ""),
+        "prometheus": config["Metrics"].get("Prometheus", ""),
+    }
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count = self.count + 1
+        self.sum = self.sum + seconds
+        self.max = max(self.max, seconds)
+
+    #
+    # Upper bound of the bucket holding the given quantile
+    #
+    def quantile(self, q):
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + [float("inf")], self.counts):
+            seen = seen + count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else 0,
+            "p50": round(self.quantile(0.5), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "max": round(self.max, 6),
+            "buckets": dict(zip([str(b) for b in BUCKETS] + ["+Inf"], self.counts)),
+        }
+
+
+class Timer:
+    def __init__(self, metrics, stage, labels):
+        self.metrics = metrics
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(
+            self.stage, time.perf_counter() - self.start, **self.labels
+        )
+        return False
+
+
+#
+# Labels as a hashable key
+#
+def label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        # (stage, labels) -> Histogram
+        self.histograms = {}
+        # (name, labels) -> number
+        self.counters = {}
+
+    def observe(self, stage, seconds, **labels):
+        key = (stage, label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def timer(self, stage, **labels):
+        return Timer(self, stage, labels)
+
+    def count(self, name, n=1, **labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    #
+    # Metrics that add the given labels (e.g. entity="trails")
+    #
+    def labelled(self, **labels):
+        return Labelled(self, labels)
+
+    def summary(self):
+        with self.lock:
+            finished = time.time()
+            duration = finished - self.started
+            written = sum(
+                value
+                for (name, labels), value in self.counters.items()
+                if name == "objects_written"
+            )
+            return {
+                "started_at": self.started,
+                "finished_at": finished,
+                "duration": round(duration, 3),
+                # Sync throughput, objects written per second of the run
+                "objects_per_second": round(written / duration, 3) if duration else 0,
+                "stages": [
+                    dict(stage=stage, labels=dict(labels), **histogram.summary())
+                    for (stage, labels), histogram in sorted(self.histograms.items())
+                ],
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+            }
+
+    def write_json(self, path, summary):
+        replace(path, json.dumps(summary, indent=2))
+
+    def write_prometheus(self, path, summary):
+        lines = [
+            "# HELP %s_stage_seconds Duration of the sync stages" % PREFIX,
+            "# TYPE %s_stage_seconds histogram" % PREFIX,
+        ]
+        for stage in summary["stages"]:
+            labels = dict(stage=stage["stage"], **stage["labels"])
+            cumulative = 0
+            for bound, count in stage["buckets"].items():
+                cumulative = cumulative + count
+                lines.append(
+                    "%s_stage_seconds_bucket%s %d"
+                    % (PREFIX, prometheus_labels(labels, le=bound), cumulative)
+                )
+            lines.append(
+                "%s_stage_seconds_sum%s %s"
+                % (PREFIX, prometheus_labels(labels), stage["sum"])
+            )
+            lines.append(
+                "%s_stage_seconds_count%s %d"
+                % (PREFIX, prometheus_labels(labels), stage["count"])
+            )
+        # Values of the last run, so gauges for the textfile collector
+        names = []
+        for counter in summary["counters"]:
+            if counter["name"] not in names:
+                names.append(counter["name"])
+        for name in names:
+            lines.append("# TYPE %s_%s gauge" % (PREFIX, name))
+            for counter in summary["counters"]:
+                if counter["name"] != name:
+                    continue
+                lines.append(
+                    "%s_%s%s %s"
+                    % (
+                        PREFIX,
+                        name,
+                        prometheus_labels(counter["labels"]),
+                        counter["value"],
+                    )
+                )
+        for name, value in [
+            ("run_duration_seconds", summary["duration"]),
+            ("objects_per_second", summary["objects_per_second"]),
+            ("last_run_timestamp_seconds", round(summary["finished_at"])),
+        ]:
+            lines.append("# TYPE %s_%s gauge" % (PREFIX, name))
+            lines.append("%s_%s %s" % (PREFIX, name, value))
+        replace(path, "\n".join(lines) + "\n")
+
+    #
+    # Write the configured files and print the stage overview
+    #
+    def report(self, settings):
+        summary = self.summary()
+        for stage in summary["stages"]:
+            labels = " ".join("%s=%s" % item for item in stage["labels"].items())
+            line = "Stage %s %s: %d calls, %.3fs, p50 %.3fs, p95 %.3fs, max %.3fs" % (
+                stage["stage"],
+                labels,
+                stage["count"],
+                stage["sum"],
+                stage["p50"],
+                stage["p95"],
+                stage["max"],
+            )
+            log.info(line)
+        line = "Run: %.1fs, %.2f objects written per second" % (
+            summary["duration"],
+            summary["objects_per_second"],
+        )
+        print(line)
+        log.info(line)
+        if settings is None:
+            return summary
+        try:
+            if settings["json"]:
+                self.write_json(settings["json"], summary)
+            if settings["prometheus"]:
+                self.write_prometheus(settings["prometheus"], summary)
+        except OSError as e:
+            print("ERROR:", e)
+            log.error(e)
+        return summary
+
+
+class Labelled:
+    def __init__(self, metrics, labels):
+        self.metrics = metrics
+        self.labels = labels
+
+    def observe(self, stage, seconds, **labels):
+        self.metrics.observe(stage, seconds, **dict(self.labels, **labels))
+
+    def timer(self, stage, **labels):
+        return self.metrics.timer(stage, **dict(self.labels, **labels))
+
+    def count(self, name, n=1, **labels):
+        self.metrics.count(name, n, **dict(self.labels, **labels))
+
+
+def prometheus_labels(labels, **extra):
+    labels = dict(labels, **extra)
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in labels.items()
+    )
+
+
+#
+# Bytes of the response body read from the network (compressed size if the
+# body was compressed), 0 for responses served by oa_cache
+#
+def transferred(response):
+    if getattr(response, "from_cache", False):
+        return 0
+    raw = getattr(response, "raw", None)
+    try:
+        return raw.tell()
+    except Exception:
+        return len(response.content or b"")
+
+
+#
+# Write the file atomically, a collector never reads half a file
+#
+def replace(path, text):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(temp_path, "w") as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+#
+# Storage client whose calls are timed as stage "supabase"
+# (table and operation as labels), the builder calls are passed through
+#
+class TimedClient:
+    def __init__(self, client, metrics):
+        self.client = client
+        self.metrics = metrics
+
+    def table(self, name):
+        return TimedQuery(self.client.table(name), self.metrics, name, "select")
+
+    def rpc(self, function, params=None):
+        return TimedQuery(
+            self.client.rpc(function, params or {}), self.metrics, function, "rpc"
+        )
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+class TimedQuery:
+    def __init__(self, query, metrics, table, operation):
+        self.query = query
+        self.metrics = metrics
+        self.table = table
+        self.operation = operation
+
+    def execute(self):
+        with self.metrics.timer("supabase", table=self.table, operation=self.operation):
+            return self.query.execute()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.query, name)
+        if not callable(attribute):
+            return attribute
+        operation = name if name in OPERATIONS else self.operation
+
+        def call(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            if hasattr(result, "execute"):
+                return TimedQuery(result, self.metrics, self.table, operation)
+            return result
+
+        return call
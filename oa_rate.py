@@ -0,0 +1,210 @@
+#####################################################################
+# Adaptive request rate for the Outdooractive API
+#
+# TokenBucket replaces the random sleep of wait(): requests take a
+# token, tokens refill at the current rate, up to Burst tokens can be
+# spent at once. The rate adapts to the API (AIMD):
+#   - every successful response adds Increase requests/second per
+#     second of success, up to MaxRate
+#   - 429 / 503 multiply the rate by Decrease (at most once per
+#     interval, the requests already in flight do not count again),
+#     down to MinRate
+#   - a Retry-After header pauses all requests for that time
+# summary() reports the current and the achieved rate.
+#
+# Configured in the [Wait] section, only used with [Action] Execute=Delay
+# (Execute=Now sends without limit but still honours Retry-After):
+#   Rate - start rate in requests/second, default 1 / average(Min, Max)
+#          ([Fetch] RequestsPerSecond takes precedence)
+#   MinRate, MaxRate - limits, default Rate / 10 and 2 * Rate
+#   Burst - tokens that can be spent at once, default 1
+#   Increase, Decrease - AIMD steps, default 0.05 and 0.5
+#   Adaptive=no keeps the rate fixed
+#
+#####################################################################
+# Version: 0.1.0
+# Email: paul.wasicsek@gmail.com
+# Status: dev
+#####################################################################
+
+import asyncio
+import datetime
+from email.utils import parsedate_to_datetime
+import logging as log
+import threading
+import time
+
+# Responses that ask us to slow down
+THROTTLE_STATUS = (429, 503)
+BURST = 1
+INCREASE = 0.05
+DECREASE = 0.5
+
+
+#
+# Seconds to wait from a Retry-After header (seconds or HTTP date)
+#
+def parse_retry_after(value):
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        until = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if until.tzinfo is None:
+        until = until.replace(tzinfo=datetime.timezone.utc)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return max(0.0, (until - now).total_seconds())
+
+
+class TokenBucket:
+    def __init__(
+        self,
+        rate,
+        burst=BURST,
+        min_rate=None,
+        max_rate=None,
+        increase=INCREASE,
+        decrease=DECREASE,
+        adaptive=True,
+    ):
+        # rate None: no limit, only Retry-After pauses
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.min_rate = min_rate if min_rate is not None else (rate or 0) / 10
+        self.max_rate = max_rate if max_rate is not None else (rate or 0) * 2
+        self.increase = increase
+        self.decrease = decrease
+        self.adaptive = adaptive and rate is not None
+        self.tokens = self.burst
+        self.lock = threading.Lock()
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        # No further decrease before this time
+        self.calm_until = 0
+        self.started = None
+        self.finished = None
+        self.stats = {"requests": 0, "succeeded": 0, "throttled": 0, "paused": 0.0}
+
+    #
+    # Take a token, returns the seconds to wait until it may be used
+    #
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.started is None:
+                self.started = now
+            self.stats["requests"] = self.stats["requests"] + 1
+            delay = 0
+            if self.rate:
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                self.tokens = self.tokens - 1
+                if self.tokens < 0:
+                    delay = -self.tokens / self.rate
+            return max(delay, self.paused_until - now)
+
+    #
+    # Blocking wait, for the sequential scripts
+    #
+    def wait(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    #
+    # Adapt the rate to the outcome of a request
+    # status is the HTTP status code, None for a connection error
+    #
+    def feedback(self, status, retry_after=None):
+        if status in THROTTLE_STATUS:
+            self.throttled(parse_retry_after(retry_after))
+        elif status is not None and status < 500:
+            self.succeeded()
+        else:
+            with self.lock:
+                self.finished = time.monotonic()
+
+    def succeeded(self):
+        with self.lock:
+            self.finished = time.monotonic()
+            self.stats["succeeded"] = self.stats["succeeded"] + 1
+            if self.adaptive and self.rate < self.max_rate:
+                # increase requests/second per second: increase / rate per request
+                self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def throttled(self, retry_after=None):
+        with self.lock:
+            now = time.monotonic()
+            self.finished = now
+            self.stats["throttled"] = self.stats["throttled"] + 1
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+                self.stats["paused"] = self.stats["paused"] + retry_after
+            if not self.adaptive or now < self.calm_until:
+                return
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            # The burst is gone, requests restart at the lower rate
+            self.tokens = min(self.tokens, 0)
+            self.calm_until = now + max(1.0, 1 / self.rate)
+        log.warning("Throttled by the API, rate lowered to %.2f/s" % self.rate)
+
+    #
+    # Current rate and the rate achieved since the first request
+    #
+    def summary(self):
+        with self.lock:
+            elapsed = (self.finished or 0) - (self.started or 0)
+            achieved = self.stats["succeeded"] / elapsed if elapsed > 0 else 0
+            return dict(self.stats, rate=self.rate, achieved=round(achieved, 3))
+
+    def print_summary(self):
+        summary = self.summary()
+        rate = "unlimited" if summary["rate"] is None else "%.2f/s" % summary["rate"]
+        line = "Rate: %s, achieved %.2f/s, %d requests, %d throttled, %.0fs paused" % (
+            rate,
+            summary["achieved"],
+            summary["requests"],
+            summary["throttled"],
+            summary["paused"],
+        )
+        print(line)
+        log.info(line)
+
+
+#
+# Request limiter from the [Wait] and [Fetch] sections of config.ini
+# rate is the start rate if it is known already (e.g. [Fetch] RequestsPerSecond)
+#
+def read_limiter(config, rate=None):
+    if config["Action"]["Execute"] != "Delay":
+        return TokenBucket(None)
+    wait = config["Wait"] if config.has_section("Wait") else {}
+    if rate is None and "Rate" in wait:
+        rate = float(wait["Rate"])
+    if rate is None and "Min" in wait and "Max" in wait:
+        average_wait = (int(wait["Min"]) + int(wait["Max"])) / 2
+        if average_wait > 0:
+            rate = 1 / average_wait
+    if not rate:
+        return TokenBucket(None)
+    return TokenBucket(
+        rate,
+        burst=int(wait.get("Burst", BURST)),
+        min_rate=float(wait["MinRate"]) if "MinRate" in wait else None,
+        max_rate=float(wait["MaxRate"]) if "MaxRate" in wait else None,
+        increase=float(wait.get("Increase", INCREASE)),
+        decrease=float(wait.get("Decrease", DECREASE)),
+        adaptive=str(wait.get("Adaptive", "yes")).lower() not in ("no", "false", "0"),
+    )
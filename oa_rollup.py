@@ -0,0 +1,101 @@
+#####################################################################
+# Daily rollups of the trails by category, difficulty, district and author
+#
+# rollup() groups the synced trail records by every dimension: the
+# records are turned into columns once (measures as arrays of floats),
+# then a plain Python loop per dimension adds every row to its group
+# (the project has no numeric library, so this is not vectorized). The
+# result is one row per (dimension, value) with trail count, distance
+# and duration, written to the TrailRollups table
+# (sql/TrailRollups.sql) by sync_engine, so dashboards read the
+# precomputed numbers instead of the whole Trails table.
+#
+# Enabled by the optional [Rollup] section:
+#   [Rollup]
+#   Dimensions=category,difficulty,district_name,author
+#
+#####################################################################
+# Version: 0.1.0
+# Email: paul.wasicsek@gmail.com
+# Status: dev
+#####################################################################
+
+from array import array
+
+DIMENSIONS = ["category", "difficulty", "district_name", "author"]
+# Columns holding several space-separated values (a trail in two districts
+# counts for both)
+MULTI_VALUE = {"district_name", "customarea"}
+MEASURES = ["distance", "duration"]
+
+
+#
+# Dimensions of the [Rollup] section, None without it
+#
+def read_dimensions(config):
+    if not config.has_section("Rollup"):
+        return None
+    if not config["Rollup"].getboolean("Enabled", fallback=True):
+        return None
+    dimensions = config["Rollup"].get("Dimensions", ",".join(DIMENSIONS))
+    return [d.strip() for d in dimensions.split(",") if d.strip()]
+
+
+def as_float(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+#
+# Records (dicts) to columns: a list per dimension, an array per measure
+#
+def to_columns(records, dimensions):
+    columns = {name: [] for name in dimensions}
+    measures = {name: array("d") for name in MEASURES}
+    for record in records:
+        for name in dimensions:
+            columns[name].append(record.get(name))
+        for name in MEASURES:
+            measures[name].append(as_float(record.get(name)))
+    return columns, measures
+
+
+#
+# Group the records by every dimension, one loop over the rows per dimension
+# Returns rows {dimension, value, total_trails, total_distance, total_duration}
+# (distance in meters, duration in minutes, as in Trails)
+#
+def rollup(records, dimensions=DIMENSIONS):
+    columns, measures = to_columns(records, dimensions)
+    distance = measures["distance"]
+    duration = measures["duration"]
+    rows = []
+    for dimension in dimensions:
+        groups = {}
+        for i, value in enumerate(columns[dimension]):
+            if value is None or value == "":
+                values = [""]
+            elif dimension in MULTI_VALUE:
+                values = str(value).split()
+            else:
+                values = [str(value)]
+            for value in values:
+                group = groups.get(value)
+                if group is None:
+                    group = groups[value] = [0, 0.0, 0.0]
+                group[0] = group[0] + 1
+                group[1] = group[1] + distance[i]
+                group[2] = group[2] + duration[i]
+        for value, (count, total_distance, total_duration) in groups.items():
+            rows.append(
+                {
+                    "dimension": dimension,
+                    "value": value,
+                    "total_trails": count,
+                    "total_distance": round(total_distance, 1),
+                    "total_duration": int(total_duration),
+                }
+            )
+    return rows
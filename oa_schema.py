@@ -0,0 +1,299 @@
+#####################################################################
+# Declarative field extraction for Outdooractive objects
+#
+# Every entity (tour, poi, event, condition) is described by a list of
+# fields: column name, path inside the object, default and type
+# coercion. Schema() compiles the list once into a single Python
+# function that reads all fields of an object in one pass, starting at
+# the object and not at the document root. A missing key, a None on
+# the way or a value that cannot be coerced gives the default instead
+# of an exception.
+#
+# Paths are written as "meta/date/@lastModified"; a numeric segment
+# selects a list item and also accepts a single (non list) element, as
+# xmltodict returns repeated elements as list and single ones as dict.
+# "a/b|c" tries the alternative paths in order.
+#
+#####################################################################
+# Version: 0.1.0
+# Email: paul.wasicsek@gmail.com
+# Status: dev
+#####################################################################
+
+
+#
+# Value passed in at extraction time (object ID, project, language ...)
+#
+class Param:
+    def __init__(self, name):
+        self.name = name
+
+
+class Field:
+    def __init__(self, name, path=None, default=None, coerce=None, param=None):
+        self.name = name
+        self.path = path
+        self.default = default
+        self.coerce = coerce
+        self.param = param
+
+
+#
+# Several columns computed by a function of the object
+#
+class Computed:
+    def __init__(self, names, function):
+        self.names = names
+        self.function = function
+
+
+#
+# Python expression reading path from the object "o"
+#
+def _path_code(path):
+    lines = ["v = o"]
+    for segment in path.split("/"):
+        if segment.isdigit():
+            lines.append("if v.__class__ is list: v = v[%d]" % int(segment))
+        else:
+            lines.append("v = v[%r]" % segment)
+    return lines
+
+
+def _default_code(default, constants):
+    if isinstance(default, Param):
+        return "p[%r]" % default.name
+    constants.append(default)
+    return "D[%d]" % (len(constants) - 1)
+
+
+class Schema:
+    def __init__(self, kind, fields):
+        self.kind = kind
+        self.fields = fields
+        self.names = []
+        constants = []
+        functions = []
+        code = ["def extract(o, p):", "    r = {}"]
+        for field in fields:
+            if isinstance(field, Computed):
+                functions.append(field.function)
+                code.append("    r.update(F[%d](o))" % (len(functions) - 1))
+                self.names.extend(field.names)
+                continue
+            self.names.append(field.name)
+            if field.param is not None:
+                code.append("    r[%r] = p[%r]" % (field.name, field.param))
+                continue
+            default = _default_code(field.default, constants)
+            code.append("    v = None")
+            for alternative in field.path.split("|"):
+                code.append("    if v is None:")
+                code.append("        try:")
+                code.extend("            " + line for line in _path_code(alternative))
+                code.append("        except (KeyError, TypeError, IndexError):")
+                code.append("            v = None")
+            if field.coerce is not None:
+                functions.append(field.coerce)
+                code.append("    if v is not None:")
+                code.append("        try:")
+                code.append("            v = F[%d](v)" % (len(functions) - 1))
+                code.append("        except (ValueError, TypeError):")
+                code.append("            v = None")
+            code.append("    r[%r] = %s if v is None else v" % (field.name, default))
+        code.append("    return r")
+        namespace = {"D": constants, "F": functions}
+        exec(compile("\n".join(code), "<schema %s>" % kind, "exec"), namespace)
+        self.extract = namespace["extract"]
+
+    #
+    # Fields of the object in a parsed /oois document, None without object
+    #
+    def extract_document(self, document, params):
+        try:
+            obj = document["oois"][self.kind]
+        except (KeyError, TypeError):
+            return None
+        if isinstance(obj, list):
+            obj = obj[0]
+        if not isinstance(obj, dict):
+            return None
+        return self.extract(obj, params)
+
+    #
+    # Fields of all objects of a batch of parsed documents, in one pass
+    # params(object_id) returns the parameters of one object
+    #
+    def extract_many(self, documents, params):
+        records = []
+        extract = self.extract
+        kind = self.kind
+        for document in documents:
+            objects = (document.get("oois") or {}).get(kind) or []
+            if not isinstance(objects, list):
+                objects = [objects]
+            for obj in objects:
+                records.append(extract(obj, params(obj.get("@id"))))
+        return records
+
+
+#
+# Numeric value, int if it is a whole number (fits integer and numeric columns)
+#
+def number(value):
+    value = float(value)
+    if value.is_integer():
+        return int(value)
+    return value
+
+
+def as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+#
+# Tourism areas (by name), districts and custom areas (by id) of an object
+#
+def regions(obj):
+    region_name = []
+    district_name = []
+    customarea = []
+    try:
+        found = as_list((obj.get("regions") or {}).get("region"))
+    except AttributeError:
+        found = []
+    for region in found:
+        if not isinstance(region, dict):
+            continue
+        if region.get("@type") == "tourismarea":
+            region_name.append(region.get("@name", ""))
+        if region.get("@type") == "customarea":
+            customarea.append(region.get("@id", ""))
+        if region.get("@type") == "district":
+            district_name.append(region.get("@id", ""))
+    return {
+        "region_name": " ".join(region_name),
+        "district_name": " ".join(district_name),
+        "customarea": " ".join(customarea),
+    }
+
+
+#
+# Point geometry "long,lat" of a condition
+#
+def coordinates(obj):
+    try:
+        long_str, lat_str = obj["geometry"].split(",")
+        return {"lat": float(lat_str), "long": float(long_str)}
+    except (KeyError, AttributeError, ValueError):
+        return {"lat": None, "long": None}
+
+
+REGIONS = Computed(["region_name", "district_name", "customarea"], regions)
+
+TRAIL = Schema(
+    "tour",
+    [
+        Field("name", "title", ""),
+        Field("lang", "localizedTitle/0/@lang", Param("lang")),
+        Field("distance", "length", 0, number),
+        Field("duration", "time/@min", 0, int),
+        Field("ranking", "@ranking", 0, number),
+        Field("trail_id", param="object_id"),
+        Field("author", "meta/authorFull/name", ""),
+        Field("author_id", "meta/authorFull/id", 0, int),
+        Field("difficulty", "rating/@difficulty", 0),
+        Field("category", "category/@id", 0),
+        Field("region", param="region"),
+        Field("date_created", "meta/date/@created", ""),
+        Field("date_lastModified", "meta/date/@lastModified", ""),
+        Field("date_firstPublish", "meta/date/@firstPublish", ""),
+        REGIONS,
+        Field("primaryImage", "primaryImage/@id", ""),
+        Field("project", param="project"),
+    ],
+)
+
+POI = Schema(
+    "poi",
+    [
+        Field("title", "title", ""),
+        Field("lang", "localizedTitle/0/@lang", Param("lang")),
+        Field("destination", "@destination", 0),
+        Field("frontendtype", "@frontendtype", ""),
+        Field("ranking", "@ranking", 0, number),
+        Field("poi_id", param="object_id"),
+        Field("author", "meta/authorFull/name", ""),
+        Field("author_id", "meta/authorFull/id", 0, int),
+        Field("category", "category/@id", 0),
+        Field("category_name", "category/@name", ""),
+        Field("datatype", "category/datatype", ""),
+        Field("region", param="region"),
+        Field("date_created", "meta/date/@created"),
+        Field("date_lastModified", "meta/date/@lastModified"),
+        Field("date_firstPublish", "meta/date/@firstPublish"),
+        REGIONS,
+        Field("primaryImage", "primaryImage/@id", ""),
+        Field("project", param="project"),
+    ],
+)
+
+EVENT = Schema(
+    "event",
+    [
+        Field("title", "title", ""),
+        Field("lang", "localizedTitle/0/@lang", Param("lang")),
+        Field("destination", "@destination", 0),
+        Field("frontendtype", "@frontendtype", ""),
+        Field("ranking", "@ranking", 0, number),
+        Field("event_id", param="object_id"),
+        Field("author", "meta/authorFull/name", ""),
+        Field("author_id", "meta/authorFull/id", 0, int),
+        Field("category", "category/@id", 0),
+        Field("category_name", "category/@name", ""),
+        Field("datatype", "category/datatype", ""),
+        Field("region", param="region"),
+        Field("date_created", "meta/date/@created", ""),
+        Field("date_lastModified", "meta/date/@lastModified", ""),
+        Field("date_firstPublish", "meta/date/@firstPublish", ""),
+        REGIONS,
+        Field("primaryImage", "primaryImage/@id", ""),
+        Field("project", param="project"),
+    ],
+)
+
+CONDITION = Schema(
+    "condition",
+    [
+        Field("condition_id", "@id", Param("object_id")),
+        Field("title", "title", ""),
+        Field("lang", "localizedTitle/0/@lang", ""),
+        Field("status", "meta/workflow/@state", ""),
+        Field("category_id", "category/@id", ""),
+        Field("ranking", "@ranking", 0, number),
+        Field("day_of_inspection", "@dayOfInspection", ""),
+        Field("date_from", "@dateFrom"),
+        Field("valid_to", "@validTo"),
+        Field("frontendtype", "@frontendtype", 0),
+        Field("datatype", "category/datatype", ""),
+        Field("author_id", "meta/authorFull/id", 0, int),
+        Field("author", "meta/authorFull/name|meta/author", ""),
+        Field("long_text", "longText", ""),
+        Field("winter_activity", "winterActivity", ""),
+        Field("geometry", "geometry", ""),
+        Computed(["lat", "long"], coordinates),
+        Field("risk_description", "riskDescription", ""),
+        Field("weather_description", "weatherDescription", ""),
+        Field("category_name", "category/@name", ""),
+        Field("primaryImage", "primaryImage/@id", ""),
+        Field("date_lastModified", "meta/date/@lastModified"),
+        Field("project", param="project"),
+    ],
+)
+
+# Schema by element name
+SCHEMAS = {schema.kind: schema for schema in [TRAIL, POI, EVENT, CONDITION]}
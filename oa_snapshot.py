@@ -0,0 +1,223 @@
+#####################################################################
+# Columnar trail snapshot for trailKM.py
+#
+# The sync (sync_engine, trails) and trailKM.py itself write the
+# listed trails as one binary column file per field into [Snapshot]
+# Path:
+#   trail_id.bin - int64
+#   distance.bin - float64, meters
+#   duration.bin - float64, minutes
+#   modified.bin - float64, lastModified as Unix time (NaN if unknown)
+#   meta.json    - creation time, project, region, number of trails
+# The columns are memory-mapped when read, so the totals of trailKM.py
+# are a sum over two arrays instead of one API request per trail.
+#
+#   [Snapshot]
+#   Path=.oa_snapshot
+#   MaxAge=86400
+#
+# Call:
+# python oa_snapshot.py <ini_file.ini>
+#   prints the totals of the snapshot
+#
+#####################################################################
+# Version: 0.1.0
+# Email: paul.wasicsek@gmail.com
+# Status: dev
+#####################################################################
+
+from array import array
+import configparser
+import json
+import math
+import mmap
+import os
+import sys
+import time
+import oa_delta
+
+SNAPSHOT_PATH = ".oa_snapshot"
+# Seconds after which trailKM.py refreshes the snapshot
+MAX_AGE = 24 * 3600
+COLUMNS = {"trail_id": "q", "distance": "d", "duration": "d", "modified": "d"}
+
+
+#
+# Read the [Snapshot] section of config.ini, None if there is none
+#
+def read_settings(config):
+    if not config.has_section("Snapshot"):
+        return None
+    if not config["Snapshot"].getboolean("Enabled", fallback=True):
+        return None
+    return {
+        "path": config["Snapshot"].get("Path", SNAPSHOT_PATH),
+        "max_age": int(config["Snapshot"].get("MaxAge", MAX_AGE)),
+    }
+
+
+def as_float(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+#
+# lastModified (ISO string) as Unix time, NaN if there is none
+#
+def as_time(value):
+    if isinstance(value, float):
+        return value
+    timestamp = oa_delta.parse_timestamp(value)
+    if timestamp is None or isinstance(timestamp, str):
+        return math.nan
+    return timestamp.timestamp()
+
+
+#
+# Write the snapshot, records are dicts with trail_id, distance, duration
+# and date_lastModified (the Trails columns)
+#
+def write(path, records, project="", region=""):
+    columns = {name: array(code) for name, code in COLUMNS.items()}
+    for record in records:
+        try:
+            trail_id = int(float(record["trail_id"]))
+        except (KeyError, TypeError, ValueError):
+            continue
+        columns["trail_id"].append(trail_id)
+        columns["distance"].append(as_float(record.get("distance")))
+        columns["duration"].append(as_float(record.get("duration")))
+        columns["modified"].append(as_time(record.get("date_lastModified")))
+    os.makedirs(path, exist_ok=True)
+    # meta.json is replaced last, a reader never sees columns of different runs
+    # as long as it checks the count
+    for name, column in columns.items():
+        temp_path = os.path.join(path, "%s.bin.%d.tmp" % (name, os.getpid()))
+        with open(temp_path, "wb") as f:
+            column.tofile(f)
+        os.replace(temp_path, os.path.join(path, name + ".bin"))
+    meta = {
+        "created_at": time.time(),
+        "project": project,
+        "region": str(region),
+        "count": len(columns["trail_id"]),
+    }
+    temp_path = os.path.join(path, "meta.json.%d.tmp" % os.getpid())
+    with open(temp_path, "w") as f:
+        json.dump(meta, f)
+    os.replace(temp_path, os.path.join(path, "meta.json"))
+    return meta
+
+
+class Snapshot:
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+        self.count = meta["count"]
+        self.columns = {}
+        self.maps = []
+        for name, code in COLUMNS.items():
+            if not self.count:
+                self.columns[name] = memoryview(array(code))
+                continue
+            with open(os.path.join(path, name + ".bin"), "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps.append(mapped)
+            self.columns[name] = memoryview(mapped).cast(code)
+            if len(self.columns[name]) != self.count:
+                self.close()
+                raise ValueError("Snapshot column %s is incomplete" % name)
+
+    def age(self):
+        return time.time() - self.meta["created_at"]
+
+    #
+    # Written for this project and region ("+"-joined if the sync merged
+    # the listings of several regions)
+    #
+    def matches(self, project, region):
+        return (
+            self.meta.get("project") == project
+            and self.meta.get("region") == str(region)
+        )
+
+    #
+    # Number of trails, meters and minutes
+    #
+    def totals(self):
+        return (
+            self.count,
+            math.fsum(self.columns["distance"]),
+            math.fsum(self.columns["duration"]),
+        )
+
+    #
+    # {trail_id (str): (distance, duration, modified)}
+    #
+    def entries(self):
+        return {
+            str(trail_id): (distance, duration, modified)
+            for trail_id, distance, duration, modified in zip(
+                self.columns["trail_id"],
+                self.columns["distance"],
+                self.columns["duration"],
+                self.columns["modified"],
+            )
+        }
+
+    def close(self):
+        for column in self.columns.values():
+            column.release()
+        self.columns = {}
+        for mapped in self.maps:
+            mapped.close()
+        self.maps = []
+
+
+#
+# Open the snapshot in path, None if there is none
+#
+def load(path):
+    try:
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        return Snapshot(path, meta)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def main():
+    try:
+        config_file = sys.argv[1]
+    except IndexError:
+        config_file = "config.ini"
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    print_snapshot(read_settings(config) or {"path": SNAPSHOT_PATH})
+
+
+#
+# Print the totals of the snapshot, False if there is none
+#
+def print_snapshot(settings):
+    snapshot = load(settings["path"])
+    if snapshot is None:
+        print("No snapshot in %s" % settings["path"])
+        return False
+    count, meters, minutes = snapshot.totals()
+    print("Snapshot: %s, %.1f hours old" % (settings["path"], snapshot.age() / 3600))
+    print(
+        "Project: %s, region: %s"
+        % (snapshot.meta.get("project"), snapshot.meta.get("region"))
+    )
+    print("Number of trails: %d" % count)
+    print("Number of kilometers: %.1f" % (meters / 1000))
+    print("Total duration: %d minutes" % minutes)
+    snapshot.close()
+    return True
+
+
+if __name__ == "__main__":
+    main()
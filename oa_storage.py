@@ -0,0 +1,450 @@
+#####################################################################
+# Storage backends for the sync
+#
+# The scripts talk to their tables through the PostgREST query builder
+# of the Supabase client:
+#   client.table(name).select(*columns).eq(column, value).gt(...)
+#       .order(column).limit(n).execute()
+#   client.table(name).insert(rows) / .upsert(rows, on_conflict=...)
+#       / .update(values).eq(...) / .delete().eq(...)
+#   client.rpc(function, params).execute()
+# and read response.data (list of row dicts) and response.error.
+# This subset is the storage interface. SQLiteClient implements it on a
+# local SQLite file (WAL, one transaction per bulk write, indexes on the
+# natural keys), with the tables of sql/Trails.sql, sql/DailyStats.sql
+# and sql/TrailRollups.sql; other tables (POIs, events, Conditions) are
+# created on first use and get a column for every new field written.
+#
+# Selected in config.ini:
+#   [Storage]
+#   Backend=sqlite      (default: supabase)
+#   Path=trailkm.db
+#
+#####################################################################
+# Version: 0.1.0
+# Email: paul.wasicsek@gmail.com
+# Status: dev
+#####################################################################
+
+import datetime
+import json
+import sqlite3
+import threading
+
+BACKEND_SUPABASE = "supabase"
+BACKEND_SQLITE = "sqlite"
+SQLITE_PATH = "trailkm.db"
+
+# Tables with a fixed layout (column name -> SQLite type), as in sql/*.sql
+TABLES = {
+    "Trails": {
+        "id": "integer primary key",
+        "created_at": "text default current_timestamp",
+        "region": "text",
+        "name": "text",
+        "category": "text",
+        "distance": "numeric",
+        "difficulty": "text",
+        "ranking": "numeric",
+        "author": "text",
+        "trail_id": "numeric",
+        "duration": "numeric",
+        "new": "boolean",
+        "author_id": "numeric",
+        "lang": "text",
+        "date_created": "text",
+        "date_lastModified": "text",
+        "date_firstPublish": "text",
+        "region_name": "text",
+        "district_name": "text",
+        "customarea": "text",
+        "primaryImage": "text",
+        "project": "text",
+        "removed_at": "text",
+    },
+    "DailyStats": {
+        "id": "integer primary key",
+        "created_at": "text default current_timestamp",
+        "date": "text",
+        "region": "text",
+        "project": "text",
+        "total_trails": "integer",
+        "total_distance": "numeric",
+        "total_duration": "text",
+        "total_pois": "integer",
+        "total_events": "integer",
+    },
+    "TrailRollups": {
+        "id": "integer primary key",
+        "created_at": "text default current_timestamp",
+        "date": "text",
+        "project": "text",
+        "region": "text",
+        "dimension": "text",
+        "value": "text",
+        "total_trails": "integer",
+        "total_distance": "numeric",
+        "total_duration": "numeric",
+    },
+}
+# Unique keys (upsert targets) and lookup indexes per table
+UNIQUE = {
+    "Trails": ["trail_id", "project"],
+    "TrailRollups": ["date", "project", "region", "dimension", "value"],
+}
+INDEXES = {
+    "DailyStats": ["date", "region", "project"],
+    "POIs": ["poi_id"],
+    "events": ["event_id"],
+    "Conditions": ["condition_id"],
+}
+
+
+#
+# Read the [Storage] section of config.ini
+#
+def read_settings(config):
+    settings = {"backend": BACKEND_SUPABASE, "path": SQLITE_PATH}
+    if config.has_section("Storage"):
+        settings["backend"] = config["Storage"].get("Backend", BACKEND_SUPABASE)
+        settings["path"] = config["Storage"].get("Path", SQLITE_PATH)
+    return settings
+
+
+#
+# Client of the configured backend
+#
+def create_client(config):
+    settings = read_settings(config)
+    if settings["backend"] == BACKEND_SQLITE:
+        return SQLiteClient(settings["path"])
+    import supabase
+
+    return supabase.create_client(
+        config["Interface"]["SUPABASE_URL"], config["Interface"]["SUPABASE_KEY"]
+    )
+
+
+def quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+def base_table(name):
+    for table in TABLES:
+        if name.endswith(table):
+            return table
+    return name
+
+
+class Response:
+    def __init__(self, data):
+        self.data = data
+        self.error = None
+
+
+class SQLiteClient:
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("pragma journal_mode=wal")
+        self.db.execute("pragma synchronous=normal")
+        # table -> {column: type}
+        self.columns = {}
+        self.functions = {"trail_totals": self.trail_totals}
+
+    def table(self, name):
+        return Query(self, name)
+
+    def rpc(self, function, params=None):
+        for name, implementation in self.functions.items():
+            # With SUPABASE_TABLE_PREFIX the function name carries the prefix
+            if function.endswith(name):
+                prefix = function[: -len(name)]
+                return Call(implementation, prefix, params or {})
+        raise ValueError("Unknown function %s" % function)
+
+    #
+    # Create the table (SUPABASE_TABLE_PREFIX is kept in the name) and its
+    # indexes on first use, add columns for unknown fields
+    #
+    def ensure_table(self, name, fields=()):
+        with self.lock:
+            if name not in self.columns:
+                rows = self.db.execute("pragma table_info(%s)" % quote(name)).fetchall()
+                if not rows:
+                    layout = TABLES.get(base_table(name), {"id": "integer primary key"})
+                    self.db.execute(
+                        "create table %s (%s)"
+                        % (
+                            quote(name),
+                            ", ".join(
+                                "%s %s" % (quote(column), kind)
+                                for column, kind in layout.items()
+                            ),
+                        )
+                    )
+                    self.create_indexes(name)
+                    rows = self.db.execute(
+                        "pragma table_info(%s)" % quote(name)
+                    ).fetchall()
+                self.columns[name] = {row[1]: row[2].lower() for row in rows}
+            columns = self.columns[name]
+            for field in fields:
+                if field not in columns:
+                    self.db.execute(
+                        "alter table %s add column %s" % (quote(name), quote(field))
+                    )
+                    columns[field] = ""
+            self.db.commit()
+            return columns
+
+    def create_indexes(self, name):
+        table = base_table(name)
+        if table in UNIQUE:
+            self.unique_index(name, UNIQUE[table])
+        for column in INDEXES.get(table, []):
+            self.db.execute(
+                "create index if not exists %s on %s(%s)"
+                % (quote("%s_%s" % (name, column)), quote(name), quote(column))
+            )
+
+    def unique_index(self, name, columns):
+        self.db.execute(
+            "create unique index if not exists %s on %s(%s)"
+            % (
+                quote("%s_%s_key" % (name, "_".join(columns))),
+                quote(name),
+                ", ".join(quote(column) for column in columns),
+            )
+        )
+
+    #
+    # Totals of the trails of a project and region (see sql/TrailTotals.sql)
+    #
+    def trail_totals(self, prefix, params):
+        table = prefix + "Trails"
+        self.ensure_table(table, ["removed_at"])
+        with self.lock:
+            # Trails that left the listing do not count
+            row = self.db.execute(
+                "select count(*), coalesce(sum(distance), 0),"
+                " coalesce(sum(duration), 0) from %s"
+                " where project = ? and region = ? and removed_at is null"
+                % quote(table),
+                (params.get("p_project"), params.get("p_region")),
+            ).fetchone()
+        return [dict(zip(["total_trails", "total_distance", "total_duration"], row))]
+
+
+class Call:
+    def __init__(self, implementation, prefix, params):
+        self.implementation = implementation
+        self.prefix = prefix
+        self.params = params
+
+    def execute(self):
+        return Response(self.implementation(self.prefix, self.params))
+
+
+#
+# Value as stored by SQLite
+#
+def to_sql(value, kind=""):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if kind in ("boolean", "") and isinstance(value, str):
+        return {"true": 1, "false": 0}.get(value.lower(), value)
+    return value
+
+
+#
+# Subset of the PostgREST query builder
+#
+class Query:
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.operation = "select"
+        self.selected = "*"
+        self.filters = []
+        self.ordering = []
+        self.count = None
+        self.rows = []
+        self.values = {}
+        self.on_conflict = None
+
+    def select(self, *columns):
+        columns = [c.strip() for column in columns for c in column.split(",")]
+        if columns and "*" not in columns:
+            self.selected = ", ".join(quote(column) for column in columns)
+        return self
+
+    def filter(self, column, operator, value):
+        self.filters.append((column, operator, value))
+        return self
+
+    def eq(self, column, value):
+        return self.filter(column, "=", value)
+
+    def neq(self, column, value):
+        return self.filter(column, "!=", value)
+
+    def gt(self, column, value):
+        return self.filter(column, ">", value)
+
+    def gte(self, column, value):
+        return self.filter(column, ">=", value)
+
+    def lt(self, column, value):
+        return self.filter(column, "<", value)
+
+    def lte(self, column, value):
+        return self.filter(column, "<=", value)
+
+    def in_(self, column, values):
+        return self.filter(column, "in", list(values))
+
+    def is_(self, column, value):
+        return self.filter(column, "is", None if value in (None, "null") else value)
+
+    def order(self, column, desc=False):
+        self.ordering.append("%s%s" % (quote(column), " desc" if desc else ""))
+        return self
+
+    def limit(self, count):
+        self.count = count
+        return self
+
+    def insert(self, rows):
+        self.operation = "insert"
+        self.rows = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def upsert(self, rows, on_conflict=None):
+        self.operation = "upsert"
+        self.rows = rows if isinstance(rows, list) else [rows]
+        self.on_conflict = on_conflict
+        return self
+
+    def update(self, values):
+        self.operation = "update"
+        self.values = values
+        return self
+
+    def delete(self):
+        self.operation = "delete"
+        return self
+
+    def where(self, columns):
+        if not self.filters:
+            return "", []
+        clauses = []
+        params = []
+        for column, operator, value in self.filters:
+            kind = columns.get(column, "")
+            if operator == "in":
+                clauses.append(
+                    "%s in (%s)" % (quote(column), ", ".join("?" * len(value)))
+                )
+                params.extend(to_sql(v, kind) for v in value)
+            elif operator == "is":
+                clauses.append("%s is ?" % quote(column))
+                params.append(to_sql(value, kind))
+            else:
+                clauses.append("%s %s ?" % (quote(column), operator))
+                params.append(to_sql(value, kind))
+        return " where " + " and ".join(clauses), params
+
+    def execute(self):
+        client = self.client
+        fields = set()
+        for row in self.rows:
+            fields.update(row)
+        fields.update(self.values)
+        fields.update(column for column, _, _ in self.filters)
+        columns = client.ensure_table(self.table, sorted(fields))
+        with client.lock:
+            if self.operation == "select":
+                return Response(self.run_select(columns))
+            if self.operation in ("insert", "upsert"):
+                return Response(self.run_insert(columns))
+            if self.operation == "update":
+                return Response(self.run_update(columns))
+            return Response(self.run_delete(columns))
+
+    def run_select(self, columns):
+        where, params = self.where(columns)
+        sql = "select %s from %s%s" % (self.selected, quote(self.table), where)
+        if self.ordering:
+            sql = sql + " order by " + ", ".join(self.ordering)
+        if self.count is not None:
+            sql = sql + " limit %d" % self.count
+        cursor = self.client.db.execute(sql, params)
+        names = [description[0] for description in cursor.description]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    #
+    # All rows in one transaction
+    #
+    def run_insert(self, columns):
+        if not self.rows:
+            return []
+        fields = sorted({field for row in self.rows for field in row})
+        sql = "insert into %s (%s) values (%s)" % (
+            quote(self.table),
+            ", ".join(quote(field) for field in fields),
+            ", ".join("?" * len(fields)),
+        )
+        if self.on_conflict:
+            keys = [key.strip() for key in self.on_conflict.split(",")]
+            self.client.unique_index(self.table, keys)
+            updates = [field for field in fields if field not in keys]
+            if updates:
+                sql = sql + " on conflict (%s) do update set %s" % (
+                    ", ".join(quote(key) for key in keys),
+                    ", ".join(
+                        "%s = excluded.%s" % (quote(field), quote(field))
+                        for field in updates
+                    ),
+                )
+            else:
+                sql = sql + " on conflict do nothing"
+        db = self.client.db
+        with db:
+            db.executemany(
+                sql,
+                [
+                    [to_sql(row.get(field), columns.get(field, "")) for field in fields]
+                    for row in self.rows
+                ],
+            )
+        return self.rows
+
+    def run_update(self, columns):
+        where, params = self.where(columns)
+        fields = sorted(self.values)
+        db = self.client.db
+        with db:
+            matched = db.execute(
+                "select rowid from %s%s" % (quote(self.table), where), params
+            ).fetchall()
+            db.execute(
+                "update %s set %s%s"
+                % (
+                    quote(self.table),
+                    ", ".join("%s = ?" % quote(field) for field in fields),
+                    where,
+                ),
+                [to_sql(self.values[f], columns.get(f, "")) for f in fields] + params,
+            )
+        return [dict(self.values, rowid=rowid) for (rowid,) in matched]
+
+    def run_delete(self, columns):
+        where, params = self.where(columns)
+        db = self.client.db
+        with db:
+            cursor = db.execute("delete from %s%s" % (quote(self.table), where), params)
+        return [{}] * cursor.rowcount
@@ -0,0 +1,170 @@
+#####################################################################
+# Streaming XML parsing for Outdooractive responses
+#
+# The xmltodict path decodes the whole response into a string and
+# builds the complete document tree before the first ID is read. The
+# functions below walk the XML events incrementally instead
+# (xml.etree.ElementTree.iterparse) and free every element as soon as
+# it was read:
+#   iter_listing() yields the <data> entries of a listing
+#   iter_objects() yields the objects of an <oois> document, converted
+#   to the same dict layout xmltodict produces, so the existing field
+#   extraction works unchanged
+#
+# [Parser] Mode=stream selects this path, Mode=xmltodict (default)
+# the old one; a script name as key selects it per script, e.g.
+#   [Parser]
+#   Mode=xmltodict
+#   trailKM_supabase=stream
+#
+#####################################################################
+# Version: 0.1.0
+# Email: paul.wasicsek@gmail.com
+# Status: dev
+#####################################################################
+
+import io
+import xml.etree.ElementTree as ElementTree
+
+MODE_XMLTODICT = "xmltodict"
+MODE_STREAM = "stream"
+
+
+#
+# Parser mode of a script (the script file name without .py)
+#
+def read_mode(config, script):
+    if not config.has_section("Parser"):
+        return MODE_XMLTODICT
+    return config["Parser"].get(script, config["Parser"].get("Mode", MODE_XMLTODICT))
+
+
+def local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+#
+# Something iterparse can read: the undecoded body of a streamed response,
+# or the already loaded content (cached responses, bytes, str)
+#
+def as_source(data):
+    if isinstance(data, str):
+        return io.BytesIO(data.encode("utf-8"))
+    if isinstance(data, bytes):
+        return io.BytesIO(data)
+    if getattr(data, "_content_consumed", True) or data.raw is None:
+        return io.BytesIO(data.content)
+    data.raw.decode_content = True
+    return data.raw
+
+
+#
+# Same layout as xmltodict: attributes as "@name", repeated children as
+# list, text-only elements as string, empty elements as None
+#
+def element_to_dict(element):
+    result = {}
+    for name, value in element.attrib.items():
+        result["@" + local_name(name)] = value
+    for child in element:
+        tag = local_name(child.tag)
+        value = element_to_dict(child)
+        if tag not in result:
+            result[tag] = value
+        elif isinstance(result[tag], list):
+            result[tag].append(value)
+        else:
+            result[tag] = [result[tag], value]
+    text = (element.text or "").strip()
+    if not result:
+        return text or None
+    if text:
+        result["#text"] = text
+    return result
+
+
+#
+# Yield the entries of a listing (<datalist><data id=".." .../></datalist>)
+# as {"@id": .., "@lastModified": ..} with only the attributes of the entry
+#
+def iter_listing(data):
+    context = ElementTree.iterparse(as_source(data), events=("start", "end"))
+    root = None
+    for event, element in context:
+        if event == "start":
+            if root is None:
+                root = element
+            continue
+        if element is not root and local_name(element.tag) == "data":
+            yield {"@" + local_name(k): v for k, v in element.attrib.items()}
+            element.clear()
+            root.clear()
+
+
+#
+# Yield (kind, object) for every object of an <oois> document
+# kind is the element name (tour, poi, event, condition)
+#
+def iter_objects(data):
+    context = ElementTree.iterparse(as_source(data), events=("start", "end"))
+    depth = 0
+    root = None
+    for event, element in context:
+        if event == "start":
+            if root is None:
+                root = element
+            depth = depth + 1
+            continue
+        depth = depth - 1
+        if depth == 1:
+            yield local_name(element.tag), element_to_dict(element)
+            element.clear()
+            root.clear()
+
+
+#
+# Streaming counterpart of oa_fetch.split_oois()
+#
+def split_oois(data, kind):
+    documents = {}
+    for object_kind, obj in iter_objects(data):
+        if object_kind == kind:
+            documents[obj["@id"]] = {"oois": {kind: obj}}
+    return documents
+
+
+#
+# Listing entries in the selected parser mode
+#
+def read_listing(data, mode=MODE_XMLTODICT):
+    if mode == MODE_STREAM:
+        return list(iter_listing(data))
+    import xmltodict
+
+    if not isinstance(data, (str, bytes)):
+        data = data.text
+    entries = (xmltodict.parse(data).get("datalist") or {}).get("data") or []
+    if not isinstance(entries, list):
+        entries = [entries]
+    return entries
+
+
+#
+# Whole <oois> document in the selected parser mode, {"oois": {kind: object}}
+#
+def read_document(data, mode=MODE_XMLTODICT):
+    if mode != MODE_STREAM:
+        import xmltodict
+
+        if not isinstance(data, (str, bytes)):
+            data = data.text
+        return xmltodict.parse(data)
+    objects = {}
+    for kind, obj in iter_objects(data):
+        if kind not in objects:
+            objects[kind] = obj
+        elif isinstance(objects[kind], list):
+            objects[kind].append(obj)
+        else:
+            objects[kind] = [objects[kind], obj]
+    return {"oois": objects}
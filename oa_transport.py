@@ -0,0 +1,337 @@
+#####################################################################
+# Resilient HTTP transport for the Outdooractive API
+#
+# Transport is a requests HTTPAdapter mounted on the sessions of all
+# scripts (mount()). On top of the plain adapter it adds:
+#   - timeouts for every request (connect and read), nothing can hang
+#   - retries of connection errors, timeouts and 500/502/504 responses
+#     with exponential backoff and full jitter (GET/HEAD only);
+#     429/503 are left to the rate limiter (oa_rate)
+#   - a deadline for the whole run, requests after it fail at once
+#     with DeadlineExceeded, so a cron run always ends
+#   - a circuit breaker: after Threshold consecutive failures all
+#     requests are paused for Cooldown seconds, then one probe request
+#     decides whether to resume or to pause again (with doubled cooldown)
+#   - every failure is classified (timeout, connection, server_error,
+#     ...) and counted for the run report
+#
+# Configured in the optional [Transport] section, see config.example
+#
+#####################################################################
+# Version: 0.1.0
+# Email: paul.wasicsek@gmail.com
+# Status: dev
+#####################################################################
+
+import logging as log
+import random
+import threading
+import time
+from xml.etree.ElementTree import ParseError
+from xml.parsers.expat import ExpatError
+import requests
+from requests.adapters import HTTPAdapter
+import oa_rate
+
+SETTINGS = {
+    "connect_timeout": 5.0,
+    "read_timeout": 30.0,
+    "retries": 3,
+    "backoff_factor": 0.5,
+    "backoff_max": 30.0,
+    "retry_status": (500, 502, 504),
+    # Seconds, 0 = no deadline
+    "run_deadline": 0.0,
+    "breaker_threshold": 5,
+    "breaker_cooldown": 30.0,
+}
+
+
+class DeadlineExceeded(requests.RequestException):
+    pass
+
+
+#
+# Read the [Transport] section of config.ini
+#
+def read_settings(config):
+    settings = dict(SETTINGS)
+    if not config.has_section("Transport"):
+        return settings
+    section = config["Transport"]
+    for key, option in [
+        ("connect_timeout", "ConnectTimeout"),
+        ("read_timeout", "ReadTimeout"),
+        ("backoff_factor", "BackoffFactor"),
+        ("backoff_max", "BackoffMax"),
+        ("run_deadline", "RunDeadline"),
+        ("breaker_cooldown", "BreakerCooldown"),
+    ]:
+        if option in section:
+            settings[key] = float(section[option])
+    for key, option in [
+        ("retries", "Retries"),
+        ("breaker_threshold", "BreakerThreshold"),
+    ]:
+        if option in section:
+            settings[key] = int(section[option])
+    if "RetryStatus" in section:
+        settings["retry_status"] = tuple(
+            int(status)
+            for status in section["RetryStatus"].split(",")
+            if status.strip()
+        )
+    return settings
+
+
+def classify_status(status):
+    if status in oa_rate.THROTTLE_STATUS:
+        return "throttled"
+    if status >= 500:
+        return "server_error"
+    return "client_error"
+
+
+#
+# Failure class of an exception, as used in the run report
+#
+def classify(error):
+    if isinstance(error, DeadlineExceeded):
+        return "deadline"
+    if isinstance(error, requests.Timeout):
+        return "timeout"
+    if isinstance(error, requests.ConnectionError):
+        return "connection"
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return classify_status(error.response.status_code)
+    if isinstance(error, (ParseError, ExpatError)):
+        return "parse"
+    if isinstance(error, KeyError):
+        return "missing"
+    return "other"
+
+
+class CircuitBreaker:
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.current_cooldown = cooldown
+        self.failures = 0
+        self.open_until = None
+        self.probing = False
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    #
+    # Block while the circuit is open, remaining() gives the seconds left
+    # of the run (None without deadline)
+    # Returns True if the request probes the API, it must call release()
+    #
+    def wait(self, remaining):
+        while True:
+            with self.lock:
+                if self.open_until is None:
+                    return False
+                delay = self.open_until - time.monotonic()
+                if delay <= 0 and not self.probing:
+                    # Half open: this request probes the API
+                    self.probing = True
+                    return True
+            left = remaining()
+            if left is not None and left <= 0:
+                raise DeadlineExceeded("run deadline reached while circuit open")
+            if delay <= 0:
+                # Another request is probing, check again shortly
+                delay = 0.5
+            time.sleep(delay if left is None else min(delay, left))
+
+    def success(self):
+        with self.lock:
+            if self.open_until is not None:
+                log.info("Circuit closed, API responding again")
+            self.failures = 0
+            self.open_until = None
+            self.probing = False
+            self.current_cooldown = self.cooldown
+
+    #
+    # End of a probe whatever its outcome: a probe that ended without
+    # success() or failure() (e.g. an unexpected error) lets the next
+    # request probe instead of blocking all requests of the run
+    #
+    def release(self):
+        with self.lock:
+            self.probing = False
+
+    def failure(self):
+        with self.lock:
+            self.failures = self.failures + 1
+            if self.probing:
+                self.probing = False
+                self.current_cooldown = min(
+                    self.current_cooldown * 2, self.cooldown * 8
+                )
+            elif self.open_until is not None or self.failures < self.threshold:
+                return
+            self.open_until = time.monotonic() + self.current_cooldown
+            self.opened = self.opened + 1
+            cooldown = self.current_cooldown
+        print("API degraded, requests paused for %.0fs" % cooldown)
+        log.warning("Circuit open, requests paused for %.0fs" % cooldown)
+
+
+class Transport(HTTPAdapter):
+    def __init__(self, settings=None, **kwargs):
+        self.settings = dict(SETTINGS, **(settings or {}))
+        self.breaker = CircuitBreaker(
+            self.settings["breaker_threshold"], self.settings["breaker_cooldown"]
+        )
+        self.deadline = None
+        if self.settings["run_deadline"]:
+            self.deadline = time.monotonic() + self.settings["run_deadline"]
+        self.lock = threading.Lock()
+        # Failed attempts (retried or not) and failed objects, by class
+        self.attempts = {}
+        self.objects = {}
+        # Requests sent and retries among them
+        self.sent = {"requests": 0, "retries": 0}
+        # Retries are done in send()
+        super().__init__(max_retries=0, **kwargs)
+
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def expired(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def count(self, counts, kind):
+        with self.lock:
+            counts[kind] = counts.get(kind, 0) + 1
+
+    #
+    # Record an object that could not be read (called by the scripts)
+    #
+    def failed(self, error):
+        self.count(self.objects, classify(error))
+
+    def timeout(self, timeout):
+        if timeout is None:
+            timeout = (self.settings["connect_timeout"], self.settings["read_timeout"])
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if remaining <= 0:
+            raise DeadlineExceeded("run deadline reached")
+        if isinstance(timeout, tuple):
+            return tuple(remaining if t is None else min(t, remaining) for t in timeout)
+        return min(timeout, remaining)
+
+    #
+    # Full jitter: random time between 0 and the exponential backoff
+    #
+    def backoff(self, attempt, retry_after=None):
+        delay = random.uniform(
+            0,
+            min(
+                self.settings["backoff_max"],
+                self.settings["backoff_factor"] * 2**attempt,
+            ),
+        )
+        retry_after = oa_rate.parse_retry_after(retry_after)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        remaining = self.remaining()
+        if remaining is not None:
+            delay = min(delay, max(0, remaining))
+        time.sleep(delay)
+
+    def send(self, request, **kwargs):
+        retries = self.settings["retries"] if request.method in ("GET", "HEAD") else 0
+        attempt = 0
+        while True:
+            probe = False
+            try:
+                try:
+                    probe = self.breaker.wait(self.remaining)
+                    kwargs["timeout"] = self.timeout(kwargs.get("timeout"))
+                except DeadlineExceeded:
+                    self.count(self.attempts, "deadline")
+                    raise
+                self.count(self.sent, "requests")
+                if attempt:
+                    self.count(self.sent, "retries")
+                try:
+                    response = super().send(request, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    self.count(self.attempts, classify(e))
+                    self.breaker.failure()
+                    probe = False
+                    if attempt >= retries:
+                        raise
+                    log.debug("Retry %d after %s: %s" % (attempt + 1, classify(e), e))
+                    self.backoff(attempt)
+                    attempt = attempt + 1
+                    continue
+                if response.status_code >= 500:
+                    self.breaker.failure()
+                else:
+                    self.breaker.success()
+                # The probe ended with success() or failure()
+                probe = False
+                if response.status_code >= 400:
+                    self.count(self.attempts, classify_status(response.status_code))
+                if (
+                    response.status_code not in self.settings["retry_status"]
+                    or attempt >= retries
+                ):
+                    return response
+                log.debug(
+                    "Retry %d after HTTP %d" % (attempt + 1, response.status_code)
+                )
+                response.close()
+                self.backoff(attempt, response.headers.get("Retry-After"))
+                attempt = attempt + 1
+            finally:
+                if probe:
+                    self.breaker.release()
+
+    def report(self):
+        with self.lock:
+            return {
+                "requests": self.sent["requests"],
+                "retries": self.sent["retries"],
+                "attempts": dict(self.attempts),
+                "objects": dict(self.objects),
+                "circuit_opened": self.breaker.opened,
+            }
+
+    def print_report(self):
+        report = self.report()
+        for name, title in [
+            ("attempts", "Failed requests"),
+            ("objects", "Failed objects"),
+        ]:
+            counts = report[name]
+            line = "%s: %s" % (
+                title,
+                ", ".join("%s=%d" % item for item in sorted(counts.items())) or "none",
+            )
+            print(line)
+            log.info(line)
+        if report["circuit_opened"]:
+            line = "Circuit opened %d times" % report["circuit_opened"]
+            print(line)
+            log.info(line)
+
+
+#
+# Mount a Transport for http and https on session, returns the transport
+#
+def mount(session, config, **kwargs):
+    transport = Transport(read_settings(config), **kwargs)
+    session.mount("http://", transport)
+    session.mount("https://", transport)
+    return transport
@@ -4,8 +4,11 @@ create table
     created_at timestamp with time zone null default now(),
     date date null,
     region character varying null,
+    project text null,
     total_trails bigint null,
     total_distance numeric null,
     total_duration character varying null,
+    total_pois bigint null,
+    total_events bigint null,
     constraint DailyStats_pkey primary key (id)
   ) tablespace pg_default;
\ No newline at end of file
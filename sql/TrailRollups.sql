@@ -0,0 +1,21 @@
+create table
+  public."TrailRollups" (
+    id bigint generated by default as identity not null,
+    created_at timestamp with time zone null default now(),
+    date date not null,
+    project text not null,
+    region character varying not null,
+    -- category, difficulty, district_name, author
+    dimension text not null,
+    value text not null,
+    total_trails bigint null,
+    -- meters
+    total_distance numeric null,
+    -- minutes
+    total_duration numeric null,
+    constraint TrailRollups_pkey primary key (id),
+    constraint TrailRollups_key unique (date, project, region, dimension, value)
+  ) tablespace pg_default;
+
+-- Written by sync_engine.py with [Rollup] enabled, one row per
+-- (dimension, value) and day, upserted on the unique key above
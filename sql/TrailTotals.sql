@@ -0,0 +1,94 @@
+-- Trail totals per project and region for DailyStats
+--
+-- TrailTotals is maintained by a trigger on Trails: every insert, update
+-- and delete applies its delta (count, distance, duration), so the totals
+-- are current after each write and reading them is a single row lookup.
+-- Trails with removed_at (left the listing, see [Tombstones]) do not count.
+-- trail_totals() is the RPC used by sync_engine.py for the DailyStats row.
+-- With SUPABASE_TABLE_PREFIX, create the objects once per prefix
+-- (table names and the RPC name get the prefix).
+
+create table
+  public."TrailTotals" (
+    project text not null,
+    region character varying not null,
+    total_trails bigint not null default 0,
+    -- meters
+    total_distance numeric not null default 0,
+    -- minutes
+    total_duration numeric not null default 0,
+    updated_at timestamp with time zone null default now(),
+    constraint TrailTotals_pkey primary key (project, region)
+  ) tablespace pg_default;
+
+create or replace function public.trail_totals_apply (
+  p_project text,
+  p_region character varying,
+  p_trails bigint,
+  p_distance numeric,
+  p_duration numeric
+) returns void language sql as $$
+  insert into public."TrailTotals" as t
+    (project, region, total_trails, total_distance, total_duration)
+  values
+    (coalesce(p_project, ''), coalesce(p_region, ''), p_trails,
+     coalesce(p_distance, 0), coalesce(p_duration, 0))
+  on conflict (project, region) do update set
+    total_trails = t.total_trails + excluded.total_trails,
+    total_distance = t.total_distance + excluded.total_distance,
+    total_duration = t.total_duration + excluded.total_duration,
+    updated_at = now();
+$$;
+
+create or replace function public.trail_totals_trigger () returns trigger
+language plpgsql as $$
+begin
+  if tg_op in ('UPDATE', 'DELETE') and old.removed_at is null then
+    perform public.trail_totals_apply(
+      old.project, old.region, -1, -old.distance, -old.duration);
+  end if;
+  if tg_op in ('INSERT', 'UPDATE') and new.removed_at is null then
+    perform public.trail_totals_apply(
+      new.project, new.region, 1, new.distance, new.duration);
+  end if;
+  return null;
+end;
+$$;
+
+-- Only changes of the aggregated columns touch TrailTotals
+create trigger trail_totals_insert_delete
+after insert or delete on public."Trails"
+for each row execute function public.trail_totals_trigger ();
+
+create trigger trail_totals_update
+after update of project, region, distance, duration, removed_at on public."Trails"
+for each row execute function public.trail_totals_trigger ();
+
+-- Totals for DailyStats, one row (zeros if the project has no trails yet)
+create or replace function public.trail_totals (p_project text, p_region text)
+returns table (total_trails bigint, total_distance numeric, total_duration numeric)
+language sql stable as $$
+  select coalesce(sum(t.total_trails), 0)::bigint,
+         coalesce(sum(t.total_distance), 0),
+         coalesce(sum(t.total_duration), 0)
+  from public."TrailTotals" t
+  where t.project = p_project and t.region = p_region;
+$$;
+
+-- Same numbers computed from Trails, to check or rebuild TrailTotals
+create or replace view public."TrailTotalsFull" as
+  select coalesce(project, '') as project,
+         coalesce(region, '') as region,
+         count(*) as total_trails,
+         coalesce(sum(distance), 0) as total_distance,
+         coalesce(sum(duration), 0) as total_duration
+  from public."Trails"
+  where removed_at is null
+  group by 1, 2;
+
+-- Fill TrailTotals for an existing Trails table (and to rebuild it):
+--   truncate public."TrailTotals";
+--   insert into public."TrailTotals"
+--     (project, region, total_trails, total_distance, total_duration)
+--   select project, region, total_trails, total_distance, total_duration
+--   from public."TrailTotalsFull";
@@ -20,5 +20,20 @@ create table
     region_name text null,
     district_name text null,
     customarea text null,
-    constraint Trails_pkey primary key (id)
-  ) tablespace pg_default;
\ No newline at end of file
+    "primaryImage" text null,
+    project text null,
+    -- set by sync_engine.py when the trail left the listing ([Tombstones])
+    removed_at timestamp with time zone null,
+    constraint Trails_pkey primary key (id),
+    constraint Trails_trail_id_project_key unique (trail_id, project)
+  ) tablespace pg_default;
+
+-- Natural key used by the batched upsert in trailKM_supabase.py
+-- (on_conflict=trail_id,project). For an existing table:
+--   alter table public.Trails
+--     add constraint Trails_trail_id_project_key unique (trail_id, project);
+
+-- Tombstones (optional [Tombstones] section), also on POIs and events:
+--   alter table public.Trails add column removed_at timestamp with time zone null;
+--   alter table public."POIs" add column removed_at timestamp with time zone null;
+--   alter table public.events add column removed_at timestamp with time zone null;
@@ -0,0 +1,258 @@
+#####################################################################
+# Bulk helpers shared by the *_supabase scripts
+#
+# load_known_ids() reads all stored IDs of a table once (in ID-range
+# pages, only the columns that are needed), so the Outdooractive
+# listing can be diffed locally instead of sending one SELECT per
+# listed object. iter_rows() is the same paging for whole rows.
+# UpsertWriter collects rows and writes them in chunks, one upsert
+# per chunk keyed on the natural key of the table (and, with max_delay,
+# at the latest max_delay seconds after a row was added). InsertWriter does
+# the same with plain inserts, for tables without such a key.
+# update_ids() sets the same values on many rows, one update per chunk
+# of IDs (id=in.(...)) instead of one per row, delete_ids() deletes them
+# the same way.
+#
+#####################################################################
+# Version: 0.1.0
+# Email: paul.wasicsek@gmail.com
+# Status: dev
+#####################################################################
+
+import logging as log
+import time
+
+# PostgREST returns at most 1000 rows per request by default
+PAGE_SIZE = 1000
+# Rows per upsert request, see UpsertWriter
+CHUNK_SIZE = 500
+# IDs per update request, see update_ids() (they go into the URL)
+ID_CHUNK_SIZE = 500
+
+
+#
+# Listing IDs are strings ("1234"), numeric columns come back as int or float
+# (1234 / 1234.0) - bring both to the same key
+#
+def normalize_id(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+#
+# Load the stored rows of a table into a dict keyed by the normalized ID
+# The table is read in ID-range chunks (keyset pagination on id_column),
+# so the number of round trips is rows / page_size and not one per object
+#
+def load_known_ids(
+    client, table, id_column, project=None, columns=None, page_size=PAGE_SIZE
+):
+    select = [id_column] + [c for c in (columns or []) if c != id_column]
+    known = {}
+    for row in iter_rows(client, table, id_column, project, select, page_size):
+        known[normalize_id(row[id_column])] = row
+    log.debug("Loaded %d known IDs from %s" % (len(known), table))
+    return known
+
+
+#
+# Rows of a table in ID-range pages (id > last ID of the previous page),
+# all columns if columns is None, filters ({column: value}) selects rows
+#
+def iter_rows(
+    client,
+    table,
+    id_column,
+    project=None,
+    columns=None,
+    page_size=PAGE_SIZE,
+    filters=None,
+):
+    select = columns or ["*"]
+    last_id = None
+    while True:
+        query = client.table(table).select(*select)
+        if project is not None:
+            query = query.eq("project", project)
+        for column, value in (filters or {}).items():
+            query = query.eq(column, value)
+        if last_id is not None:
+            query = query.gt(id_column, last_id)
+        response = query.order(id_column).limit(page_size).execute()
+        yield from response.data
+        if len(response.data) < page_size:
+            break
+        last_id = response.data[-1][id_column]
+
+
+#
+# Collect rows and write them in chunks as one upsert per chunk
+# on_conflict names the natural key (e.g. "trail_id,project"), which needs
+# a unique constraint on these columns in the table.
+# A failing chunk does not stop the run, it is recorded in failed_chunks
+# and reported by close()
+# on_written(ids) is called with the IDs of every chunk that was written
+#
+class UpsertWriter:
+    def __init__(
+        self,
+        client,
+        table,
+        on_conflict,
+        chunk_size=CHUNK_SIZE,
+        on_written=None,
+        max_delay=None,
+    ):
+        self.operation = "upserted"
+        self.on_written = on_written
+        self.client = client
+        self.table = table
+        self.on_conflict = on_conflict
+        self.key_columns = [c.strip() for c in on_conflict.split(",")]
+        self.chunk_size = chunk_size
+        # Seconds a row may wait for a full chunk, None waits for the chunk
+        self.max_delay = max_delay
+        self.first_added = None
+        self.rows = {}
+        self.chunks = 0
+        self.written = 0
+        self.failed_chunks = []
+
+    def add(self, row):
+        # The same key twice in one upsert is rejected by Postgres, keep the last
+        key = tuple(normalize_id(row[c]) for c in self.key_columns)
+        self.rows[key] = row
+        if self.first_added is None:
+            self.first_added = time.monotonic()
+        if len(self.rows) >= self.chunk_size or (
+            self.max_delay is not None
+            and time.monotonic() - self.first_added >= self.max_delay
+        ):
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        chunk = list(self.rows.values())
+        self.rows = {}
+        self.first_added = None
+        self.chunks = self.chunks + 1
+        try:
+            self.send(chunk)
+            self.written = self.written + len(chunk)
+            if self.on_written is not None:
+                self.on_written(
+                    [normalize_id(row[self.key_columns[0]]) for row in chunk]
+                )
+            log.debug(
+                "%s chunk %d: %d rows %s"
+                % (self.table, self.chunks, len(chunk), self.operation)
+            )
+        except Exception as e:
+            ids = [normalize_id(row[self.key_columns[0]]) for row in chunk]
+            self.failed_chunks.append(
+                {"chunk": self.chunks, "ids": ids, "error": str(e)}
+            )
+            print(
+                "ERROR: %s chunk %d (%d rows): %s"
+                % (self.table, self.chunks, len(chunk), e)
+            )
+            log.error(
+                "%s chunk %d failed for IDs %s: %s"
+                % (self.table, self.chunks, ",".join(ids), e)
+            )
+
+    def send(self, chunk):
+        (
+            self.client.table(self.table)
+            .upsert(chunk, on_conflict=self.on_conflict)
+            .execute()
+        )
+
+    def close(self):
+        self.flush()
+        failed_rows = sum(len(chunk["ids"]) for chunk in self.failed_chunks)
+        print(
+            "%s: %d rows %s in %d chunks, %d chunks (%d rows) failed"
+            % (
+                self.table,
+                self.written,
+                self.operation,
+                self.chunks,
+                len(self.failed_chunks),
+                failed_rows,
+            )
+        )
+        log.info(
+            "%s: %d rows %s, %d chunks failed"
+            % (self.table, self.written, self.operation, len(self.failed_chunks))
+        )
+        return self.failed_chunks
+
+
+#
+# Chunked bulk insert for new rows of tables without a unique natural key
+# id_column is only used to drop duplicates and to report failed chunks
+#
+class InsertWriter(UpsertWriter):
+    def __init__(
+        self,
+        client,
+        table,
+        id_column,
+        chunk_size=CHUNK_SIZE,
+        on_written=None,
+        max_delay=None,
+    ):
+        super().__init__(client, table, id_column, chunk_size, on_written, max_delay)
+        self.operation = "inserted"
+
+    def send(self, chunk):
+        self.client.table(self.table).insert(chunk).execute()
+
+
+#
+# Set values on the rows with the given IDs, one update per chunk of IDs
+# Returns the number of IDs in the chunks that were sent without error
+#
+def update_ids(
+    client, table, id_column, ids, values, project=None, chunk_size=ID_CHUNK_SIZE
+):
+    ids = list(ids)
+    updated = 0
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start : start + chunk_size]
+        query = client.table(table).update(values).in_(id_column, chunk)
+        if project is not None:
+            query = query.eq("project", project)
+        try:
+            query.execute()
+            updated = updated + len(chunk)
+        except Exception as e:
+            print("ERROR: %s update of %d rows: %s" % (table, len(chunk), e))
+            log.error("%s update failed for IDs %s: %s" % (table, ",".join(chunk), e))
+    log.debug("%s: %d rows updated with %s" % (table, updated, values))
+    return updated
+
+
+#
+# Delete the rows with the given IDs, one delete per chunk of IDs
+# Returns the number of IDs in the chunks that were sent without error
+#
+def delete_ids(client, table, id_column, ids, chunk_size=ID_CHUNK_SIZE):
+    ids = list(ids)
+    deleted = 0
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start : start + chunk_size]
+        try:
+            client.table(table).delete().in_(id_column, chunk).execute()
+            deleted = deleted + len(chunk)
+        except Exception as e:
+            print("ERROR: %s delete of %d rows: %s" % (table, len(chunk), e))
+            log.error(
+                "%s delete failed for IDs %s: %s"
+                % (table, ",".join(str(i) for i in chunk), e)
+            )
+    log.debug("%s: %d rows deleted" % (table, deleted))
+    return deleted
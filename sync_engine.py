@@ -0,0 +1,1414 @@
+#####################################################################
+# Call:
+# python sync_engine.py <ini_file.ini> [trails] [pois] [events] [conditions]
+#   ini_file.ini - is optional, by default it is config.ini
+#   without entity names all four entities are synchronised
+#
+# Sync engine behind trailKM_supabase, POIs_supabase, events_supabase and
+# conditions_supabase. Every entity runs the same pipeline
+#   listing -> diff -> fetch -> extract -> write
+# and only describes what differs (endpoint, table, schema, statistics).
+# All entities run in one process, each in its own thread, over one
+# requests session (one connection pool, one response cache), one
+# storage client (Supabase or SQLite, see oa_storage) and one request
+# budget (the adaptive rate limiter of oa_rate is shared by all of them).
+# Session and client are created on first use; Engine.reconcile() only
+# checks the stored rows against the listings (see trailkm_cli.py).
+#
+# Prerequisite:
+#  API access for Outdooractive, see
+#  http://developers.outdooractive.com/API-Reference/Data-API.html
+#
+#####################################################################
+# Version: 0.1.0
+# Email: paul.wasicsek@gmail.com
+# Status: dev
+#####################################################################
+
+import configparser
+import copy
+import datetime
+from datetime import timedelta, date
+import logging as log
+import os
+import sys
+import threading
+import supabase_bulk
+import oa_fetch
+import oa_cache
+import oa_stream
+import oa_schema
+import oa_delta
+import oa_journal
+import oa_listing
+import oa_metrics
+import oa_rollup
+import oa_snapshot
+import oa_storage
+import oa_transport
+
+OA_BASE_URL = "https://www.outdooractive.com/api/project/"
+# Status of stored conditions that are no longer listed
+REJECTED = "rejected"
+
+
+#
+# Shared state of a run: configuration, HTTP session, Supabase client
+# and the request budget
+# With a [Targets] section the run covers several projects and regions,
+# target() gives the Engine of one project that shares all of the above
+#
+class Engine:
+    def __init__(self, config):
+        self.config = config
+        interface = config["Interface"]
+        self.project = interface["OUTDOORACTIVE_PROJECT"]
+        self.key = interface["OUTDOORACTIVE_API"]
+        self.lang = interface.get("OUTDOORACTIVE_LANGUAGE", "")
+        # Another base URL points the run to a stand-in server
+        self.base_url = interface.get("OUTDOORACTIVE_URL", OA_BASE_URL).rstrip("/")
+        self.area = interface.get("OUTDOORACTIVE_REGION", 0)
+        # Regions listed for the project, objects of several are fetched once
+        self.regions = [self.area]
+        # (project, API key, regions) of the run, see read_targets()
+        self.targets = read_targets(config)
+        # Position in [Targets]: the snapshot for trailKM.py is written by
+        # the first target, shared objects are owned by the first listing them
+        self.index = 0
+        self.first = True
+        self.prefix = interface.get("SUPABASE_TABLE_PREFIX", "")
+        self.batch_size = int(
+            interface.get("SUPABASE_BATCH_SIZE", supabase_bulk.CHUNK_SIZE)
+        )
+        self.today = date.today()
+        self.sync_mode = oa_delta.read_mode(config)
+        # The limiter in fetch_settings["rate"] is one budget for all entities
+        self.fetch_settings = oa_fetch.read_settings(config)
+
+        # HTTP session and storage client are created on first use,
+        # the targets share them (and the lock) through this dict
+        self.lock = threading.Lock()
+        self.shared = {}
+        # Listings of the targets by entity and target index (see claim())
+        self.listings = {}
+        self.listed_all = threading.Condition(self.lock)
+
+        # Listing snapshots of the previous runs, see [Tombstones]
+        self.tombstone_settings = oa_listing.read_settings(config)
+
+        # Latency of the stages and counters of the run, see [Metrics]
+        self.metrics = oa_metrics.Metrics()
+        self.metrics_settings = oa_metrics.read_settings(config)
+
+        # Progress of the entity runs, so a crashed run can be resumed
+        self.journal = None
+        # Seconds the writers keep rows, None without journal (full chunks)
+        self.flush_interval = None
+        journal_settings = oa_journal.read_settings(config)
+        if journal_settings is not None:
+            self.journal = oa_journal.Journal(
+                journal_settings["path"], journal_settings["max_age"]
+            )
+            self.flush_interval = journal_settings["flush_interval"]
+
+    #
+    # GET responses go through the on-disk cache if [Cache] is configured,
+    # the rest through the transport (timeouts, retries, circuit breaker)
+    #
+    @property
+    def session(self):
+        with self.lock:
+            if "session" not in self.shared:
+                session = oa_cache.CachedSession(self.config)
+                # Enough pooled connections for the workers of all entities
+                # of all targets
+                workers = self.fetch_settings["concurrency"] * len(ENTITIES)
+                self.shared["transport"] = oa_transport.mount(
+                    session,
+                    self.config,
+                    pool_maxsize=max(10, workers * len(self.targets)),
+                )
+                self.shared["session"] = session
+            return self.shared["session"]
+
+    @property
+    def transport(self):
+        self.session
+        return self.shared["transport"]
+
+    #
+    # Worker processes that parse and extract the /oois responses, None
+    # without [Fetch] Processes
+    #
+    @property
+    def pool(self):
+        with self.lock:
+            if "pool" not in self.shared:
+                self.shared["pool"] = oa_fetch.create_pool(
+                    self.fetch_settings["processes"]
+                )
+            return self.shared["pool"]
+
+    #
+    # Supabase, or the local SQLite file with [Storage] Backend=sqlite
+    # (every call is timed as stage "supabase")
+    #
+    @property
+    def client(self):
+        with self.lock:
+            if "client" not in self.shared:
+                self.shared["client"] = oa_metrics.TimedClient(
+                    oa_storage.create_client(self.config), self.metrics
+                )
+            return self.shared["client"]
+
+    #
+    # Engine of one project of [Targets]: own project, key and regions,
+    # everything else is shared with this one
+    #
+    def target(self, project, key, regions, index=0):
+        target = copy.copy(self)
+        target.project = project
+        target.key = key
+        target.regions = regions
+        target.area = regions[0]
+        target.index = index
+        target.first = index == 0
+        return target
+
+    def target_engines(self):
+        if not self.config.has_section("Targets"):
+            return [self]
+        return [
+            self.target(project, key, regions, index=i)
+            for i, (project, key, regions) in enumerate(self.targets)
+        ]
+
+    #
+    # Objects of the tables without a project filter (POIs, events,
+    # conditions) are stored once for all projects. The owner of an ID
+    # listed by several targets is the first of them in [Targets], so
+    # whichever thread gets there first, the same project fetches it
+    #
+    def claim(self, entity, ids):
+        listings = self.shared_listings(entity)
+        if listings is None:
+            return ids
+        earlier = set()
+        for index, listing in listings.items():
+            if index < self.index and listing is not None:
+                earlier.update(listing.ids())
+        pending = [object_id for object_id in ids if object_id not in earlier]
+        skipped = len(ids) - len(pending)
+        if skipped:
+            log.info(
+                "%s %s: %d IDs fetched by another project"
+                % (entity.name, self.project, skipped)
+            )
+        return pending
+
+    #
+    # Hand the listing of an entity (None if it failed) to the other
+    # targets; only the first call of a target counts
+    #
+    def publish(self, entity, listing):
+        with self.listed_all:
+            listings = self.listings.setdefault(entity.name, {})
+            if self.index not in listings:
+                listings[self.index] = listing
+                self.listed_all.notify_all()
+
+    #
+    # Listings of all targets by target index once every target published
+    # one, None if the table is not shared by several targets
+    #
+    def shared_listings(self, entity):
+        if len(self.targets) == 1 or entity.project_filter:
+            return None
+        with self.listed_all:
+            self.listed_all.wait_for(
+                lambda: len(self.listings.get(entity.name, {})) == len(self.targets)
+            )
+            return dict(self.listings[entity.name])
+
+    #
+    # Outdooractive API URL of path (e.g. "pois", "oois/123")
+    # area=True filters by the region of the engine, a region ID by this one
+    #
+    def api_url(self, path, lang=None, area=False):
+        url = self.base_url + "/" + self.project + "/" + path + "?key=" + self.key
+        if lang is not None:
+            url = url + "&lang=" + lang
+        if area is True:
+            area = self.area
+        if area is not False and area != 0:
+            url = url + "&area=" + str(area)
+        return url
+
+    #
+    # Run the given entities (all if None) concurrently and store the
+    # daily statistics they collected
+    # Returns False if an entity failed
+    #
+    def run(self, names=None):
+        entities = self.start(names, "run")
+
+        # One DailyStats row per table, project and region, merged over all
+        # entities (failed entities write no statistics, the stored row of
+        # the day is kept)
+        daily_stats = {}
+        for entity in entities:
+            if not entity.completed:
+                continue
+            for area in entity.engine.regions:
+                stats = entity.daily_stats(area)
+                if stats is None:
+                    continue
+                key = (entity.stats_table, entity.engine.project, area)
+                daily_stats.setdefault(key, (entity.engine, {}))[1].update(stats)
+        for (table, project, area), (target, stats) in daily_stats.items():
+            target.store_daily_stats(table, stats, area)
+        self.report_metrics()
+        return check_completed(entities)
+
+    #
+    # Check the stored rows of the given entities (all if None) against
+    # their listing, nothing is fetched or written but the marks
+    #
+    def reconcile(self, names=None):
+        entities = self.start(names, "reconcile")
+        self.report_metrics()
+        return check_completed(entities)
+
+    #
+    # Call the given stage of the entities of all targets concurrently,
+    # one thread each
+    #
+    def start(self, names, stage):
+        entities = [
+            ENTITIES[name](target)
+            for target in self.target_engines()
+            for name in names or ENTITIES
+        ]
+        threads = [
+            threading.Thread(
+                target=self.call, args=(entity, stage), name=entity.thread_name()
+            )
+            for entity in entities
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        pool = self.shared.pop("pool", None)
+        if pool is not None:
+            pool.shutdown()
+        if "session" in self.shared:
+            self.session.print_cache_stats()
+            self.fetch_settings["rate"].print_summary()
+            self.transport.print_report()
+        return entities
+
+    #
+    # Thread target: an error ends the entity, it stays not completed
+    #
+    def call(self, entity, stage):
+        try:
+            getattr(entity, stage)()
+        except Exception as e:
+            print("ERROR:", e)
+            log.exception(e)
+        finally:
+            # Targets waiting for the listings must not wait for a failed one
+            entity.engine.publish(entity, None)
+
+    #
+    # Add the counters of transport, cache and limiter to the metrics and
+    # write the run report
+    #
+    def report_metrics(self):
+        if "session" in self.shared:
+            transport = self.transport.report()
+            self.metrics.count("requests", transport["requests"])
+            self.metrics.count("retries", transport["retries"])
+            for reason, count in transport["attempts"].items():
+                self.metrics.count("failed_requests", count, reason=reason)
+            if self.session.cache is not None:
+                cache = self.session.cache.summary()
+                for name in ["hits", "revalidated", "misses"]:
+                    self.metrics.count("cache_" + name, cache[name])
+            self.metrics.count(
+                "throttled", self.fetch_settings["rate"].summary()["throttled"]
+            )
+        self.metrics.report(self.metrics_settings)
+
+    def store_daily_stats(self, table, stats, area=None):
+        if area is None:
+            area = self.area
+        data = dict(
+            stats,
+            date=self.today.isoformat(),
+            region=str(area),
+            project=self.project,
+        )
+        response = (
+            self.client.table(table)
+            .select("*")
+            .eq("date", self.today)
+            .eq("region", area)
+            .eq("project", self.project)
+            .execute()
+        )
+        if len(response.data) > 0:
+            print("Updating data")
+            try:
+                response = (
+                    self.client.table(table)
+                    .update(data)
+                    .eq("date", self.today)
+                    .eq("region", area)
+                    .eq("project", self.project)
+                    .execute()
+                )
+            except Exception as e:
+                print("ERROR:", e)
+                log.error(e)
+                return
+            check_operation_result(response, "Daily statistics", "update")
+        else:
+            print("Insering data")
+            try:
+                response = self.client.table(table).insert(data).execute()
+            except Exception as e:
+                print("ERROR:", e)
+                log.error(e)
+                return
+            check_operation_result(response, "Daily statistics", "insert")
+
+
+#
+# Pipeline of one entity type, the subclasses fill in the differences
+#
+class Entity:
+    # Name on the command line
+    name = ""
+    # Element name in /oois documents
+    kind = ""
+    # Listing endpoint
+    listing = ""
+    # Former script, its name still selects the [Parser] mode
+    script = ""
+    table = ""
+    id_column = ""
+    schema = None
+    # Language of the detail documents, None for [Interface] OUTDOORACTIVE_LANGUAGE
+    lang = None
+    # Stored objects are loaded for the project only
+    project_filter = False
+    known_columns = ["date_lastModified"]
+    # Natural key for upserts, None writes new objects with plain inserts
+    on_conflict = None
+    # Rows of objects that left the listing get removed_at ([Tombstones])
+    tombstones = False
+    # Table of the daily statistics row
+    stats_table = "DailyStats"
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.client = engine.client
+        self.parser = oa_stream.read_mode(engine.config, self.script)
+        if len(engine.targets) > 1:
+            self.metrics = engine.metrics.labelled(
+                entity=self.name, project=engine.project
+            )
+        else:
+            self.metrics = engine.metrics.labelled(entity=self.name)
+        self.listed = None
+        # With several regions: the listing of every region and the first
+        # region that listed an object (its region column)
+        self.region_listings = {}
+        self.region_of = {}
+        self.known = {}
+        # After a resume self.known only holds the pending IDs
+        self.reload_known = False
+        self.unverified = set()
+        # oa_journal.Run of this run, None without [Journal]
+        self.checkpoint = None
+        # Set when the stage ran to its end, a failed entity writes no
+        # statistics and the run exits non-zero
+        self.completed = False
+        if self.on_conflict is None:
+            self.writer = supabase_bulk.InsertWriter(
+                self.client,
+                self.table_name(),
+                self.id_column,
+                chunk_size=engine.batch_size,
+                on_written=self.written,
+                max_delay=engine.flush_interval,
+            )
+        else:
+            self.writer = supabase_bulk.UpsertWriter(
+                self.client,
+                self.table_name(),
+                self.on_conflict,
+                chunk_size=engine.batch_size,
+                on_written=self.written,
+                max_delay=engine.flush_interval,
+            )
+
+    def table_name(self):
+        return self.table
+
+    def thread_name(self):
+        if len(self.engine.targets) > 1:
+            return "%s@%s" % (self.name, self.engine.project)
+        return self.name
+
+    def run(self):
+        log.info("%s: sync start" % self.name)
+        if self.engine.journal is not None:
+            self.checkpoint = self.engine.journal.open_run(
+                self.name, self.engine.project
+            )
+        if self.checkpoint is not None and self.checkpoint.resumed:
+            pending = self.engine.claim(self, self.resume())
+        else:
+            if not self.list_objects():
+                return
+            pending = self.engine.claim(self, self.diff(self.listed))
+            if self.checkpoint is not None:
+                self.checkpoint.start(
+                    self.listed, pending, self.known, self.checkpoint_state()
+                )
+        self.metrics.count("objects_pending", len(pending))
+        for object_id, data in self.extracted(self.fetch(pending)):
+            self.write(object_id, data)
+        self.writer.close()
+        self.mark_tombstones()
+        self.finish()
+        if self.checkpoint is not None:
+            self.checkpoint.finish()
+        self.completed = True
+        log.info("%s: sync end" % self.name)
+
+    #
+    # Reconcile only: the stored rows are checked against the listing
+    # (tombstones, see Conditions for the expired conditions)
+    #
+    def reconcile(self):
+        if self.engine.tombstone_settings is None or not self.tombstones:
+            print("%s: nothing to reconcile" % self.name)
+            self.completed = True
+            return
+        log.info("%s: reconcile start" % self.name)
+        if not self.list_objects():
+            return
+        self.load_known()
+        self.mark_tombstones()
+        self.completed = True
+        log.info("%s: reconcile end" % self.name)
+
+    #
+    # Read the listing into self.listed, False if it failed
+    #
+    def list_objects(self):
+        try:
+            self.listed = self.read_listing()
+        except Exception as e:
+            self.engine.transport.failed(e)
+            print("ERROR:", e)
+            log.error(e)
+            return False
+        self.metrics.count("objects_listed", len(self.listed))
+        self.engine.publish(self, self.listed)
+        return True
+
+    #
+    # Continue a crashed run from the journal: listing, stored values and
+    # state come from the journal, only the unfinished IDs are fetched
+    #
+    def resume(self):
+        entries, pending, self.known, state = self.checkpoint.restore()
+        self.listed = oa_listing.Listing.from_entries(entries)
+        self.engine.publish(self, self.listed)
+        self.reload_known = True
+        self.restore_state(state)
+        if len(self.engine.regions) > 1:
+            # The journal keeps the merged listing, the region listings
+            # are read again for the statistics and the region column
+            try:
+                self.read_listing()
+            except Exception as e:
+                self.engine.transport.failed(e)
+                log.warning("%s: region listings not read: %s" % (self.name, e))
+        print("Resuming %s: %d IDs left" % (self.name, len(pending)))
+        log.info("%s: resuming, %d IDs left" % (self.name, len(pending)))
+        return pending
+
+    #
+    # Entity state needed to resume after the diff (see Trails)
+    #
+    def checkpoint_state(self):
+        return {"unverified": list(self.unverified)}
+
+    def restore_state(self, state):
+        self.unverified = set(state["unverified"])
+
+    def record(self, state, ids):
+        if self.checkpoint is not None:
+            self.checkpoint.record(state, ids)
+
+    # Called by the writer for every chunk that was stored
+    def written(self, ids):
+        self.record(oa_journal.WRITTEN, ids)
+        self.metrics.count("objects_written", len(ids))
+
+    #
+    # Listing stage: the listed objects as oa_listing.Listing (IDs and
+    # lastModified in typed arrays, the parsed document is not kept)
+    #
+    def read_listing(self):
+        if len(self.engine.regions) == 1:
+            return self.read_region_listing(True)
+        # Objects listed in several regions are kept once
+        listed = oa_listing.Listing()
+        self.region_of = {}
+        for area in self.engine.regions:
+            listing = self.read_region_listing(area)
+            self.region_listings[area] = listing
+            for object_id, modified in listing.items():
+                if object_id not in self.region_of:
+                    self.region_of[object_id] = area
+                    listed.append(object_id, modified)
+        log.info(
+            "%s %s: %d objects in %d regions"
+            % (self.name, self.engine.project, len(listed), len(self.engine.regions))
+        )
+        return listed
+
+    def read_region_listing(self, area):
+        url = self.engine.api_url(self.listing, area=area)
+        log.debug("Get region URL:" + url)
+        with self.metrics.timer("listing"):
+            response = self.engine.session.get(url, stream=True)
+            listing = oa_listing.read(response, self.parser)
+        self.metrics.count("bytes_received", oa_metrics.transferred(response))
+        return listing
+
+    #
+    # Diff stage: IDs that have to be fetched, new ones first
+    #
+    def diff(self, entries):
+        self.load_known()
+        pending = [
+            object_id for object_id in entries.ids() if object_id not in self.known
+        ]
+        print("." * (len(entries) - len(pending)), end="")
+        return pending + self.modified(entries)
+
+    #
+    # Load the stored objects once, the listing is diffed locally
+    #
+    def load_known(self):
+        self.known = supabase_bulk.load_known_ids(
+            self.client,
+            self.table_name(),
+            self.id_column,
+            project=self.engine.project if self.project_filter else None,
+            columns=self.known_columns,
+        )
+
+    #
+    # All stored objects, also after a resume (the journal only kept the
+    # stored values of the pending IDs)
+    #
+    def load_all_known(self):
+        if self.reload_known:
+            self.load_known()
+            self.reload_known = False
+
+    #
+    # Stored objects to refresh, only in [Sync] Mode=Delta
+    #
+    def modified(self, entries):
+        if self.engine.sync_mode != oa_delta.MODE_DELTA:
+            return []
+        modified, unverified = oa_delta.split_known(entries, self.known)
+        self.unverified = set(unverified) - set(modified)
+        return modified + list(self.unverified)
+
+    #
+    # Fetch stage: yields (object_id, document) of the changed objects,
+    # (object_id, record) if the worker processes extract the fields
+    #
+    def fetch(self, pending):
+        pool = self.engine.pool
+        for object_id, document, error in oa_fetch.fetch_objects(
+            self.engine.session,
+            pending,
+            self.object_url,
+            self.kind,
+            parser=self.parser,
+            metrics=self.metrics,
+            pool=pool,
+            params=self.params if pool is not None else None,
+            **self.engine.fetch_settings,
+        ):
+            if error is not None:
+                self.engine.transport.failed(error)
+                self.record(oa_journal.FAILED, [object_id])
+                self.metrics.count("objects_failed")
+                # After the run deadline every request fails, only count them
+                if not isinstance(error, oa_transport.DeadlineExceeded):
+                    print("ERROR:", error)
+                    log.error(error)
+                continue
+            if pool is not None:
+                document, last_modified = document
+            else:
+                last_modified = oa_delta.last_modified(document, self.kind)
+            if object_id in self.unverified and not oa_delta.is_modified(
+                last_modified, self.known[object_id]["date_lastModified"]
+            ):
+                self.record(oa_journal.SKIPPED, [object_id])
+                self.metrics.count("objects_skipped")
+                continue
+            yield object_id, document
+
+    #
+    # Extract stage: yields (object_id, data) of the fetched objects
+    #
+    def extracted(self, fetched):
+        for object_id, document in fetched:
+            self.record(oa_journal.FETCHED, [object_id])
+            self.metrics.count("objects_fetched")
+            if self.engine.pool is not None:
+                # Extracted by the worker process (stage "parse")
+                data = document
+            else:
+                with self.metrics.timer("extract"):
+                    data = self.extract(object_id, document)
+            yield object_id, data
+
+    #
+    # Detail document URL of one object (or of comma-separated IDs)
+    #
+    def object_url(self, object_id):
+        lang = self.engine.lang if self.lang is None else self.lang
+        return self.engine.api_url("oois/" + str(object_id), lang=lang)
+
+    #
+    # Extract stage
+    #
+    def extract(self, object_id, document):
+        return self.schema.extract_document(document, self.params(object_id))
+
+    def params(self, object_id):
+        return {
+            "object_id": object_id,
+            "lang": self.engine.lang,
+            "region": str(self.region_of.get(object_id, self.engine.area)),
+            "project": self.engine.project,
+        }
+
+    #
+    # Write stage: new objects are inserted in chunks, stored ones updated
+    #
+    def write(self, object_id, data):
+        if data is None:
+            return
+        if object_id in self.known:
+            self.update(data)
+        else:
+            self.insert(data)
+
+    def insert(self, data):
+        print("Inserting %s %s" % (self.kind, data[self.id_column]))
+        data["new"] = True
+        self.writer.add(data)
+
+    def update(self, data):
+        print("Updating %s %s" % (self.kind, data[self.id_column]))
+        try:
+            response = (
+                self.client.table(self.table_name())
+                .update(data)
+                .eq(self.id_column, data[self.id_column])
+                .eq("project", data["project"])
+                .execute()
+            )
+        except Exception as e:
+            print("ERROR:", e)
+            log.error(e)
+            return
+        if not response.data:
+            # No row of this project, e.g. stored by another project of
+            # [Targets]: the object is not synced
+            line = "Failed to update %s %s of project %s, no stored row" % (
+                self.kind,
+                data[self.id_column],
+                data["project"],
+            )
+            print(line)
+            log.warning(line)
+            self.record(oa_journal.FAILED, [data[self.id_column]])
+            self.metrics.count("objects_failed")
+            return
+        check_operation_result(response, self.table_name(), "update")
+        self.written([data[self.id_column]])
+
+    #
+    # (listed IDs, projects, projects and regions key) the stored rows are
+    # checked against. A table shared by several targets is checked once,
+    # by the first target, against the listings of all of them: an object
+    # is only gone when no target lists it. None for the other targets or
+    # if a listing is missing
+    #
+    def reconciled_listing(self):
+        listings = self.engine.shared_listings(self)
+        if listings is None:
+            return (
+                self.listed.ids(),
+                [self.engine.project],
+                (
+                    self.engine.project,
+                    "+".join(str(area) for area in self.engine.regions),
+                ),
+            )
+        if self.engine.index != 0:
+            return None
+        if any(listing is None for listing in listings.values()):
+            line = "%s: a target has no listing, stored rows left unchanged" % (
+                self.name
+            )
+            print(line)
+            log.warning(line)
+            return None
+        listed = set()
+        for listing in listings.values():
+            listed.update(listing.ids())
+        projects = list(dict.fromkeys(target[0] for target in self.engine.targets))
+        key = (
+            "+".join(projects),
+            "+".join(
+                "%s-%s" % (project, area)
+                for project, key, regions in self.engine.targets
+                for area in regions
+            ),
+        )
+        return listed, projects, key
+
+    #
+    # Tombstone stage: the listing is diffed against the one of the previous
+    # run (sorted ID arrays, see oa_listing), rows of removed objects get
+    # removed_at, rows of objects listed again get it cleared
+    #
+    def mark_tombstones(self):
+        settings = self.engine.tombstone_settings
+        if settings is None or not self.tombstones or not self.listed:
+            return
+        reconciled = self.reconciled_listing()
+        if reconciled is None:
+            return
+        listed, projects, (project_key, area_key) = reconciled
+        self.load_all_known()
+        file_path = oa_listing.file_name(
+            settings["path"], self.name, project_key, area_key
+        )
+        current = oa_listing.to_array(listed)
+        previous = oa_listing.load(file_path)
+        if previous is not None:
+            added, removed = oa_listing.diff(previous, current)
+            removed = [str(object_id) for object_id in removed]
+            # Only stored objects can carry a removed_at
+            returned = [
+                str(object_id) for object_id in added if str(object_id) in self.known
+            ]
+            marked = 0
+            for project in projects:
+                marked = marked + supabase_bulk.update_ids(
+                    self.client,
+                    self.table_name(),
+                    self.id_column,
+                    removed,
+                    {
+                        "removed_at": datetime.datetime.now(
+                            datetime.timezone.utc
+                        ).isoformat()
+                    },
+                    project=project,
+                )
+                supabase_bulk.update_ids(
+                    self.client,
+                    self.table_name(),
+                    self.id_column,
+                    returned,
+                    {"removed_at": None},
+                    project=project,
+                )
+            self.metrics.count("objects_removed", marked)
+            line = "%s: %d added, %d removed, %d listed again" % (
+                self.name,
+                len(added),
+                len(removed),
+                len(returned),
+            )
+            print(line)
+            log.info(line)
+            if marked < len(removed):
+                # Keep the old snapshot, the next run marks them again
+                return
+        oa_listing.save(file_path, current)
+
+    def set_new_to_false(self):
+        data = {
+            "new": False,
+        }
+        (
+            self.client.table(self.table_name())
+            .update(data)
+            .eq("new", "True")
+            .eq("project", self.engine.project)
+            .execute()
+        )
+
+    #
+    # Called after all objects are written
+    #
+    def finish(self):
+        pass
+
+    #
+    # Columns for the DailyStats row of a region, None if the entity has no
+    # statistics
+    #
+    def daily_stats(self, area):
+        return None
+
+    #
+    # Listed objects of a region (the merged listing if there is only one)
+    #
+    def region_listing(self, area):
+        return self.region_listings.get(area, self.listed)
+
+
+class Trails(Entity):
+    name = "trails"
+    kind = "tour"
+    listing = "filter/tour"
+    script = "trailKM_supabase"
+    table = "Trails"
+    id_column = "trail_id"
+    schema = oa_schema.TRAIL
+    project_filter = True
+    known_columns = ["duration", "distance", "region_name", "date_lastModified"]
+    # New and changed trails are written with one upsert per chunk
+    on_conflict = "trail_id,project"
+    tombstones = True
+
+    def __init__(self, engine):
+        super().__init__(engine)
+        self.stats_table = engine.prefix + "DailyStats"
+        self.total_duration_minutes = 0
+        self.total_length_meters = 0
+        # Trails written in this run, for the rollups and the snapshot
+        self.synced = {}
+        self.rollup_dimensions = oa_rollup.read_dimensions(engine.config)
+        if self.rollup_dimensions is not None:
+            # The rollups are computed from the stored values read by the diff
+            self.known_columns = self.known_columns + [
+                d for d in self.rollup_dimensions if d not in self.known_columns
+            ]
+
+    def table_name(self):
+        return self.engine.prefix + self.table
+
+    def diff(self, entries):
+        self.load_known()
+        new_trails = []
+        changed_trails = []
+        for trail_id in entries.ids():
+            stored_trail = self.known.get(trail_id)
+            if stored_trail is not None:
+                # Trail already in database
+                self.total_duration_minutes = self.total_duration_minutes + int(
+                    stored_trail["duration"]
+                )
+                self.total_length_meters = self.total_length_meters + float(
+                    stored_trail["distance"]
+                )
+                if str(stored_trail["region_name"]) == "None":
+                    changed_trails.append(trail_id)
+            else:
+                new_trails.append(trail_id)
+        changed = set(changed_trails)
+        modified = [
+            trail_id for trail_id in self.modified(entries) if trail_id not in changed
+        ]
+        self.unverified = self.unverified - changed
+        return new_trails + changed_trails + modified
+
+    #
+    # New trails count in the totals as well
+    #
+    def insert(self, data):
+        super().insert(data)
+        self.add_totals(data, 1)
+        self.synced[data["trail_id"]] = data
+
+    #
+    # The upsert on (trail_id, project) updates the stored row, the totals
+    # change by the difference to the stored values
+    #
+    def update(self, data):
+        print("Updating trail " + data["trail_id"])
+        data["new"] = False
+        self.writer.add(data)
+        self.add_totals(self.known[data["trail_id"]], -1)
+        self.add_totals(data, 1)
+        self.synced[data["trail_id"]] = data
+
+    def add_totals(self, data, sign):
+        try:
+            duration = int(data["duration"] or 0)
+            distance = float(data["distance"] or 0)
+        except (KeyError, TypeError, ValueError):
+            return
+        self.total_duration_minutes = self.total_duration_minutes + sign * duration
+        self.total_length_meters = self.total_length_meters + sign * distance
+
+    def finish(self):
+        snapshot_settings = oa_snapshot.read_settings(self.engine.config)
+        if self.rollup_dimensions is None and snapshot_settings is None:
+            return
+        records = self.listed_records()
+        if self.rollup_dimensions is not None:
+            for area in self.engine.regions:
+                if len(self.engine.regions) == 1:
+                    self.write_rollups(records, area)
+                else:
+                    listing = self.region_listing(area)
+                    self.write_rollups(self.listed_records(listing), area)
+        if snapshot_settings is not None and len(records) < len(self.listed):
+            # Trails that were not stored would be missing in the totals
+            line = "Snapshot not written, %d listed trails not stored" % (
+                len(self.listed) - len(records)
+            )
+            print(line)
+            log.warning(line)
+        elif snapshot_settings is not None and self.engine.first:
+            # Read by trailKM.py instead of the API
+            oa_snapshot.write(
+                snapshot_settings["path"],
+                records,
+                self.engine.project,
+                "+".join(str(area) for area in self.engine.regions),
+            )
+
+    #
+    # Listed trails (of a region listing) with their stored values,
+    # overlaid with the ones written in this run
+    #
+    def listed_records(self, listing=None):
+        self.load_all_known()
+        records = []
+        for trail_id in (self.listed if listing is None else listing).ids():
+            record = self.synced.get(trail_id) or self.known.get(trail_id)
+            if record is not None:
+                records.append(dict(record, trail_id=trail_id))
+        return records
+
+    #
+    # Group the trails by the [Rollup] dimensions and store one row per group
+    # The rows are upserted on their key, then the rows of an earlier run
+    # of today whose group has no trails any more are deleted (only if all
+    # chunks were stored, so a failed upsert never leaves the day empty)
+    #
+    def write_rollups(self, records, area):
+        rows = oa_rollup.rollup(records, self.rollup_dimensions)
+        table = self.engine.prefix + "TrailRollups"
+        today = self.engine.today.isoformat()
+        stored = list(
+            supabase_bulk.iter_rows(
+                self.client,
+                table,
+                "id",
+                project=self.engine.project,
+                columns=["id", "dimension", "value"],
+                filters={"date": today, "region": str(area)},
+            )
+        )
+        writer = supabase_bulk.UpsertWriter(
+            self.client,
+            table,
+            "date,project,region,dimension,value",
+            chunk_size=self.engine.batch_size,
+        )
+        groups = set()
+        for row in rows:
+            row["date"] = today
+            row["project"] = self.engine.project
+            row["region"] = str(area)
+            groups.add((row["dimension"], row["value"]))
+            writer.add(row)
+        if writer.close():
+            return
+        gone = [
+            row["id"]
+            for row in stored
+            if (row["dimension"], row["value"]) not in groups
+        ]
+        supabase_bulk.delete_ids(self.client, table, "id", gone)
+
+    #
+    # Totals of the stored trails, from the trail_totals RPC
+    # (sql/TrailTotals.sql) or, without it, from the totals kept by this run
+    # (summed from the stored rows after a resume). The RPC counts every
+    # stored row without removed_at, so it is only asked with [Tombstones]
+    #
+    def daily_stats(self, area):
+        listing = self.region_listing(area)
+        if listing is not self.listed:
+            # A trail listed in several regions is stored with the first
+            # one only, the totals of a region come from its listing
+            return self.listing_totals(listing)
+        total_trails = len(self.listed)
+        totals = None
+        if self.engine.tombstone_settings is not None:
+            try:
+                totals = (
+                    self.client.rpc(
+                        self.engine.prefix + "trail_totals",
+                        {
+                            "p_project": self.engine.project,
+                            "p_region": str(area),
+                        },
+                    )
+                    .execute()
+                    .data
+                )
+            except Exception as e:
+                log.warning(
+                    "trail_totals not available, totals of this run used: %s" % e
+                )
+        if totals:
+            total_trails = int(totals[0]["total_trails"])
+            self.total_length_meters = float(totals[0]["total_distance"])
+            self.total_duration_minutes = int(totals[0]["total_duration"])
+        elif self.checkpoint is not None and self.checkpoint.resumed:
+            return self.listing_totals(self.listed)
+        return {
+            "total_trails": total_trails,
+            "total_distance": int(self.total_length_meters / 1000),
+            "total_duration": str(timedelta(minutes=self.total_duration_minutes)),
+        }
+
+    def listing_totals(self, listing):
+        meters = 0
+        minutes = 0
+        for record in self.listed_records(listing):
+            try:
+                minutes = minutes + int(record["duration"] or 0)
+                meters = meters + float(record["distance"] or 0)
+            except (KeyError, TypeError, ValueError):
+                continue
+        return {
+            "total_trails": len(listing),
+            "total_distance": int(meters / 1000),
+            "total_duration": str(timedelta(minutes=minutes)),
+        }
+
+
+class POIs(Entity):
+    name = "pois"
+    kind = "poi"
+    listing = "pois"
+    script = "POIs_supabase"
+    table = "POIs"
+    id_column = "poi_id"
+    schema = oa_schema.POI
+    tombstones = True
+
+    def daily_stats(self, area):
+        return {"total_pois": len(self.region_listing(area))}
+
+
+class Events(Entity):
+    name = "events"
+    kind = "event"
+    listing = "events"
+    script = "events_supabase"
+    table = "events"
+    id_column = "event_id"
+    schema = oa_schema.EVENT
+    tombstones = True
+
+    def daily_stats(self, area):
+        return {"total_events": len(self.region_listing(area))}
+
+
+class Conditions(Entity):
+    name = "conditions"
+    kind = "condition"
+    listing = "conditions"
+    script = "conditions_supabase"
+    table = "Conditions"
+    id_column = "condition_id"
+    schema = oa_schema.CONDITION
+    lang = "ro"
+
+    def __init__(self, engine):
+        super().__init__(engine)
+        # date_lastModified is not in the original Conditions table, it is
+        # only read and written in [Sync] Mode=Delta (which needs the column)
+        self.delta = engine.sync_mode == oa_delta.MODE_DELTA
+        # The status finds the rejected conditions that are listed again
+        self.known_columns = ["status"]
+        if self.delta:
+            self.known_columns = ["status", "date_lastModified"]
+
+    def params(self, object_id):
+        return {"object_id": object_id, "project": self.engine.project}
+
+    #
+    # Rejected conditions that are listed again are fetched as well, their
+    # status is taken from the document again
+    #
+    def diff(self, entries):
+        pending = super().diff(entries)
+        queued = set(pending)
+        return pending + [
+            condition_id
+            for condition_id in self.relisted()
+            if condition_id not in queued
+        ]
+
+    #
+    # Listed conditions stored with status "rejected"
+    #
+    def relisted(self):
+        relisted = [
+            condition_id
+            for condition_id in self.listed.ids()
+            if self.known.get(condition_id, {}).get("status") == REJECTED
+        ]
+        if relisted:
+            line = "Conditions: %d %s conditions listed again" % (
+                len(relisted),
+                REJECTED,
+            )
+            print(line)
+            log.info(line)
+        return relisted
+
+    def insert(self, data):
+        print("Inserting condition " + data["condition_id"])
+        if not self.delta:
+            data.pop("date_lastModified", None)
+        self.writer.add(data)
+
+    def update(self, data):
+        if not self.delta:
+            data.pop("date_lastModified", None)
+        super().update(data)
+
+    def finish(self):
+        self.status_stored_conditions()
+
+    #
+    # The relisted conditions are the only objects a reconcile fetches
+    #
+    def reconcile(self):
+        log.info("%s: reconcile start" % self.name)
+        if self.list_objects():
+            self.load_known()
+            relisted = self.engine.claim(self, self.relisted())
+            for object_id, data in self.extracted(self.fetch(relisted)):
+                self.write(object_id, data)
+            self.writer.close()
+            self.status_stored_conditions()
+            self.completed = True
+        log.info("%s: reconcile end" % self.name)
+
+    #
+    # Conditions stored for the project that are no longer listed are marked
+    # "rejected": the stored IDs are loaded page by page and diffed against
+    # the listing as sets, the vanished ones are updated in bulk. With
+    # several targets the first one checks the conditions of all projects
+    # against all listings (see reconciled_listing())
+    #
+    def status_stored_conditions(self):
+        if not self.listed:
+            # An empty listing is more likely an API problem than no conditions
+            log.warning("No conditions listed, stored conditions left unchanged")
+            return 0
+        reconciled = self.reconciled_listing()
+        if reconciled is None:
+            return 0
+        listed, projects, keys = reconciled
+        listed = set(listed)
+        stored = 0
+        expired = 0
+        for project in projects:
+            rows = supabase_bulk.load_known_ids(
+                self.client,
+                self.table_name(),
+                self.id_column,
+                project=project,
+                columns=["status"],
+            )
+            vanished = [
+                condition_id
+                for condition_id, row in rows.items()
+                if condition_id not in listed and row.get("status") != REJECTED
+            ]
+            stored = stored + len(rows)
+            expired = expired + supabase_bulk.update_ids(
+                self.client,
+                self.table_name(),
+                self.id_column,
+                vanished,
+                {"status": REJECTED},
+                project=project,
+            )
+        self.metrics.count("objects_expired", expired)
+        line = "Conditions: %d stored, %d listed, %d expired (marked %s)" % (
+            stored,
+            len(listed),
+            expired,
+            REJECTED,
+        )
+        print(line)
+        log.info(line)
+        return expired
+
+
+# Entities by command line name, in the order they are started
+ENTITIES = {entity.name: entity for entity in [Trails, POIs, Events, Conditions]}
+
+
+def check_completed(entities):
+    failed = [entity.thread_name() for entity in entities if not entity.completed]
+    if failed:
+        line = "Failed: %s" % ", ".join(failed)
+        print("ERROR:", line)
+        log.error(line)
+    return not failed
+
+
+def check_operation_result(response, entity_name, operation):
+    if len(response.data) > 0:
+        print(f"{entity_name} {operation}ed successfully.")
+    else:
+        print(f"Failed to {operation} {entity_name}.")
+        print(f"Error: {response.error}")
+
+
+#
+# (project, API key, regions) of the run: the [Interface] project and
+# region, or with a [Targets] section one project and region per line,
+# the API key of [Interface] unless the line names one
+#   [Targets]
+#   List=
+#       myproject 0
+#       myproject 1234
+#       otherproject 0 otherkey
+#
+def read_targets(config):
+    interface = config["Interface"]
+    key = interface["OUTDOORACTIVE_API"]
+    if not config.has_section("Targets"):
+        return [
+            (
+                interface["OUTDOORACTIVE_PROJECT"],
+                key,
+                [interface.get("OUTDOORACTIVE_REGION", 0)],
+            )
+        ]
+    targets = {}
+    for line in config["Targets"].get("List", "").splitlines():
+        fields = line.split()
+        if not fields:
+            continue
+        project = fields[0]
+        region = fields[1] if len(fields) > 1 else "0"
+        target = targets.setdefault(
+            project, {"key": fields[2] if len(fields) > 2 else key, "regions": []}
+        )
+        if region not in target["regions"]:
+            target["regions"].append(region)
+    return [
+        (project, target["key"], target["regions"])
+        for project, target in targets.items()
+    ]
+
+
+#
+# Read initialization parameters
+#
+def read_config(config_file):
+    print("Config file: " + config_file)
+    config = configparser.ConfigParser()
+    try:
+        config.read(config_file)
+    except Exception as err:
+        print("Cannot read INI file due to Error: %s" % (str(err)))
+    return config
+
+
+def start_log(config, names):
+    log.basicConfig(
+        filename=config["Log"]["File"],
+        level=os.environ.get("LOGLEVEL", config["Log"]["Level"]),
+        format="%(asctime)s [%(levelname)s] %(threadName)s %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S ",
+    )
+    log.info("===============================")
+    log.info(
+        "Program start: " + str(datetime.datetime.today().strftime("%Y-%m-%d %H:%M"))
+    )
+    log.info("Entities: " + ", ".join(names))
+    log.info("===============================")
+
+
+def check_names(names):
+    for name in names:
+        if name not in ENTITIES:
+            print("Unknown entity %s, use one of: %s" % (name, ", ".join(ENTITIES)))
+            sys.exit(1)
+
+
+#
+# Sync (stage "run") or reconcile the given entities, all if empty
+#
+def execute(config, names, stage="run"):
+    names = names or list(ENTITIES)
+    check_names(names)
+    start_log(config, names)
+    completed = getattr(Engine(config), stage)(names)
+    print(
+        str(datetime.datetime.today().strftime("%Y-%m-%d %H:%M"))
+        + " [END] "
+        + ", ".join(names)
+    )
+    if not completed:
+        sys.exit(1)
+
+
+#
+# Entry point of sync_engine.py and of the *_supabase scripts
+# names are the entities to run, by default the ones given on the command line
+#
+def main(names=None):
+    args = sys.argv[1:]
+    config_file = "config.ini"
+    if args and args[0] not in ENTITIES:
+        config_file = args.pop(0)
+    if names is None:
+        names = args
+    check_names(names)
+    execute(read_config(config_file), names)
+
+
+if __name__ == "__main__":
+    main()
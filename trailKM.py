@@ -17,92 +17,138 @@
 #####################################################################
 
 import configparser
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-import datetime
 from datetime import timedelta
 import logging as log
+import math
 import os
-from random import randint
-import time
-import xmltodict
+import oa_cache
+import oa_listing
+import oa_rate
+import oa_snapshot
+import oa_transport
+import oa_stream
 import sys
 
 # global variables
 number_of_trails = 0
 total_duration_minutes = 0
 total_length_meters = 0
+# Values of every counted trail, for the snapshot
+trail_records = {}
+# Trails whose document could not be read, no snapshot is written then
+failed_reads = 0
 
-try:
-    config_file = sys.argv[1]
-except:
-    config_file = "config.ini"
-
-# Read initialization parameters
-config = configparser.ConfigParser()
-try:
-    config.read(config_file)
-except Exception as err:
-    print("Cannot read INI file due to Error: %s" % (str(err)))
-
-OA_PROJECT = config["Interface"]["OUTDOORACTIVE_PROJECT"]
-OA_KEY = config["Interface"]["OUTDOORACTIVE_API"]
-try:
-    OA_AREA = config["Interface"]["OUTDOORACTIVE_REGION"]
-except:
-    OA_AREA = 0
-
-log.basicConfig(
-    filename=config["Log"]["File"],
-    level=os.environ.get("LOGLEVEL", config["Log"]["Level"]),
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S ",
-)
-
-# Improve https connection handling, see article:
-# https://stackoverflow.com/questions/23013220/max-retries-exceeded-with-url-in-requests
+# Set by configure()
+config = None
+OA_PROJECT = None
+OA_KEY = None
+OA_URL = None
+OA_AREA = 0
+PARSER_MODE = None
+SNAPSHOT_SETTINGS = None
+session = None
+transport = None
+limiter = None
+
+
+#
+# Read initialization parameters, start the log and create the HTTP session
+# (importing the module has no side effects, see trailkm_cli.py)
 #
-session = requests.Session()
-retry = Retry(connect=3, backoff_factor=0.5)
-adapter = HTTPAdapter(max_retries=retry)
-session.mount("http://", adapter)
-session.mount("https://", adapter)
+def configure(config_file="config.ini"):
+    global config, OA_PROJECT, OA_KEY, OA_URL, OA_AREA, PARSER_MODE
+    global SNAPSHOT_SETTINGS, session, transport, limiter
+
+    config = configparser.ConfigParser()
+    try:
+        config.read(config_file)
+    except Exception as err:
+        print("Cannot read INI file due to Error: %s" % (str(err)))
+
+    OA_PROJECT = config["Interface"]["OUTDOORACTIVE_PROJECT"]
+    OA_KEY = config["Interface"]["OUTDOORACTIVE_API"]
+    OA_URL = (
+        config["Interface"]
+        .get("OUTDOORACTIVE_URL", "https://www.outdooractive.com/api/project/")
+        .rstrip("/")
+    )
+    try:
+        OA_AREA = config["Interface"]["OUTDOORACTIVE_REGION"]
+    except:
+        OA_AREA = 0
+    PARSER_MODE = oa_stream.read_mode(config, "trailKM")
+    SNAPSHOT_SETTINGS = oa_snapshot.read_settings(config)
+
+    log.basicConfig(
+        filename=config["Log"]["File"],
+        level=os.environ.get("LOGLEVEL", config["Log"]["Level"]),
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S ",
+    )
+
+    # Improve https connection handling, see article:
+    # https://stackoverflow.com/questions/23013220/max-retries-exceeded-with-url-in-requests
+    #
+    # GET responses go through the on-disk cache if [Cache] is configured
+    session = oa_cache.CachedSession(config)
+    # Timeouts, retries with jitter and circuit breaker, see [Transport]
+    transport = oa_transport.mount(session, config)
+
+    # Paces the detail requests, see [Wait] in config.ini
+    limiter = oa_rate.read_limiter(config)
 
 
 #
 # Wait according to seetings in config.ini (try not to send too many requests in a too short time)
 #
 def wait():
-    if config["Action"]["Execute"] == "Delay":
-        # Include a waiting period, so the algorithm doesn't think it's automatic processing
-        t = randint(int(config["Wait"]["Min"]), int(config["Wait"]["Max"]))
-        time.sleep(t)
+    limiter.wait()
 
 
 #
 # Return map region type and name based on region id
+# With a snapshot only the trails missing in it or modified since are read,
+# the others are counted with their snapshot values
 #
-def get_region_data():
+def get_region_data(snapshot=None):
     global number_of_trails
+    global total_duration_minutes
+    global total_length_meters
 
-    url = (
-        "https://www.outdooractive.com/api/project/"
-        + OA_PROJECT
-        + "/filter/tour"
-        + "?key="
-        + OA_KEY
-    )
+    url = OA_URL + "/" + OA_PROJECT + "/filter/tour" + "?key=" + OA_KEY
     if OA_AREA != 0:
         url = url + "&area=" + OA_AREA
 
     log.debug("Get region URL:" + url)
-    region_xml = xmltodict.parse(session.get(url).text)
-    trails = region_xml["datalist"]["data"]
+    # IDs and lastModified only, the parsed listing is not kept
+    trails = oa_listing.read(session.get(url, stream=True), PARSER_MODE)
     number_of_trails = len(trails)
 
-    for trail in trails:
-        read_trail_data(trail["@id"])
+    stored = snapshot.entries() if snapshot is not None else {}
+    for trail_id, last_modified in trails.items():
+        entry = stored.get(trail_id)
+        if entry is None or is_stale(last_modified, entry):
+            read_trail_data(trail_id)
+            continue
+        distance, duration, modified = entry
+        total_duration_minutes = total_duration_minutes + int(duration)
+        total_length_meters = total_length_meters + distance
+        trail_records[trail_id] = {
+            "trail_id": trail_id,
+            "distance": distance,
+            "duration": duration,
+            "date_lastModified": modified,
+        }
+
+
+#
+# The listing shows a newer lastModified than the snapshot
+# (without lastModified in the listing only new trails are read)
+#
+def is_stale(modified, entry):
+    if math.isnan(modified):
+        return False
+    return math.isnan(entry[2]) or modified > entry[2]
 
 
 #
@@ -112,10 +158,12 @@ def read_trail_data(trail):
     global trail_xml
     global total_duration_minutes
     global total_length_meters
+    global failed_reads
 
     wait()
     url = (
-        "https://www.outdooractive.com/api/project/"
+        OA_URL
+        + "/"
         + OA_PROJECT
         + "/oois/"
         + str(trail)
@@ -126,9 +174,15 @@ def read_trail_data(trail):
     log.debug("Condition URL:" + url)
 
     try:
-        trail_xml = xmltodict.parse(session.get(url).text)
-    except:
+        response = session.get(url)
+        limiter.feedback(response.status_code, response.headers.get("Retry-After"))
+        response.raise_for_status()
+        trail_xml = oa_stream.read_document(response, PARSER_MODE)
+    except Exception as e:
+        transport.failed(e)
+        failed_reads = failed_reads + 1
         print("ERROR")
+        return
 
     try:
         duration_minutes = trail_xml["oois"]["tour"]["time"]["@min"]
@@ -140,16 +194,74 @@ def read_trail_data(trail):
     except:
         length_meters = 0
 
+    try:
+        last_modified = trail_xml["oois"]["tour"]["meta"]["date"]["@lastModified"]
+    except:
+        last_modified = None
+
     total_duration_minutes = total_duration_minutes + int(duration_minutes)
     total_length_meters = total_length_meters + float(length_meters)
+    trail_records[trail] = {
+        "trail_id": trail,
+        "distance": length_meters,
+        "duration": duration_minutes,
+        "date_lastModified": last_modified,
+    }
 
 
+#
+# Totals from a snapshot that is younger than [Snapshot] MaxAge, otherwise
+# the stale entries are refreshed and a new snapshot is written
+#
 def main():
-    get_region_data()
+    global number_of_trails, total_duration_minutes, total_length_meters
+
+    snapshot = None
+    if SNAPSHOT_SETTINGS is not None:
+        snapshot = oa_snapshot.load(SNAPSHOT_SETTINGS["path"])
+    if snapshot is not None and not snapshot.matches(OA_PROJECT, OA_AREA):
+        # Written for another project or region (e.g. by a [Targets] sync)
+        log.info("Snapshot of another project or region, not used")
+        snapshot.close()
+        snapshot = None
+    if snapshot is not None and snapshot.age() < SNAPSHOT_SETTINGS["max_age"]:
+        number_of_trails, total_length_meters, total_duration_minutes = (
+            snapshot.totals()
+        )
+        total_duration_minutes = int(total_duration_minutes)
+        snapshot.close()
+        print("From snapshot %s" % SNAPSHOT_SETTINGS["path"])
+        print_totals()
+        return
+
+    get_region_data(snapshot)
+    if snapshot is not None:
+        snapshot.close()
+    if SNAPSHOT_SETTINGS is not None and failed_reads:
+        # The snapshot would count fewer trails than the listing from now on
+        line = "Snapshot not written, %d trails could not be read" % failed_reads
+        print(line)
+        log.warning(line)
+    elif SNAPSHOT_SETTINGS is not None:
+        oa_snapshot.write(
+            SNAPSHOT_SETTINGS["path"], trail_records.values(), OA_PROJECT, OA_AREA
+        )
+    session.print_cache_stats()
+    limiter.print_summary()
+    transport.print_report()
+    print_totals()
+
+
+def print_totals():
     print("Number of trails: %d" % number_of_trails)
     print("Number of kilometers: %.1f" % int(total_length_meters / 1000))
     print("Total duration: %s" % str(timedelta(minutes=total_duration_minutes))[:-3])
 
 
 if __name__ == "__main__":
+    try:
+        config_file = sys.argv[1]
+    except:
+        config_file = "config.ini"
+    configure(config_file)
     main()
@@ -0,0 +1,185 @@
+#####################################################################
+# Call:
+# python trailkm_cli.py [-c ini_file.ini] <command> [options]
+#   stats [--refresh]                 - trail totals from the snapshot
+#   sync [trails] [pois] [events] [conditions]
+#   reconcile [trails] [pois] [events] [conditions]
+#   export <entity> [--format csv|json] [--output file] [--all-projects]
+#   ini_file.ini - is optional, by default it is config.ini
+#
+# One entry point for the scripts of this repository. Only argparse and
+# configparser are imported at start, every command imports what it
+# needs when it runs, and the HTTP session and the storage client of
+# sync_engine are created on first use. So "stats" and "--help" start
+# without loading requests, xmltodict or supabase, and all modules can
+# be imported as a library without reading config.ini.
+#
+#   stats      - totals of the trail snapshot and the listing snapshots
+#                of [Tombstones] (no request); --refresh counts through
+#                trailKM.py when the snapshot is older than [Snapshot]
+#                MaxAge (or there is no [Snapshot] section)
+#   sync       - sync_engine run of the given entities (all if none)
+#   reconcile  - only checks the stored rows against the listings:
+#                tombstones of trails, POIs and events ([Tombstones]),
+#                expired conditions; only rejected conditions that are
+#                listed again are fetched
+#   export     - stored rows of an entity as CSV or JSON (stdout or
+#                --output), trails of [Interface] OUTDOORACTIVE_PROJECT
+#                unless --all-projects
+#
+#####################################################################
+# Version: 0.1.0
+# Email: paul.wasicsek@gmail.com
+# Status: dev
+#####################################################################
+
+import argparse
+import configparser
+import sys
+
+ENTITY_NAMES = ["trails", "pois", "events", "conditions"]
+FORMATS = ["csv", "json"]
+
+
+def read_config(config_file):
+    config = configparser.ConfigParser()
+    try:
+        config.read(config_file)
+    except Exception as err:
+        print("Cannot read INI file due to Error: %s" % (str(err)))
+    return config
+
+
+def stats(options):
+    if options.refresh:
+        import trailKM
+
+        trailKM.configure(options.config)
+        trailKM.main()
+        return
+    import oa_listing
+    import oa_snapshot
+
+    config = read_config(options.config)
+    snapshot_settings = oa_snapshot.read_settings(config) or {
+        "path": oa_snapshot.SNAPSHOT_PATH
+    }
+    if not oa_snapshot.print_snapshot(snapshot_settings):
+        print("Run 'sync trails' or 'stats --refresh' to write one")
+    listing_settings = oa_listing.read_settings(config)
+    if listing_settings is not None:
+        oa_listing.print_snapshots(listing_settings)
+
+
+def sync(options):
+    import sync_engine
+
+    sync_engine.execute(sync_engine.read_config(options.config), options.entities)
+
+
+def reconcile(options):
+    import sync_engine
+
+    sync_engine.execute(
+        sync_engine.read_config(options.config), options.entities, "reconcile"
+    )
+
+
+def export(options):
+    import sync_engine
+    import supabase_bulk
+
+    config = read_config(options.config)
+    sync_engine.start_log(config, [options.entity])
+    engine = sync_engine.Engine(config)
+    entity = sync_engine.ENTITIES[options.entity](engine)
+    project = None
+    if entity.project_filter and not options.all_projects:
+        project = engine.project
+    rows = supabase_bulk.iter_rows(
+        engine.client, entity.table_name(), entity.id_column, project=project
+    )
+    output = open(options.output, "w", newline="") if options.output else sys.stdout
+    try:
+        count = write_rows(rows, output, options.format)
+    finally:
+        if options.output:
+            output.close()
+    if options.output:
+        print(
+            "%d rows of %s written to %s" % (count, entity.table_name(), options.output)
+        )
+
+
+#
+# Write the rows as they are read, returns the number of rows
+#
+def write_rows(rows, output, format):
+    import json
+
+    count = 0
+    if format == "json":
+        output.write("[")
+        for row in rows:
+            output.write(",\n" if count else "\n")
+            output.write(json.dumps(row, default=str))
+            count = count + 1
+        output.write("\n]\n")
+        return count
+    import csv
+
+    writer = None
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(output, fieldnames=list(row), extrasaction="ignore")
+            writer.writeheader()
+        writer.writerow(row)
+        count = count + 1
+    return count
+
+
+def parser():
+    parser = argparse.ArgumentParser(
+        prog="trailkm", description="Outdooractive statistics and sync"
+    )
+    parser.add_argument("-c", "--config", default="config.ini", help="ini file")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+
+    command = commands.add_parser("stats", help="trail totals from the snapshot")
+    command.add_argument(
+        "--refresh", action="store_true", help="refresh a stale snapshot via the API"
+    )
+    command.set_defaults(run=stats)
+
+    for name, run, description in [
+        ("sync", sync, "sync entities into the database"),
+        ("reconcile", reconcile, "mark stored rows that left the listing"),
+    ]:
+        command = commands.add_parser(name, help=description)
+        command.add_argument(
+            "entities",
+            nargs="*",
+            metavar="entity",
+            help="%s (all if none)" % ", ".join(ENTITY_NAMES),
+        )
+        command.set_defaults(run=run)
+
+    command = commands.add_parser("export", help="write stored rows as CSV or JSON")
+    command.add_argument("entity", choices=ENTITY_NAMES)
+    command.add_argument("--format", choices=FORMATS, default="csv")
+    command.add_argument("--output", help="file, default stdout")
+    command.add_argument(
+        "--all-projects", action="store_true", help="trails of all projects"
+    )
+    command.set_defaults(run=export)
+    return parser
+
+
+def main(args=None):
+    options = parser().parse_args(args)
+    options.run(options)
+
+
+if __name__ == "__main__":
+    main()